@@ -4,12 +4,14 @@ import signal
 import sys
 import atexit
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
 import os
 from dotenv import load_dotenv
 
 from .handlers import start, restaurant_owner, partner, payments, admin, broadcasts
-from .middlewares import AntiSpamMiddleware, ErrorMonitorMiddleware
+from .middlewares import AntiSpamMiddleware, DbSessionMiddleware, ErrorMonitorMiddleware, ReachabilityMiddleware
+from .services.rate_limiter import create_limiter_backend
+from .services.alerts import alerts
+from .services.fsm_storage import create_fsm_storage
 
 # Load environment variables
 load_dotenv()
@@ -75,9 +77,16 @@ async def main():
     
     # Initialize bot and dispatcher
     bot = Bot(token=BOT_TOKEN)
-    storage = MemoryStorage()
+    # FSM state survives restarts when REDIS_URL is set; abandoned states expire per state group
+    storage = create_fsm_storage()
     dp = Dispatcher(storage=storage)
     
+    # One database session per update, shared by all handlers and helpers it runs
+    dp.update.middleware(DbSessionMiddleware())
+    
+    # Background queue for admin alerts, so middlewares never wait on the Telegram API
+    alerts.start(bot, ADMIN_ID)
+    
     # Register error monitoring middleware (should be first to catch all errors)
     error_monitor = ErrorMonitorMiddleware()
     dp.message.middleware(error_monitor)
@@ -93,9 +102,18 @@ async def main():
     dp.chat_member.middleware(error_monitor)
     dp.chat_join_request.middleware(error_monitor)
     
-    # Register anti-spam middlewares with different limits for different event types
-    dp.message.middleware(AntiSpamMiddleware(rate_limit=3, time_window=3))
-    dp.callback_query.middleware(AntiSpamMiddleware(rate_limit=5, time_window=3))
+    # Register one anti-spam middleware for messages and callbacks: a single per-user budget
+    # with weighted costs per update kind. Limits are shared between bot instances when REDIS_URL is set
+    anti_spam = AntiSpamMiddleware(rate_limit=5, time_window=3, backend=create_limiter_backend(), name="user")
+    dp.message.middleware(anti_spam)
+    dp.callback_query.middleware(anti_spam)
+    
+    # Clear the unreachable flag for users who write to the bot again or unblock it
+    reachability = ReachabilityMiddleware()
+    dp.message.middleware(reachability)
+    dp.callback_query.middleware(reachability)
+    # No handler listens to my_chat_member, so an inner middleware would never run there
+    dp.my_chat_member.outer_middleware(reachability)
     
     # Register routers
     dp.include_router(start.router)
@@ -136,6 +154,12 @@ async def main():
         await polling_task
     except asyncio.CancelledError:
         logging.info("Polling task cancelled")
+    
+    # Flush pending FSM state before exit
+    await storage.close()
+    
+    # Deliver queued admin alerts and the final digest while the bot session is still open
+    await alerts.close()
 
 def setup_signal_handlers():
     """Setup signal handlers for graceful shutdown"""
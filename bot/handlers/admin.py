@@ -4,9 +4,15 @@ from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from sqlalchemy import func, select, desc
-from ..models.base import async_session
+from sqlalchemy.ext.asyncio import AsyncSession
 from ..models.models import User, Restaurant, MenuItem, Donation, Order
+from ..services.telegram_errors import handler_error_counts, HANDLER_ERROR_LABELS
+from ..services.fsm_storage import CachedStorage
+from ..services.query_stats import query_stats
+from ..services.identity import identity_cache
+from ..services.menu import menu_cache
 from datetime import datetime, timedelta
+from functools import lru_cache
 import os
 import logging
 
@@ -23,7 +29,8 @@ ADMIN_ID = int(os.getenv("ADMIN_ID", "5385155120"))
 def is_admin(telegram_id):
     return telegram_id == ADMIN_ID
 
-# Клавиатура админ-панели
+# Клавиатура админ-панели (собирается один раз)
+@lru_cache(maxsize=None)
 def get_admin_keyboard():
     kb = [
         [
@@ -78,316 +85,349 @@ async def admin_refresh(callback: CallbackQuery):
             await callback.answer("Ошибка при обновлении")
 
 @router.callback_query(F.data == "admin_users")
-async def admin_users(callback: CallbackQuery):
+async def admin_users(callback: CallbackQuery, session: AsyncSession):
     if not is_admin(callback.from_user.id):
         await callback.answer("У вас нет доступа к этой функции")
         return
     
-    async with async_session() as session:
-        # Получаем статистику пользователей
-        total_users = await session.scalar(select(func.count()).select_from(User))
-        
-        # Активные пользователи за последние 24 часа
-        last_day = datetime.utcnow() - timedelta(days=1)
-        active_users_query = select(func.count()).select_from(User).where(User.last_activity >= last_day)
-        last_day_active = await session.scalar(active_users_query) or 0
-        
-        # Пользователи с ресторанами
-        restaurant_owners = await session.scalar(
-            select(func.count()).select_from(User).where(User.is_restaurant_owner == True)
-        )
-        
-        # Пользователи, подключенные к ресторанам
-        connected_users = await session.scalar(
-            select(func.count()).select_from(User).where(User.current_restaurant_id != None)
-        )
-        
-        # Новые пользователи за 24 часа
-        new_users_query = select(func.count()).select_from(User).where(User.created_at >= last_day)
-        last_registered = await session.scalar(new_users_query) or 0
-        
-        # Получаем 5 последних пользователей
-        recent_users_query = select(User).order_by(desc(User.created_at)).limit(5)
-        result = await session.execute(recent_users_query)
-        recent_users = result.scalars().all()
+    # Получаем статистику пользователей
+    total_users = await session.scalar(select(func.count()).select_from(User))
+    
+    # Активные пользователи за последние 24 часа
+    last_day = datetime.utcnow() - timedelta(days=1)
+    active_users_query = select(func.count()).select_from(User).where(User.last_activity >= last_day)
+    last_day_active = await session.scalar(active_users_query) or 0
+    
+    # Пользователи с ресторанами
+    restaurant_owners = await session.scalar(
+        select(func.count()).select_from(User).where(User.is_restaurant_owner == True)
+    )
+    
+    # Пользователи, подключенные к ресторанам
+    connected_users = await session.scalar(
+        select(func.count()).select_from(User).where(User.current_restaurant_id != None)
+    )
+    
+    # Новые пользователи за 24 часа
+    new_users_query = select(func.count()).select_from(User).where(User.created_at >= last_day)
+    last_registered = await session.scalar(new_users_query) or 0
+    
+    # Получаем 5 последних пользователей
+    recent_users_query = select(User).order_by(desc(User.created_at)).limit(5)
+    result = await session.execute(recent_users_query)
+    recent_users = result.scalars().all()
 
-        recent_users_text = ""
-        for i, user in enumerate(recent_users, 1):
-            try:
-                # Получаем информацию о пользователе из Telegram
-                user_info = await callback.bot.get_chat(user.telegram_id)
-                username = user_info.username or "Нет username"
-                fullname = user_info.full_name or "Без имени"
-                user_display = f"{fullname}" + (f" (@{username})" if username != "Нет username" else "")
-                recent_users_text += f"{i}. {user_display}\n   🆔 ID: {user.telegram_id}, создан: {user.created_at.strftime('%d.%m.%Y %H:%M')}\n"
-            except Exception as e:
-                logging.error(f"Failed to get user info: {e}")
-                recent_users_text += f"{i}. ID: {user.telegram_id}, создан: {user.created_at.strftime('%d.%m.%Y %H:%M')}\n"
-        
-        text = (
-            "👥 Статистика пользователей:\n\n"
-            f"Всего пользователей: {total_users}\n"
-            f"Активных за 24 часа: {last_day_active}\n"
-            f"Владельцев ресторанов: {restaurant_owners}\n"
-            f"Подключены к ресторанам: {connected_users}\n"
-            f"Новых за 24 часа: {last_registered}\n\n"
-            "Последние пользователи:\n"
-            f"{recent_users_text}\n"
-            "Выберите действие:"
-        )
-        
-        kb = [
-            [InlineKeyboardButton(text="📑 Список всех пользователей", callback_data="admin_all_users")],
-            [InlineKeyboardButton(text="📱 Поиск по ID", callback_data="admin_search_user")],
-            [InlineKeyboardButton(text="◀️ Назад", callback_data="admin_back")]
-        ]
-        
+    recent_users_text = ""
+    for i, user in enumerate(recent_users, 1):
         try:
-            await callback.message.edit_text(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=kb))
+            # Получаем информацию о пользователе из Telegram
+            user_info = await callback.bot.get_chat(user.telegram_id)
+            username = user_info.username or "Нет username"
+            fullname = user_info.full_name or "Без имени"
+            user_display = f"{fullname}" + (f" (@{username})" if username != "Нет username" else "")
+            recent_users_text += f"{i}. {user_display}\n   🆔 ID: {user.telegram_id}, создан: {user.created_at.strftime('%d.%m.%Y %H:%M')}\n"
         except Exception as e:
-            logging.error(f"Error editing message in admin_users: {e}")
-            # Если сообщение нельзя отредактировать, отправляем новое
-            await callback.message.answer(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=kb))
+            logging.error(f"Failed to get user info: {e}")
+            recent_users_text += f"{i}. ID: {user.telegram_id}, создан: {user.created_at.strftime('%d.%m.%Y %H:%M')}\n"
+    
+    text = (
+        "👥 Статистика пользователей:\n\n"
+        f"Всего пользователей: {total_users}\n"
+        f"Активных за 24 часа: {last_day_active}\n"
+        f"Владельцев ресторанов: {restaurant_owners}\n"
+        f"Подключены к ресторанам: {connected_users}\n"
+        f"Новых за 24 часа: {last_registered}\n\n"
+        "Последние пользователи:\n"
+        f"{recent_users_text}\n"
+        "Выберите действие:"
+    )
+    
+    kb = [
+        [InlineKeyboardButton(text="📑 Список всех пользователей", callback_data="admin_all_users")],
+        [InlineKeyboardButton(text="📱 Поиск по ID", callback_data="admin_search_user")],
+        [InlineKeyboardButton(text="◀️ Назад", callback_data="admin_back")]
+    ]
+    
+    try:
+        await callback.message.edit_text(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=kb))
+    except Exception as e:
+        logging.error(f"Error editing message in admin_users: {e}")
+        # Если сообщение нельзя отредактировать, отправляем новое
+        await callback.message.answer(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=kb))
 
 @router.callback_query(F.data == "admin_restaurants")
-async def admin_restaurants(callback: CallbackQuery):
+async def admin_restaurants(callback: CallbackQuery, session: AsyncSession):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("У вас нет доступа к этой функции")
+        return
+    
+    total_restaurants = await session.scalar(select(func.count()).select_from(Restaurant))
+    
+    # Получаем список недавно созданных ресторанов
+    recent_restaurants_query = select(Restaurant, User).join(
+        User, Restaurant.owner_id == User.id
+    ).order_by(desc(Restaurant.created_at)).limit(5)
+    
+    result = await session.execute(recent_restaurants_query)
+    recent_restaurants = result.all()
+    
+    # Подсчет меню-позиций для всех ресторанов
+    total_menu_items = await session.scalar(select(func.count()).select_from(MenuItem))
+    
+    text = (
+        "🏠 Статистика ресторанов:\n\n"
+        f"Всего ресторанов: {total_restaurants}\n"
+        f"Всего позиций в меню: {total_menu_items}\n\n"
+        "Недавно созданные рестораны:\n"
+    )
+    
+    if recent_restaurants:
+        for i, (restaurant, owner) in enumerate(recent_restaurants, 1):
+            menu_count = await session.scalar(
+                select(func.count()).select_from(MenuItem).where(
+                    MenuItem.restaurant_id == restaurant.id
+                )
+            )
+            
+            # Получаем информацию о владельце из Telegram
+            try:
+                owner_info = await callback.bot.get_chat(owner.telegram_id)
+                username = owner_info.username or "Нет username"
+                fullname = owner_info.full_name or "Без имени"
+                owner_display = f"{fullname}" + (f" (@{username})" if username != "Нет username" else "")
+            except Exception as e:
+                logging.error(f"Failed to get owner info: {e}")
+                owner_display = f"ID: {owner.telegram_id}"
+            
+            text += (
+                f"{i}. '{restaurant.name}'\n"
+                f"   Владелец: {owner_display} (ID: {owner.telegram_id})\n"
+                f"   Создан: {restaurant.created_at.strftime('%d.%m.%Y')}\n"
+                f"   Позиций в меню: {menu_count}\n"
+            )
+    else:
+        text += "Нет ресторанов\n"
+    
+    kb = [
+        [InlineKeyboardButton(text="📑 Список всех ресторанов", callback_data="admin_all_restaurants")],
+        [InlineKeyboardButton(text="◀️ Назад", callback_data="admin_back")]
+    ]
+    
+    try:
+        await callback.message.edit_text(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=kb))
+    except Exception as e:
+        logging.error(f"Error editing message in admin_restaurants: {e}")
+        # Если не удалось отредактировать сообщение, отправляем новое
+        await callback.message.answer(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=kb))
+
+@router.callback_query(F.data == "admin_orders")
+async def admin_orders(callback: CallbackQuery, session: AsyncSession):
     if not is_admin(callback.from_user.id):
         await callback.answer("У вас нет доступа к этой функции")
         return
     
-    async with async_session() as session:
-        total_restaurants = await session.scalar(select(func.count()).select_from(Restaurant))
+    # Проверяем существование таблицы Order
+    try:
+        # Получаем общее количество заказов
+        total_orders = await session.scalar(select(func.count()).select_from(Order))
         
-        # Получаем список недавно созданных ресторанов
-        recent_restaurants_query = select(Restaurant, User).join(
-            User, Restaurant.owner_id == User.id
-        ).order_by(desc(Restaurant.created_at)).limit(5)
+        # Заказы за последние 24 часа
+        last_day = datetime.utcnow() - timedelta(days=1)
+        recent_orders = await session.scalar(
+            select(func.count()).select_from(Order).where(
+                Order.created_at >= last_day
+            )
+        ) or 0
         
-        result = await session.execute(recent_restaurants_query)
-        recent_restaurants = result.all()
+        # Получаем последние 5 заказов с деталями
+        recent_orders_query = select(Order, User, Restaurant).join(
+            User, Order.user_id == User.id
+        ).join(
+            Restaurant, Order.restaurant_id == Restaurant.id
+        ).order_by(desc(Order.created_at)).limit(5)
         
-        # Подсчет меню-позиций для всех ресторанов
-        total_menu_items = await session.scalar(select(func.count()).select_from(MenuItem))
+        result = await session.execute(recent_orders_query)
+        last_orders = result.all()
         
         text = (
-            "🏠 Статистика ресторанов:\n\n"
-            f"Всего ресторанов: {total_restaurants}\n"
-            f"Всего позиций в меню: {total_menu_items}\n\n"
-            "Недавно созданные рестораны:\n"
+            "💘 Статистика заказов:\n\n"
+            f"Всего заказов: {total_orders}\n"
+            f"Заказов за 24 часа: {recent_orders}\n\n"
+            "Последние заказы:\n"
         )
         
-        if recent_restaurants:
-            for i, (restaurant, owner) in enumerate(recent_restaurants, 1):
-                menu_count = await session.scalar(
-                    select(func.count()).select_from(MenuItem).where(
-                        MenuItem.restaurant_id == restaurant.id
-                    )
-                )
-                
-                # Получаем информацию о владельце из Telegram
+        if last_orders:
+            for i, (order, user, restaurant) in enumerate(last_orders, 1):
+                # Получаем информацию о пользователе из Telegram
                 try:
-                    owner_info = await callback.bot.get_chat(owner.telegram_id)
-                    username = owner_info.username or "Нет username"
-                    fullname = owner_info.full_name or "Без имени"
-                    owner_display = f"{fullname}" + (f" (@{username})" if username != "Нет username" else "")
+                    user_info = await callback.bot.get_chat(user.telegram_id)
+                    username = user_info.username or "Нет username"
+                    fullname = user_info.full_name or "Без имени"
+                    user_display = f"{fullname}" + (f" (@{username})" if username != "Нет username" else "")
                 except Exception as e:
-                    logging.error(f"Failed to get owner info: {e}")
-                    owner_display = f"ID: {owner.telegram_id}"
+                    logging.error(f"Failed to get user info: {e}")
+                    user_display = f"ID: {user.telegram_id}"
                 
                 text += (
-                    f"{i}. '{restaurant.name}'\n"
-                    f"   Владелец: {owner_display} (ID: {owner.telegram_id})\n"
-                    f"   Создан: {restaurant.created_at.strftime('%d.%m.%Y')}\n"
-                    f"   Позиций в меню: {menu_count}\n"
+                    f"{i}. Ресторан: '{restaurant.name}'\n"
+                    f"   Пользователь: {user_display} (ID: {user.telegram_id})\n"
+                    f"   Сумма: {order.total_kisses or 0} поцелуев, {order.total_hugs or 0} мин обнимашек\n"
+                    f"   Дата: {order.created_at.strftime('%d.%m.%Y %H:%M')}\n"
                 )
         else:
-            text += "Нет ресторанов\n"
-        
-        kb = [
-            [InlineKeyboardButton(text="📑 Список всех ресторанов", callback_data="admin_all_restaurants")],
-            [InlineKeyboardButton(text="◀️ Назад", callback_data="admin_back")]
-        ]
-        
-        try:
-            await callback.message.edit_text(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=kb))
-        except Exception as e:
-            logging.error(f"Error editing message in admin_restaurants: {e}")
-            # Если не удалось отредактировать сообщение, отправляем новое
-            await callback.message.answer(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=kb))
-
-@router.callback_query(F.data == "admin_orders")
-async def admin_orders(callback: CallbackQuery):
-    if not is_admin(callback.from_user.id):
-        await callback.answer("У вас нет доступа к этой функции")
-        return
+            text += "Нет заказов\n"
+    except Exception as e:
+        logging.error(f"Error querying orders: {e}")
+        text = (
+            "💘 Статистика заказов:\n\n"
+            "В настоящее время информация о заказах недоступна.\n"
+            "Заказы обрабатываются в реальном времени через колбэки.\n\n"
+        )
     
-    async with async_session() as session:
-        # Проверяем существование таблицы Order
-        try:
-            # Получаем общее количество заказов
-            total_orders = await session.scalar(select(func.count()).select_from(Order))
-            
-            # Заказы за последние 24 часа
-            last_day = datetime.utcnow() - timedelta(days=1)
-            recent_orders = await session.scalar(
-                select(func.count()).select_from(Order).where(
-                    Order.created_at >= last_day
-                )
-            ) or 0
-            
-            # Получаем последние 5 заказов с деталями
-            recent_orders_query = select(Order, User, Restaurant).join(
-                User, Order.user_id == User.id
-            ).join(
-                Restaurant, Order.restaurant_id == Restaurant.id
-            ).order_by(desc(Order.created_at)).limit(5)
-            
-            result = await session.execute(recent_orders_query)
-            last_orders = result.all()
-            
-            text = (
-                "💘 Статистика заказов:\n\n"
-                f"Всего заказов: {total_orders}\n"
-                f"Заказов за 24 часа: {recent_orders}\n\n"
-                "Последние заказы:\n"
-            )
-            
-            if last_orders:
-                for i, (order, user, restaurant) in enumerate(last_orders, 1):
-                    # Получаем информацию о пользователе из Telegram
-                    try:
-                        user_info = await callback.bot.get_chat(user.telegram_id)
-                        username = user_info.username or "Нет username"
-                        fullname = user_info.full_name or "Без имени"
-                        user_display = f"{fullname}" + (f" (@{username})" if username != "Нет username" else "")
-                    except Exception as e:
-                        logging.error(f"Failed to get user info: {e}")
-                        user_display = f"ID: {user.telegram_id}"
-                    
-                    text += (
-                        f"{i}. Ресторан: '{restaurant.name}'\n"
-                        f"   Пользователь: {user_display} (ID: {user.telegram_id})\n"
-                        f"   Сумма: {order.total_kisses or 0} поцелуев, {order.total_hugs or 0} мин обнимашек\n"
-                        f"   Дата: {order.created_at.strftime('%d.%m.%Y %H:%M')}\n"
-                    )
-            else:
-                text += "Нет заказов\n"
-        except Exception as e:
-            logging.error(f"Error querying orders: {e}")
-            text = (
-                "💘 Статистика заказов:\n\n"
-                "В настоящее время информация о заказах недоступна.\n"
-                "Заказы обрабатываются в реальном времени через колбэки.\n\n"
-            )
-        
-        kb = [
-            [InlineKeyboardButton(text="◀️ Назад", callback_data="admin_back")]
-        ]
-        
-        try:
-            await callback.message.edit_text(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=kb))
-        except Exception as e:
-            logging.error(f"Error editing message in admin_orders: {e}")
-            # Если не удалось отредактировать сообщение, отправляем новое
-            await callback.message.answer(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=kb))
+    kb = [
+        [InlineKeyboardButton(text="◀️ Назад", callback_data="admin_back")]
+    ]
+    
+    try:
+        await callback.message.edit_text(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=kb))
+    except Exception as e:
+        logging.error(f"Error editing message in admin_orders: {e}")
+        # Если не удалось отредактировать сообщение, отправляем новое
+        await callback.message.answer(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=kb))
 
 @router.callback_query(F.data == "admin_donations")
-async def admin_donations(callback: CallbackQuery):
+async def admin_donations(callback: CallbackQuery, session: AsyncSession):
     if not is_admin(callback.from_user.id):
         await callback.answer("У вас нет доступа к этой функции")
         return
     
-    async with async_session() as session:
-        # Статистика донатов
-        total_donations = await session.scalar(select(func.count()).select_from(Donation))
-        total_amount = await session.scalar(select(func.sum(Donation.amount)).select_from(Donation)) or 0
-        
-        # Последние донаты
-        recent_donations_query = select(Donation, User).join(User).order_by(desc(Donation.created_at)).limit(5)
-        result = await session.execute(recent_donations_query)
-        recent_donations = result.all()
-        
-        text = (
-            "⭐ Статистика донатов:\n\n"
-            f"Всего пожертвований: {total_donations}\n"
-            f"Сумма: {total_amount} звезд\n\n"
-            "Последние пожертвования:\n"
-        )
-        
-        for i, (donation, user) in enumerate(recent_donations, 1):
-            # Получаем информацию о пользователе из Telegram
-            try:
-                user_info = await callback.bot.get_chat(user.telegram_id)
-                username = user_info.username or "Нет username"
-                fullname = user_info.full_name or "Без имени"
-                user_display = f"{fullname}" + (f" (@{username})" if username != "Нет username" else "")
-            except Exception as e:
-                logging.error(f"Failed to get user info: {e}")
-                user_display = f"ID: {user.telegram_id}"
-                
-            comment_text = donation.comment if donation.comment else "без комментария"
-            donation_text = (
-                f"{i}. {user_display} (ID: {user.telegram_id})\n"
-                f"   Сумма: {donation.amount} звезд\n"
-                f"   Комментарий: {comment_text[:30]}\n"
-                f"   Дата: {donation.created_at.strftime('%d.%m.%Y %H:%M')}\n"
-            )
-            text += donation_text
-        
-        if not recent_donations:
-            text += "Пока нет пожертвований\n"
-        
-        kb = [
-            [InlineKeyboardButton(text="◀️ Назад", callback_data="admin_back")]
-        ]
-        
+    # Статистика донатов
+    total_donations = await session.scalar(select(func.count()).select_from(Donation))
+    total_amount = await session.scalar(select(func.sum(Donation.amount)).select_from(Donation)) or 0
+    
+    # Последние донаты
+    recent_donations_query = select(Donation, User).join(User).order_by(desc(Donation.created_at)).limit(5)
+    result = await session.execute(recent_donations_query)
+    recent_donations = result.all()
+    
+    text = (
+        "⭐ Статистика донатов:\n\n"
+        f"Всего пожертвований: {total_donations}\n"
+        f"Сумма: {total_amount} звезд\n\n"
+        "Последние пожертвования:\n"
+    )
+    
+    for i, (donation, user) in enumerate(recent_donations, 1):
+        # Получаем информацию о пользователе из Telegram
         try:
-            await callback.message.edit_text(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=kb))
+            user_info = await callback.bot.get_chat(user.telegram_id)
+            username = user_info.username or "Нет username"
+            fullname = user_info.full_name or "Без имени"
+            user_display = f"{fullname}" + (f" (@{username})" if username != "Нет username" else "")
         except Exception as e:
-            logging.error(f"Error editing message in admin_donations: {e}")
-            # Если не удалось отредактировать сообщение, отправляем новое
-            await callback.message.answer(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=kb))
+            logging.error(f"Failed to get user info: {e}")
+            user_display = f"ID: {user.telegram_id}"
+            
+        comment_text = donation.comment if donation.comment else "без комментария"
+        donation_text = (
+            f"{i}. {user_display} (ID: {user.telegram_id})\n"
+            f"   Сумма: {donation.amount} звезд\n"
+            f"   Комментарий: {comment_text[:30]}\n"
+            f"   Дата: {donation.created_at.strftime('%d.%m.%Y %H:%M')}\n"
+        )
+        text += donation_text
+    
+    if not recent_donations:
+        text += "Пока нет пожертвований\n"
+    
+    kb = [
+        [InlineKeyboardButton(text="◀️ Назад", callback_data="admin_back")]
+    ]
+    
+    try:
+        await callback.message.edit_text(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=kb))
+    except Exception as e:
+        logging.error(f"Error editing message in admin_donations: {e}")
+        # Если не удалось отредактировать сообщение, отправляем новое
+        await callback.message.answer(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=kb))
 
 @router.callback_query(F.data == "admin_stats")
-async def admin_stats(callback: CallbackQuery):
+async def admin_stats(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
     if not is_admin(callback.from_user.id):
         await callback.answer("У вас нет доступа к этой функции")
         return
     
     # Собираем статистику
-    async with async_session() as session:
-        # Статистика пользователей
-        total_users = await session.scalar(select(func.count()).select_from(User))
-        
-        # Активные пользователи за последние 24 часа
-        last_day = datetime.utcnow() - timedelta(days=1)
-        active_users_query = select(func.count()).select_from(User).where(User.last_activity >= last_day)
-        last_day_active = await session.scalar(active_users_query) or 0
-        
-        # Рестораны
-        total_restaurants = await session.scalar(select(func.count()).select_from(Restaurant))
-        
-        # Позиции в меню
-        total_menu_items = await session.scalar(select(func.count()).select_from(MenuItem))
-        
-        # Заказы
-        total_orders = await session.scalar(select(func.count()).select_from(Order))
-        
-        # Донаты
-        total_donations = await session.scalar(select(func.count()).select_from(Donation))
-        total_donation_amount = await session.scalar(select(func.sum(Donation.amount)).select_from(Donation)) or 0
-        
-        text = (
-            "📊 Общая статистика бота:\n\n"
-            f"👥 Всего пользователей: {total_users}\n"
-            f"👥 Активных за 24 часа: {last_day_active}\n\n"
-            f"🏠 Всего ресторанов: {total_restaurants}\n"
-            f"🍔 Всего позиций в меню: {total_menu_items}\n\n"
-            f"💘 Всего заказов: {total_orders}\n\n"
-            f"⭐ Всего пожертвований: {total_donations}\n"
-            f"⭐ На сумму: {total_donation_amount} звезд\n"
+    # Статистика пользователей
+    total_users = await session.scalar(select(func.count()).select_from(User))
+    
+    # Активные пользователи за последние 24 часа
+    last_day = datetime.utcnow() - timedelta(days=1)
+    active_users_query = select(func.count()).select_from(User).where(User.last_activity >= last_day)
+    last_day_active = await session.scalar(active_users_query) or 0
+    
+    # Рестораны
+    total_restaurants = await session.scalar(select(func.count()).select_from(Restaurant))
+    
+    # Позиции в меню
+    total_menu_items = await session.scalar(select(func.count()).select_from(MenuItem))
+    
+    # Заказы
+    total_orders = await session.scalar(select(func.count()).select_from(Order))
+    
+    # Донаты
+    total_donations = await session.scalar(select(func.count()).select_from(Donation))
+    total_donation_amount = await session.scalar(select(func.sum(Donation.amount)).select_from(Donation)) or 0
+    
+    text = (
+        "📊 Общая статистика бота:\n\n"
+        f"👥 Всего пользователей: {total_users}\n"
+        f"👥 Активных за 24 часа: {last_day_active}\n\n"
+        f"🏠 Всего ресторанов: {total_restaurants}\n"
+        f"🍔 Всего позиций в меню: {total_menu_items}\n\n"
+        f"💘 Всего заказов: {total_orders}\n\n"
+        f"⭐ Всего пожертвований: {total_donations}\n"
+        f"⭐ На сумму: {total_donation_amount} звезд\n"
+    )
+    
+    # Некритичные ошибки Telegram API с момента запуска (лишние запросы к API)
+    if handler_error_counts:
+        text += "\n🗑 Лишние запросы к API с момента запуска:\n"
+        for kind, count in handler_error_counts.most_common():
+            text += f"   {HANDLER_ERROR_LABELS.get(kind, kind)}: {count}\n"
+    
+    # Нагрузка на БД от обработки обновлений
+    if query_stats.updates:
+        text += (
+            f"\n🗄 Запросов к БД на обновление: в среднем {query_stats.average:.1f}, "
+            f"максимум {query_stats.max_queries}\n"
+        )
+    
+    # Кэш снимков пользователей
+    if identity_cache.hits or identity_cache.misses:
+        text += (
+            f"👤 Кэш пользователей: {len(identity_cache)} записей, "
+            f"попаданий {identity_cache.hit_rate:.0%} ({identity_cache.hits}/{identity_cache.hits + identity_cache.misses}), "
+            f"сбросов {identity_cache.invalidations}\n"
         )
     
+    # Кэш меню ресторанов
+    if menu_cache.hits or menu_cache.misses:
+        text += (
+            f"🍽 Кэш меню: {len(menu_cache)} ресторанов, "
+            f"попаданий {menu_cache.hit_rate:.0%} ({menu_cache.hits}/{menu_cache.hits + menu_cache.misses})\n"
+        )
+    
+    # Память, занятая состояниями FSM, по группам состояний
+    if isinstance(state.storage, CachedStorage):
+        fsm_stats = state.storage.memory_stats()
+        if fsm_stats:
+            total_count = sum(count for count, _ in fsm_stats.values())
+            total_size = sum(size for _, size in fsm_stats.values())
+            text += f"\n🧠 Состояния в памяти: {total_count} (~{total_size // 1024} КБ), сброшено брошенных: {state.storage.expired}\n"
+            for group, (count, size) in sorted(fsm_stats.items(), key=lambda item: item[1][1], reverse=True):
+                text += f"   {group}: {count} (~{size // 1024} КБ)\n"
+    
     kb = [
         [InlineKeyboardButton(text="◀️ Назад", callback_data="admin_back")]
     ]
@@ -400,7 +440,7 @@ async def admin_stats(callback: CallbackQuery):
         await callback.message.answer(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=kb))
 
 @router.callback_query(F.data == "admin_all_users")
-async def admin_all_users(callback: CallbackQuery, state: FSMContext):
+async def admin_all_users(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
     if not is_admin(callback.from_user.id):
         await callback.answer("У вас нет доступа к этой функции")
         return
@@ -412,105 +452,104 @@ async def admin_all_users(callback: CallbackQuery, state: FSMContext):
     users_per_page = 10
     offset = (page - 1) * users_per_page
     
-    async with async_session() as session:
-        # Получаем общее количество пользователей
-        total_users = await session.scalar(select(func.count()).select_from(User))
+    # Получаем общее количество пользователей
+    total_users = await session.scalar(select(func.count()).select_from(User))
+    
+    # Получаем пользователей для текущей страницы
+    users_query = select(User).order_by(desc(User.created_at)).offset(offset).limit(users_per_page)
+    result = await session.execute(users_query)
+    users = result.scalars().all()
+    
+    # Общее количество страниц
+    total_pages = (total_users + users_per_page - 1) // users_per_page
+    
+    text = f"👥 Список пользователей (страница {page} из {total_pages}):\n\n"
+    
+    for i, user in enumerate(users, offset + 1):
+        # Определяем статус пользователя
+        status = []
+        if user.is_restaurant_owner:
+            status.append("владелец")
+        if user.current_restaurant_id:
+            status.append("подключен")
         
-        # Получаем пользователей для текущей страницы
-        users_query = select(User).order_by(desc(User.created_at)).offset(offset).limit(users_per_page)
-        result = await session.execute(users_query)
-        users = result.scalars().all()
+        status_text = ", ".join(status) if status else "обычный"
+        last_activity = user.last_activity.strftime("%d.%m.%Y %H:%M") if user.last_activity else "нет данных"
         
-        # Общее количество страниц
-        total_pages = (total_users + users_per_page - 1) // users_per_page
+        # Получаем информацию о пользователе из Telegram
+        try:
+            user_info = await callback.bot.get_chat(user.telegram_id)
+            username = user_info.username or "Нет username"
+            fullname = user_info.full_name or "Без имени"
+            user_display = f"{fullname}" + (f" (@{username})" if username != "Нет username" else "")
+        except Exception as e:
+            logging.error(f"Failed to get user info: {e}")
+            user_display = f"ID: {user.telegram_id}"
         
-        text = f"👥 Список пользователей (страница {page} из {total_pages}):\n\n"
+        # Добавляем базовую информацию
+        user_info_text = (
+            f"{i}. {user_display}\n"
+            f"   🆔 ID: {user.telegram_id}\n"
+            f"   📊 Статус: {status_text}\n"
+        )
         
-        for i, user in enumerate(users, offset + 1):
-            # Определяем статус пользователя
-            status = []
-            if user.is_restaurant_owner:
-                status.append("владелец")
-            if user.current_restaurant_id:
-                status.append("подключен")
-            
-            status_text = ", ".join(status) if status else "обычный"
-            last_activity = user.last_activity.strftime("%d.%m.%Y %H:%M") if user.last_activity else "нет данных"
-            
-            # Получаем информацию о пользователе из Telegram
-            try:
-                user_info = await callback.bot.get_chat(user.telegram_id)
-                username = user_info.username or "Нет username"
-                fullname = user_info.full_name or "Без имени"
-                user_display = f"{fullname}" + (f" (@{username})" if username != "Нет username" else "")
-            except Exception as e:
-                logging.error(f"Failed to get user info: {e}")
-                user_display = f"ID: {user.telegram_id}"
-            
-            # Добавляем базовую информацию
-            user_info_text = (
-                f"{i}. {user_display}\n"
-                f"   🆔 ID: {user.telegram_id}\n"
-                f"   📊 Статус: {status_text}\n"
-            )
-            
-            # Если пользователь владелец ресторана, добавляем информацию о его ресторане
-            if user.is_restaurant_owner:
-                # Получаем ресторан пользователя
-                restaurant_query = select(Restaurant).where(Restaurant.owner_id == user.id)
-                result = await session.execute(restaurant_query)
-                restaurant = result.scalar_one_or_none()
-                
-                if restaurant:
-                    user_info_text += f"   🍴 Владеет рестораном: '{restaurant.name}' (ID: {restaurant.id})\n"
-            
-            # Если пользователь подключен к ресторану, добавляем информацию об этом ресторане
-            if user.current_restaurant_id:
-                # Получаем ресторан, к которому подключен пользователь
-                connected_query = select(Restaurant).where(Restaurant.id == user.current_restaurant_id)
-                result = await session.execute(connected_query)
-                connected_restaurant = result.scalar_one_or_none()
-                
-                if connected_restaurant:
-                    user_info_text += f"   🔑 Подключен к ресторану: '{connected_restaurant.name}' (ID: {connected_restaurant.id})\n"
-            
-            # Добавляем информацию о регистрации и активности
-            user_info_text += (
-                f"   📅 Регистрация: {user.created_at.strftime('%d.%m.%Y')}\n"
-                f"   ⏱ Активность: {last_activity}\n\n"
-            )
+        # Если пользователь владелец ресторана, добавляем информацию о его ресторане
+        if user.is_restaurant_owner:
+            # Получаем ресторан пользователя
+            restaurant_query = select(Restaurant).where(Restaurant.owner_id == user.id)
+            result = await session.execute(restaurant_query)
+            restaurant = result.scalar_one_or_none()
             
-            text += user_info_text
-        
-        # Кнопки пагинации
-        kb = []
-        
-        # Добавляем кнопки навигации
-        nav_buttons = []
-        
-        if page > 1:
-            nav_buttons.append(InlineKeyboardButton(text="◀️ Назад", callback_data="admin_users_prev"))
-        
-        if page < total_pages:
-            nav_buttons.append(InlineKeyboardButton(text="Вперед ▶️", callback_data="admin_users_next"))
-        
-        if nav_buttons:
-            kb.append(nav_buttons)
+            if restaurant:
+                user_info_text += f"   🍴 Владеет рестораном: '{restaurant.name}' (ID: {restaurant.id})\n"
         
-        kb.append([InlineKeyboardButton(text="🔙 В меню пользователей", callback_data="admin_users")])
+        # Если пользователь подключен к ресторану, добавляем информацию об этом ресторане
+        if user.current_restaurant_id:
+            # Получаем ресторан, к которому подключен пользователь
+            connected_query = select(Restaurant).where(Restaurant.id == user.current_restaurant_id)
+            result = await session.execute(connected_query)
+            connected_restaurant = result.scalar_one_or_none()
+            
+            if connected_restaurant:
+                user_info_text += f"   🔑 Подключен к ресторану: '{connected_restaurant.name}' (ID: {connected_restaurant.id})\n"
         
-        # Сохраняем текущую страницу в состоянии
-        await state.update_data(users_page=page)
+        # Добавляем информацию о регистрации и активности
+        user_info_text += (
+            f"   📅 Регистрация: {user.created_at.strftime('%d.%m.%Y')}\n"
+            f"   ⏱ Активность: {last_activity}\n\n"
+        )
         
-        try:
-            await callback.message.edit_text(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=kb))
-        except Exception as e:
-            logging.error(f"Error editing message: {e}")
-            # Если не удалось отредактировать сообщение, отправляем новое
-            await callback.message.answer(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=kb))
+        text += user_info_text
+    
+    # Кнопки пагинации
+    kb = []
+    
+    # Добавляем кнопки навигации
+    nav_buttons = []
+    
+    if page > 1:
+        nav_buttons.append(InlineKeyboardButton(text="◀️ Назад", callback_data="admin_users_prev"))
+    
+    if page < total_pages:
+        nav_buttons.append(InlineKeyboardButton(text="Вперед ▶️", callback_data="admin_users_next"))
+    
+    if nav_buttons:
+        kb.append(nav_buttons)
+    
+    kb.append([InlineKeyboardButton(text="🔙 В меню пользователей", callback_data="admin_users")])
+    
+    # Сохраняем текущую страницу в состоянии
+    await state.update_data(users_page=page)
+    
+    try:
+        await callback.message.edit_text(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=kb))
+    except Exception as e:
+        logging.error(f"Error editing message: {e}")
+        # Если не удалось отредактировать сообщение, отправляем новое
+        await callback.message.answer(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=kb))
 
 @router.callback_query(F.data == "admin_users_prev")
-async def admin_users_prev_page(callback: CallbackQuery, state: FSMContext):
+async def admin_users_prev_page(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
     if not is_admin(callback.from_user.id):
         await callback.answer("У вас нет доступа к этой функции")
         return
@@ -520,12 +559,12 @@ async def admin_users_prev_page(callback: CallbackQuery, state: FSMContext):
     
     if current_page > 1:
         await state.update_data(users_page=current_page - 1)
-        await admin_all_users(callback, state)
+        await admin_all_users(callback, state, session=session)
     else:
         await callback.answer("Вы уже на первой странице")
 
 @router.callback_query(F.data == "admin_users_next")
-async def admin_users_next_page(callback: CallbackQuery, state: FSMContext):
+async def admin_users_next_page(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
     if not is_admin(callback.from_user.id):
         await callback.answer("У вас нет доступа к этой функции")
         return
@@ -533,19 +572,18 @@ async def admin_users_next_page(callback: CallbackQuery, state: FSMContext):
     data = await state.get_data()
     current_page = data.get('users_page', 1)
     
-    async with async_session() as session:
-        total_users = await session.scalar(select(func.count()).select_from(User))
-        users_per_page = 10
-        total_pages = (total_users + users_per_page - 1) // users_per_page
-        
-        if current_page < total_pages:
-            await state.update_data(users_page=current_page + 1)
-            await admin_all_users(callback, state)
-        else:
-            await callback.answer("Вы уже на последней странице")
+    total_users = await session.scalar(select(func.count()).select_from(User))
+    users_per_page = 10
+    total_pages = (total_users + users_per_page - 1) // users_per_page
+    
+    if current_page < total_pages:
+        await state.update_data(users_page=current_page + 1)
+        await admin_all_users(callback, state, session=session)
+    else:
+        await callback.answer("Вы уже на последней странице")
 
 @router.callback_query(F.data == "admin_all_restaurants")
-async def admin_all_restaurants(callback: CallbackQuery, state: FSMContext):
+async def admin_all_restaurants(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
     if not is_admin(callback.from_user.id):
         await callback.answer("У вас нет доступа к этой функции")
         return
@@ -557,90 +595,89 @@ async def admin_all_restaurants(callback: CallbackQuery, state: FSMContext):
     restaurants_per_page = 5
     offset = (page - 1) * restaurants_per_page
     
-    async with async_session() as session:
-        # Получаем общее количество ресторанов
-        total_restaurants = await session.scalar(select(func.count()).select_from(Restaurant))
-        
-        # Получаем рестораны для текущей страницы с владельцами
-        restaurants_query = select(Restaurant, User).join(
-            User, Restaurant.owner_id == User.id
-        ).order_by(desc(Restaurant.created_at)).offset(offset).limit(restaurants_per_page)
-        
-        result = await session.execute(restaurants_query)
-        restaurants_with_owners = result.all()
-        
-        # Общее количество страниц
-        total_pages = (total_restaurants + restaurants_per_page - 1) // restaurants_per_page
-        
-        text = f"🏠 Список ресторанов (страница {page} из {total_pages}):\n\n"
-        
-        for i, (restaurant, owner) in enumerate(restaurants_with_owners, offset + 1):
-            # Получаем количество позиций в меню
-            menu_count = await session.scalar(
-                select(func.count()).select_from(MenuItem).where(
-                    MenuItem.restaurant_id == restaurant.id
-                )
-            )
-            
-            # Получаем информацию о владельце из Telegram
-            try:
-                owner_info = await callback.bot.get_chat(owner.telegram_id)
-                username = owner_info.username or "Нет username"
-                fullname = owner_info.full_name or "Без имени"
-                owner_display = f"{fullname}" + (f" (@{username})" if username != "Нет username" else "")
-            except Exception as e:
-                logging.error(f"Failed to get owner info: {e}")
-                owner_display = f"ID: {owner.telegram_id}"
-            
-            # Считаем количество подключенных клиентов
-            clients_count = await session.scalar(
-                select(func.count()).select_from(User).where(
-                    User.current_restaurant_id == restaurant.id
-                )
-            )
-            
-            text += (
-                f"{i}. '{restaurant.name}'\n"
-                f"   👤 Владелец: {owner_display}\n"
-                f"   🆔 ID владельца: {owner.telegram_id}\n"
-                f"   🔑 Код приглашения: {restaurant.invite_code}\n"
-                f"   📋 Позиций в меню: {menu_count}\n"
-                f"   👥 Подключенных клиентов: {clients_count}\n"
-                f"   📅 Создан: {restaurant.created_at.strftime('%d.%m.%Y %H:%M')}\n\n"
+    # Получаем общее количество ресторанов
+    total_restaurants = await session.scalar(select(func.count()).select_from(Restaurant))
+    
+    # Получаем рестораны для текущей страницы с владельцами
+    restaurants_query = select(Restaurant, User).join(
+        User, Restaurant.owner_id == User.id
+    ).order_by(desc(Restaurant.created_at)).offset(offset).limit(restaurants_per_page)
+    
+    result = await session.execute(restaurants_query)
+    restaurants_with_owners = result.all()
+    
+    # Общее количество страниц
+    total_pages = (total_restaurants + restaurants_per_page - 1) // restaurants_per_page
+    
+    text = f"🏠 Список ресторанов (страница {page} из {total_pages}):\n\n"
+    
+    for i, (restaurant, owner) in enumerate(restaurants_with_owners, offset + 1):
+        # Получаем количество позиций в меню
+        menu_count = await session.scalar(
+            select(func.count()).select_from(MenuItem).where(
+                MenuItem.restaurant_id == restaurant.id
             )
+        )
         
-        if not restaurants_with_owners:
-            text += "Нет ресторанов\n"
-        
-        # Кнопки пагинации
-        kb = []
-        
-        # Добавляем кнопки навигации
-        nav_buttons = []
-        
-        if page > 1:
-            nav_buttons.append(InlineKeyboardButton(text="◀️ Назад", callback_data="admin_restaurants_prev"))
-        
-        if page < total_pages:
-            nav_buttons.append(InlineKeyboardButton(text="Вперед ▶️", callback_data="admin_restaurants_next"))
-        
-        if nav_buttons:
-            kb.append(nav_buttons)
-        
-        kb.append([InlineKeyboardButton(text="🔙 В меню ресторанов", callback_data="admin_restaurants")])
-        
-        # Сохраняем текущую страницу в состоянии
-        await state.update_data(restaurants_page=page)
-        
+        # Получаем информацию о владельце из Telegram
         try:
-            await callback.message.edit_text(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=kb))
+            owner_info = await callback.bot.get_chat(owner.telegram_id)
+            username = owner_info.username or "Нет username"
+            fullname = owner_info.full_name or "Без имени"
+            owner_display = f"{fullname}" + (f" (@{username})" if username != "Нет username" else "")
         except Exception as e:
-            logging.error(f"Error editing message in admin_all_restaurants: {e}")
-            # Если не удалось отредактировать сообщение, отправляем новое
-            await callback.message.answer(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=kb))
+            logging.error(f"Failed to get owner info: {e}")
+            owner_display = f"ID: {owner.telegram_id}"
+        
+        # Считаем количество подключенных клиентов
+        clients_count = await session.scalar(
+            select(func.count()).select_from(User).where(
+                User.current_restaurant_id == restaurant.id
+            )
+        )
+        
+        text += (
+            f"{i}. '{restaurant.name}'\n"
+            f"   👤 Владелец: {owner_display}\n"
+            f"   🆔 ID владельца: {owner.telegram_id}\n"
+            f"   🔑 Код приглашения: {restaurant.invite_code}\n"
+            f"   📋 Позиций в меню: {menu_count}\n"
+            f"   👥 Подключенных клиентов: {clients_count}\n"
+            f"   📅 Создан: {restaurant.created_at.strftime('%d.%m.%Y %H:%M')}\n\n"
+        )
+    
+    if not restaurants_with_owners:
+        text += "Нет ресторанов\n"
+    
+    # Кнопки пагинации
+    kb = []
+    
+    # Добавляем кнопки навигации
+    nav_buttons = []
+    
+    if page > 1:
+        nav_buttons.append(InlineKeyboardButton(text="◀️ Назад", callback_data="admin_restaurants_prev"))
+    
+    if page < total_pages:
+        nav_buttons.append(InlineKeyboardButton(text="Вперед ▶️", callback_data="admin_restaurants_next"))
+    
+    if nav_buttons:
+        kb.append(nav_buttons)
+    
+    kb.append([InlineKeyboardButton(text="🔙 В меню ресторанов", callback_data="admin_restaurants")])
+    
+    # Сохраняем текущую страницу в состоянии
+    await state.update_data(restaurants_page=page)
+    
+    try:
+        await callback.message.edit_text(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=kb))
+    except Exception as e:
+        logging.error(f"Error editing message in admin_all_restaurants: {e}")
+        # Если не удалось отредактировать сообщение, отправляем новое
+        await callback.message.answer(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=kb))
 
 @router.callback_query(F.data == "admin_restaurants_prev")
-async def admin_restaurants_prev_page(callback: CallbackQuery, state: FSMContext):
+async def admin_restaurants_prev_page(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
     if not is_admin(callback.from_user.id):
         await callback.answer("У вас нет доступа к этой функции")
         return
@@ -650,12 +687,12 @@ async def admin_restaurants_prev_page(callback: CallbackQuery, state: FSMContext
     
     if current_page > 1:
         await state.update_data(restaurants_page=current_page - 1)
-        await admin_all_restaurants(callback, state)
+        await admin_all_restaurants(callback, state, session=session)
     else:
         await callback.answer("Вы уже на первой странице")
 
 @router.callback_query(F.data == "admin_restaurants_next")
-async def admin_restaurants_next_page(callback: CallbackQuery, state: FSMContext):
+async def admin_restaurants_next_page(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
     if not is_admin(callback.from_user.id):
         await callback.answer("У вас нет доступа к этой функции")
         return
@@ -663,30 +700,28 @@ async def admin_restaurants_next_page(callback: CallbackQuery, state: FSMContext
     data = await state.get_data()
     current_page = data.get('restaurants_page', 1)
     
-    async with async_session() as session:
-        total_restaurants = await session.scalar(select(func.count()).select_from(Restaurant))
-        restaurants_per_page = 5
-        total_pages = (total_restaurants + restaurants_per_page - 1) // restaurants_per_page
-        
-        if current_page < total_pages:
-            await state.update_data(restaurants_page=current_page + 1)
-            await admin_all_restaurants(callback, state)
-        else:
-            await callback.answer("Вы уже на последней странице")
+    total_restaurants = await session.scalar(select(func.count()).select_from(Restaurant))
+    restaurants_per_page = 5
+    total_pages = (total_restaurants + restaurants_per_page - 1) // restaurants_per_page
+    
+    if current_page < total_pages:
+        await state.update_data(restaurants_page=current_page + 1)
+        await admin_all_restaurants(callback, state, session=session)
+    else:
+        await callback.answer("Вы уже на последней странице")
 
 @router.callback_query(F.data == "admin_back")
-async def admin_back(callback: CallbackQuery):
+async def admin_back(callback: CallbackQuery, session: AsyncSession):
     if not is_admin(callback.from_user.id):
         await callback.answer("У вас нет доступа к этой функции")
         return
     
     # Получаем статистику для главной панели
-    async with async_session() as session:
-        total_users = await session.scalar(select(func.count()).select_from(User))
-        restaurant_owners = await session.scalar(
-            select(func.count()).select_from(User).where(User.is_restaurant_owner == True)
-        )
-        total_restaurants = await session.scalar(select(func.count()).select_from(Restaurant))
+    total_users = await session.scalar(select(func.count()).select_from(User))
+    restaurant_owners = await session.scalar(
+        select(func.count()).select_from(User).where(User.is_restaurant_owner == True)
+    )
+    total_restaurants = await session.scalar(select(func.count()).select_from(Restaurant))
     
     text = (
         "👨‍💼 Панель администратора:\n\n"
@@ -734,7 +769,7 @@ async def admin_search_user(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
 @router.message(UserSearch.waiting_for_query)
-async def process_user_search(message: Message, state: FSMContext):
+async def process_user_search(message: Message, state: FSMContext, session: AsyncSession):
     """Обработка поискового запроса"""
     if not is_admin(message.from_user.id):
         await message.answer("У вас нет доступа к этой функции")
@@ -746,11 +781,11 @@ async def process_user_search(message: Message, state: FSMContext):
     if search_query.isdigit():
         # Поиск по ID
         user_tg_id = int(search_query)
-        await find_user_by_telegram_id(message, user_tg_id, state)
+        await find_user_by_telegram_id(message, user_tg_id, state, session=session)
     elif search_query.startswith('@'):
         # Поиск по username
         username = search_query[1:]  # убираем @
-        await find_user_by_username(message, username, state)
+        await find_user_by_username(message, username, state, session=session)
     else:
         # Неверный формат
         await message.answer(
@@ -762,167 +797,164 @@ async def process_user_search(message: Message, state: FSMContext):
             ])
         )
 
-async def find_user_by_telegram_id(message: Message, telegram_id: int, state: FSMContext):
+async def find_user_by_telegram_id(message: Message, telegram_id: int, state: FSMContext, session: AsyncSession):
     """Поиск пользователя по Telegram ID"""
-    async with async_session() as session:
-        result = await session.execute(select(User).where(User.telegram_id == telegram_id))
-        user = result.scalar_one_or_none()
-        
-        if user:
-            await show_user_profile(message, user, state)
-        else:
-            # Пользователь не найден в базе
-            await message.answer(
-                f"❌ Пользователь с ID {telegram_id} не найден в базе данных.",
-                reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                    [InlineKeyboardButton(text="◀️ Назад к поиску", callback_data="admin_search_user")],
-                    [InlineKeyboardButton(text="🔙 В меню пользователей", callback_data="admin_users")]
-                ])
-            )
+    result = await session.execute(select(User).where(User.telegram_id == telegram_id))
+    user = result.scalar_one_or_none()
+    
+    if user:
+        await show_user_profile(message, user, state, session=session)
+    else:
+        # Пользователь не найден в базе
+        await message.answer(
+            f"❌ Пользователь с ID {telegram_id} не найден в базе данных.",
+            reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+                [InlineKeyboardButton(text="◀️ Назад к поиску", callback_data="admin_search_user")],
+                [InlineKeyboardButton(text="🔙 В меню пользователей", callback_data="admin_users")]
+            ])
+        )
 
-async def find_user_by_username(message: Message, username: str, state: FSMContext):
+async def find_user_by_username(message: Message, username: str, state: FSMContext, session: AsyncSession):
     """Поиск пользователя по username"""
     # Здесь мы будем искать всех пользователей в БД и проверять username через Telegram API
-    async with async_session() as session:
-        # Получаем всех пользователей
-        result = await session.execute(select(User))
-        users = result.scalars().all()
-        
-        found_user = None
-        
-        # Ищем пользователя с нужным username
-        for user in users:
-            try:
-                user_info = await message.bot.get_chat(user.telegram_id)
-                if user_info.username and user_info.username.lower() == username.lower():
-                    found_user = user
-                    break
-            except Exception as e:
-                logging.error(f"Failed to get user info for {user.telegram_id}: {e}")
-        
-        if found_user:
-            await show_user_profile(message, found_user, state)
-        else:
-            # Пользователь не найден
-            await message.answer(
-                f"❌ Пользователь с username @{username} не найден в базе данных.",
-                reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                    [InlineKeyboardButton(text="◀️ Назад к поиску", callback_data="admin_search_user")],
-                    [InlineKeyboardButton(text="🔙 В меню пользователей", callback_data="admin_users")]
-                ])
-            )
+    # Получаем всех пользователей
+    result = await session.execute(select(User))
+    users = result.scalars().all()
+    
+    found_user = None
+    
+    # Ищем пользователя с нужным username
+    for user in users:
+        try:
+            user_info = await message.bot.get_chat(user.telegram_id)
+            if user_info.username and user_info.username.lower() == username.lower():
+                found_user = user
+                break
+        except Exception as e:
+            logging.error(f"Failed to get user info for {user.telegram_id}: {e}")
+    
+    if found_user:
+        await show_user_profile(message, found_user, state, session=session)
+    else:
+        # Пользователь не найден
+        await message.answer(
+            f"❌ Пользователь с username @{username} не найден в базе данных.",
+            reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+                [InlineKeyboardButton(text="◀️ Назад к поиску", callback_data="admin_search_user")],
+                [InlineKeyboardButton(text="🔙 В меню пользователей", callback_data="admin_users")]
+            ])
+        )
 
-async def show_user_profile(message: Message, user: User, state: FSMContext):
+async def show_user_profile(message: Message, user: User, state: FSMContext, session: AsyncSession):
     """Показать профиль пользователя"""
     await state.clear()  # Очищаем состояние
     
-    async with async_session() as session:
-        # Определяем статус пользователя
-        status = []
-        if user.is_restaurant_owner:
-            status.append("владелец ресторана")
-            
-            # Получаем ресторан пользователя
-            restaurant_query = select(Restaurant).where(Restaurant.owner_id == user.id)
-            result = await session.execute(restaurant_query)
-            restaurant = result.scalar_one_or_none()
-            
-            if restaurant:
-                restaurant_info = f"🍴 Ресторан: {restaurant.name} (ID: {restaurant.id})\n" \
-                                f"📅 Создан: {restaurant.created_at.strftime('%d.%m.%Y %H:%M')}\n" \
-                                f"🔑 Код приглашения: {restaurant.invite_code}\n"
-                
-                # Счетчик позиций в меню
-                menu_count_query = select(func.count()).select_from(MenuItem).where(MenuItem.restaurant_id == restaurant.id)
-                menu_count = await session.scalar(menu_count_query) or 0
-                restaurant_info += f"📋 Позиций в меню: {menu_count}\n"
-                
-                # Счетчик клиентов
-                clients_count_query = select(func.count()).select_from(User).where(User.current_restaurant_id == restaurant.id)
-                clients_count = await session.scalar(clients_count_query) or 0
-                restaurant_info += f"👥 Клиентов: {clients_count}\n"
-            else:
-                restaurant_info = "🍴 Ресторан не найден (возможно, удален)\n"
-        else:
-            restaurant_info = ""
+    # Определяем статус пользователя
+    status = []
+    if user.is_restaurant_owner:
+        status.append("владелец ресторана")
         
-        # Проверяем, подключен ли пользователь к ресторану
-        if user.current_restaurant_id:
-            status.append("клиент ресторана")
+        # Получаем ресторан пользователя
+        restaurant_query = select(Restaurant).where(Restaurant.owner_id == user.id)
+        result = await session.execute(restaurant_query)
+        restaurant = result.scalar_one_or_none()
+        
+        if restaurant:
+            restaurant_info = f"🍴 Ресторан: {restaurant.name} (ID: {restaurant.id})\n" \
+                            f"📅 Создан: {restaurant.created_at.strftime('%d.%m.%Y %H:%M')}\n" \
+                            f"🔑 Код приглашения: {restaurant.invite_code}\n"
             
-            # Получаем ресторан, к которому подключен
-            connected_restaurant_query = select(Restaurant).where(Restaurant.id == user.current_restaurant_id)
-            result = await session.execute(connected_restaurant_query)
-            connected_restaurant = result.scalar_one_or_none()
+            # Счетчик позиций в меню
+            menu_count_query = select(func.count()).select_from(MenuItem).where(MenuItem.restaurant_id == restaurant.id)
+            menu_count = await session.scalar(menu_count_query) or 0
+            restaurant_info += f"📋 Позиций в меню: {menu_count}\n"
             
-            if connected_restaurant:
-                connected_info = f"🔗 Подключен к ресторану: {connected_restaurant.name}\n"
-            else:
-                connected_info = "🔗 Подключен к несуществующему ресторану\n"
+            # Счетчик клиентов
+            clients_count_query = select(func.count()).select_from(User).where(User.current_restaurant_id == restaurant.id)
+            clients_count = await session.scalar(clients_count_query) or 0
+            restaurant_info += f"👥 Клиентов: {clients_count}\n"
         else:
-            connected_info = ""
-            
-        if not status:
-            status.append("обычный пользователь")
+            restaurant_info = "🍴 Ресторан не найден (возможно, удален)\n"
+    else:
+        restaurant_info = ""
+    
+    # Проверяем, подключен ли пользователь к ресторану
+    if user.current_restaurant_id:
+        status.append("клиент ресторана")
         
-        status_text = ", ".join(status)
+        # Получаем ресторан, к которому подключен
+        connected_restaurant_query = select(Restaurant).where(Restaurant.id == user.current_restaurant_id)
+        result = await session.execute(connected_restaurant_query)
+        connected_restaurant = result.scalar_one_or_none()
         
-        # Получаем информацию о пользователе из Telegram
+        if connected_restaurant:
+            connected_info = f"🔗 Подключен к ресторану: {connected_restaurant.name}\n"
+        else:
+            connected_info = "🔗 Подключен к несуществующему ресторану\n"
+    else:
+        connected_info = ""
+        
+    if not status:
+        status.append("обычный пользователь")
+    
+    status_text = ", ".join(status)
+    
+    # Получаем информацию о пользователе из Telegram
+    try:
+        user_info = await message.bot.get_chat(user.telegram_id)
+        username = user_info.username or "Нет username"
+        fullname = user_info.full_name or "Без имени"
+        user_display = f"{fullname}" + (f" (@{username})" if username != "Нет username" else "")
+        
+        # Проверяем, есть ли у пользователя фото
+        photos = await message.bot.get_user_profile_photos(user.telegram_id, limit=1)
+        has_photo = photos.total_count > 0
+    except Exception as e:
+        logging.error(f"Failed to get user info: {e}")
+        user_display = f"ID: {user.telegram_id}"
+        has_photo = False
+    
+    # Форматируем информацию о пользователе
+    last_activity = user.last_activity.strftime("%d.%m.%Y %H:%M") if user.last_activity else "нет данных"
+    
+    text = (
+        f"👤 Профиль пользователя: {user_display}\n\n"
+        f"🆔 Telegram ID: {user.telegram_id}\n"
+        f"📊 Статус: {status_text}\n"
+        f"📅 Регистрация: {user.created_at.strftime('%d.%m.%Y %H:%M')}\n"
+        f"⏱ Последняя активность: {last_activity}\n\n"
+    )
+    
+    # Добавляем информацию о ресторане, если есть
+    if restaurant_info:
+        text += f"📌 Информация о ресторане:\n{restaurant_info}\n"
+    
+    # Добавляем информацию о подключении, если есть
+    if connected_info:
+        text += f"📌 Подключение:\n{connected_info}\n"
+    
+    # Создаем клавиатуру с действиями
+    kb = [
+        [InlineKeyboardButton(text="◀️ Назад к поиску", callback_data="admin_search_user")],
+        [InlineKeyboardButton(text="🔙 В меню пользователей", callback_data="admin_users")]
+    ]
+    
+    # Если у пользователя есть фото, отправляем с фото
+    if has_photo:
         try:
-            user_info = await message.bot.get_chat(user.telegram_id)
-            username = user_info.username or "Нет username"
-            fullname = user_info.full_name or "Без имени"
-            user_display = f"{fullname}" + (f" (@{username})" if username != "Нет username" else "")
-            
-            # Проверяем, есть ли у пользователя фото
-            photos = await message.bot.get_user_profile_photos(user.telegram_id, limit=1)
-            has_photo = photos.total_count > 0
+            await message.answer_photo(
+                photos.photos[0][-1].file_id,
+                caption=text,
+                reply_markup=InlineKeyboardMarkup(inline_keyboard=kb)
+            )
         except Exception as e:
-            logging.error(f"Failed to get user info: {e}")
-            user_display = f"ID: {user.telegram_id}"
-            has_photo = False
-        
-        # Форматируем информацию о пользователе
-        last_activity = user.last_activity.strftime("%d.%m.%Y %H:%M") if user.last_activity else "нет данных"
-        
-        text = (
-            f"👤 Профиль пользователя: {user_display}\n\n"
-            f"🆔 Telegram ID: {user.telegram_id}\n"
-            f"📊 Статус: {status_text}\n"
-            f"📅 Регистрация: {user.created_at.strftime('%d.%m.%Y %H:%M')}\n"
-            f"⏱ Последняя активность: {last_activity}\n\n"
-        )
-        
-        # Добавляем информацию о ресторане, если есть
-        if restaurant_info:
-            text += f"📌 Информация о ресторане:\n{restaurant_info}\n"
-        
-        # Добавляем информацию о подключении, если есть
-        if connected_info:
-            text += f"📌 Подключение:\n{connected_info}\n"
-        
-        # Создаем клавиатуру с действиями
-        kb = [
-            [InlineKeyboardButton(text="◀️ Назад к поиску", callback_data="admin_search_user")],
-            [InlineKeyboardButton(text="🔙 В меню пользователей", callback_data="admin_users")]
-        ]
-        
-        # Если у пользователя есть фото, отправляем с фото
-        if has_photo:
-            try:
-                await message.answer_photo(
-                    photos.photos[0][-1].file_id,
-                    caption=text,
-                    reply_markup=InlineKeyboardMarkup(inline_keyboard=kb)
-                )
-            except Exception as e:
-                logging.error(f"Failed to send photo: {e}")
-                await message.answer(
-                    text,
-                    reply_markup=InlineKeyboardMarkup(inline_keyboard=kb)
-                )
-        else:
+            logging.error(f"Failed to send photo: {e}")
             await message.answer(
                 text,
                 reply_markup=InlineKeyboardMarkup(inline_keyboard=kb)
-            ) 
\ No newline at end of file
+            )
+    else:
+        await message.answer(
+            text,
+            reply_markup=InlineKeyboardMarkup(inline_keyboard=kb)
+        ) 
\ No newline at end of file
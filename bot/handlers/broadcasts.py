@@ -1,13 +1,23 @@
 import logging
+from functools import lru_cache
 from datetime import datetime, timedelta
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
-from sqlalchemy import select, func, desc, and_
+from sqlalchemy import select, func, desc, and_, or_, delete, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from ..models.base import async_session
-from ..models.models import User, Broadcast, BroadcastRecipient
+from ..models.models import Broadcast, BroadcastRecipient
 from ..states.states import BroadcastForm
+from ..services.broadcast_sender import BroadcastSender, GLOBAL_RATE
+from ..services.broadcast_audience import iter_audience, count_audience, estimate_audience, segment_label
+from ..services.broadcast_writer import RecipientWriter, DeliveryCursor
+from ..services.telegram_errors import classify_send_error, BLOCKED, CHAT_NOT_FOUND
+from ..services.broadcast_scheduler import scheduler
+from ..services import broadcast_runtime
+from ..services.broadcast_runtime import BroadcastRun
+from ..services.broadcast_lease import BroadcastLease, INSTANCE_ID, LEASE_TIMEOUT, claim_broadcast, lease_expired
 import os
 import asyncio
 import re
@@ -21,7 +31,8 @@ ADMIN_ID = int(os.getenv("ADMIN_ID", "5385155120"))
 def is_admin(telegram_id):
     return telegram_id == ADMIN_ID
 
-# Получить клавиатуру меню рассылок
+# Получить клавиатуру меню рассылок (собирается один раз)
+@lru_cache(maxsize=None)
 def get_broadcasts_menu_kb():
     kb = [
         [InlineKeyboardButton(text="📝 Создать рассылку", callback_data="create_broadcast")],
@@ -32,80 +43,81 @@ def get_broadcasts_menu_kb():
     return InlineKeyboardMarkup(inline_keyboard=kb)
 
 @router.callback_query(F.data == "admin_broadcasts")
-async def admin_broadcasts_menu(callback: CallbackQuery):
+async def admin_broadcasts_menu(callback: CallbackQuery, session: AsyncSession):
     """Меню рассылок"""
     if not is_admin(callback.from_user.id):
         await callback.answer("У вас нет доступа к этой функции")
         return
 
-    async with async_session() as session:
-        # Получаем статистику по рассылкам
-        total_broadcasts = await session.scalar(select(func.count()).select_from(Broadcast))
-        active_broadcasts = await session.scalar(
-            select(func.count()).select_from(Broadcast).where(
-                Broadcast.status.in_(["created", "sending"])
-            )
+    # Получаем статистику по рассылкам
+    total_broadcasts = await session.scalar(select(func.count()).select_from(Broadcast))
+    active_broadcasts = await session.scalar(
+        select(func.count()).select_from(Broadcast).where(
+            Broadcast.status.in_(["created", "sending", "paused"])
         )
-        scheduled_broadcasts = await session.scalar(
-            select(func.count()).select_from(Broadcast).where(
-                and_(
-                    Broadcast.status == "created",
-                    Broadcast.scheduled_at.isnot(None)
-                )
+    )
+    scheduled_broadcasts = await session.scalar(
+        select(func.count()).select_from(Broadcast).where(
+            and_(
+                Broadcast.status == "created",
+                Broadcast.scheduled_at.isnot(None)
             )
         )
-        
-        # Получаем последние рассылки
-        recent_broadcasts_query = select(Broadcast).order_by(desc(Broadcast.created_at)).limit(3)
-        result = await session.execute(recent_broadcasts_query)
-        recent_broadcasts = result.scalars().all()
-        
-        text = (
-            "📨 Рассылки сообщений\n\n"
-            f"Всего рассылок: {total_broadcasts}\n"
-            f"Активных рассылок: {active_broadcasts}\n"
-            f"Запланированных: {scheduled_broadcasts}\n\n"
-        )
-        
-        if recent_broadcasts:
-            text += "Последние рассылки:\n"
-            for i, broadcast in enumerate(recent_broadcasts, 1):
-                status_emoji = {
-                    "created": "⏳",
-                    "sending": "🔄",
-                    "completed": "✅",
-                    "failed": "❌"
-                }.get(broadcast.status, "❓")
+    )
+    
+    # Получаем последние рассылки
+    recent_broadcasts_query = select(Broadcast).order_by(desc(Broadcast.created_at)).limit(3)
+    result = await session.execute(recent_broadcasts_query)
+    recent_broadcasts = result.scalars().all()
+    
+    text = (
+        "📨 Рассылки сообщений\n\n"
+        f"Всего рассылок: {total_broadcasts}\n"
+        f"Активных рассылок: {active_broadcasts}\n"
+        f"Запланированных: {scheduled_broadcasts}\n\n"
+    )
+    
+    if recent_broadcasts:
+        text += "Последние рассылки:\n"
+        for i, broadcast in enumerate(recent_broadcasts, 1):
+            status_emoji = {
+                "created": "⏳",
+                "sending": "🔄",
+                "paused": "⏸",
+                "completed": "✅",
+                "cancelled": "🚫",
+                "failed": "❌"
+            }.get(broadcast.status, "❓")
+            
+            # Форматируем информацию о рассылке
+            text += (
+                f"{i}. {status_emoji} {broadcast.name}\n"
+                f"   Статус: {broadcast.status}\n"
+                f"   Создана: {broadcast.created_at.strftime('%d.%m.%Y %H:%M')}\n"
+            )
+            
+            if broadcast.scheduled_at:
+                text += f"   Запланирована на: {broadcast.scheduled_at.strftime('%d.%m.%Y %H:%M')}\n"
                 
-                # Форматируем информацию о рассылке
+            if broadcast.sent_at:
+                text += f"   Отправлена: {broadcast.sent_at.strftime('%d.%m.%Y %H:%M')}\n"
+                
+            if broadcast.status in ["completed", "sending"]:                        
                 text += (
-                    f"{i}. {status_emoji} {broadcast.name}\n"
-                    f"   Статус: {broadcast.status}\n"
-                    f"   Создана: {broadcast.created_at.strftime('%d.%m.%Y %H:%M')}\n"
+                    f"   Получили: {broadcast.received_count}/{broadcast.total_users}\n"
                 )
-                
-                if broadcast.scheduled_at:
-                    text += f"   Запланирована на: {broadcast.scheduled_at.strftime('%d.%m.%Y %H:%M')}\n"
-                    
-                if broadcast.sent_at:
-                    text += f"   Отправлена: {broadcast.sent_at.strftime('%d.%m.%Y %H:%M')}\n"
-                    
-                if broadcast.status in ["completed", "sending"]:                        
-                    text += (
-                        f"   Получили: {broadcast.received_count}/{broadcast.total_users}\n"
-                    )
-                
-                text += "\n"
-        else:
-            text += "Пока нет рассылок\n"
-        
-        try:
-            await callback.message.edit_text(text, reply_markup=get_broadcasts_menu_kb())
-        except Exception as e:
-            logging.error(f"Error editing message in admin_broadcasts_menu: {e}")
-            await callback.message.answer(text, reply_markup=get_broadcasts_menu_kb())
             
-        await callback.answer()
+            text += "\n"
+    else:
+        text += "Пока нет рассылок\n"
+    
+    try:
+        await callback.message.edit_text(text, reply_markup=get_broadcasts_menu_kb())
+    except Exception as e:
+        logging.error(f"Error editing message in admin_broadcasts_menu: {e}")
+        await callback.message.answer(text, reply_markup=get_broadcasts_menu_kb())
+        
+    await callback.answer()
 
 @router.callback_query(F.data == "create_broadcast")
 async def create_broadcast_start(callback: CallbackQuery, state: FSMContext):
@@ -291,7 +303,7 @@ async def process_button_text(message: Message, state: FSMContext):
     )
 
 @router.message(BroadcastForm.waiting_for_button_url)
-async def process_button_url(message: Message, state: FSMContext):
+async def process_button_url(message: Message, state: FSMContext, session: AsyncSession):
     """Обработка URL кнопки"""
     if not is_admin(message.from_user.id):
         return
@@ -310,10 +322,10 @@ async def process_button_url(message: Message, state: FSMContext):
     await state.update_data(button_url=button_url)
     
     # Переходим к подтверждению рассылки
-    await show_broadcast_preview(message, state)
+    await show_broadcast_preview(message, state, session=session)
 
 @router.callback_query(F.data == "skip_broadcast_button")
-async def skip_broadcast_button(callback: CallbackQuery, state: FSMContext):
+async def skip_broadcast_button(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
     """Пропуск добавления кнопки"""
     if not is_admin(callback.from_user.id):
         await callback.answer("У вас нет доступа к этой функции")
@@ -323,11 +335,21 @@ async def skip_broadcast_button(callback: CallbackQuery, state: FSMContext):
     await state.update_data(button_text=None, button_url=None)
     
     # Переходим к подтверждению рассылки
-    await show_broadcast_preview(callback.message, state)
+    await show_broadcast_preview(callback.message, state, session=session)
     
     await callback.answer()
 
-async def show_broadcast_preview(message: Message, state: FSMContext):
+# Сегменты, доступные для выбора при создании рассылки: (сегмент, период в днях)
+SEGMENT_CHOICES = [
+    ("all", None),
+    ("owners", None),
+    ("connected", None),
+    ("active", 7),
+    ("active", 30),
+    ("ordered", None),
+]
+
+async def show_broadcast_preview(message: Message, state: FSMContext, session: AsyncSession, show_sample: bool = True):
     """Показывает предпросмотр рассылки и запрашивает подтверждение"""
     # Получаем данные о рассылке
     data = await state.get_data()
@@ -337,13 +359,16 @@ async def show_broadcast_preview(message: Message, state: FSMContext):
     photo = data.get("photo")
     button_text = data.get("button_text")
     button_url = data.get("button_url")
+    segment = data.get("segment", "all")
+    segment_days = data.get("segment_days")
     
     # Отдельное сообщение с примером текста рассылки с форматированием HTML
     # Отправляем сначала, чтобы это сообщение было первым
-    await message.answer(
-        f"📱 Так будет выглядеть текст рассылки:\n\n{text}",
-        parse_mode="HTML"
-    )
+    if show_sample:
+        await message.answer(
+            f"📱 Так будет выглядеть текст рассылки:\n\n{text}",
+            parse_mode="HTML"
+        )
     
     # Создаем текст предпросмотра
     preview_text = (
@@ -362,10 +387,12 @@ async def show_broadcast_preview(message: Message, state: FSMContext):
     else:
         preview_text += "🔘 Кнопка: Отсутствует\n"
     
-    # Подсчитываем количество получателей
-    async with async_session() as session:
-        total_users = await session.scalar(select(func.count()).select_from(User))
-        preview_text += f"\nПолучателей: {total_users} пользователей\n\n"
+    # Оцениваем количество получателей без полного подсчета
+    total_users = await estimate_audience(session, segment, segment_days)
+    preview_text += (
+        f"\n🎯 Аудитория: {segment_label(segment, segment_days)}\n"
+        f"Получателей: ~{total_users} пользователей\n\n"
+    )
     
     # Создаем клавиатуру для подтверждения или редактирования
     kb = [
@@ -373,6 +400,7 @@ async def show_broadcast_preview(message: Message, state: FSMContext):
             InlineKeyboardButton(text="✅ Отправить сейчас", callback_data="send_broadcast_now"),
             InlineKeyboardButton(text="⏰ Запланировать", callback_data="schedule_broadcast")
         ],
+        [InlineKeyboardButton(text="🎯 Выбрать аудиторию", callback_data="broadcast_choose_segment")],
         [InlineKeyboardButton(text="❌ Отмена", callback_data="admin_broadcasts")]
     ]
     
@@ -405,8 +433,42 @@ async def show_broadcast_preview(message: Message, state: FSMContext):
     if preview_message:
         await state.update_data(preview_message_id=preview_message.message_id)
 
+@router.callback_query(F.data == "broadcast_choose_segment")
+async def broadcast_choose_segment(callback: CallbackQuery, state: FSMContext):
+    """Выбор аудитории рассылки"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("У вас нет доступа к этой функции")
+        return
+    
+    kb = [
+        [InlineKeyboardButton(
+            text=segment_label(segment, days),
+            callback_data=f"broadcast_segment_{segment}_{days or 0}"
+        )]
+        for segment, days in SEGMENT_CHOICES
+    ]
+    
+    await callback.message.answer(
+        "🎯 Выберите аудиторию рассылки:",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=kb)
+    )
+    await callback.answer()
+
+@router.callback_query(F.data.startswith("broadcast_segment_"))
+async def broadcast_set_segment(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
+    """Сохраняет выбранную аудиторию и показывает обновленный предпросмотр"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("У вас нет доступа к этой функции")
+        return
+    
+    _, _, segment, days = callback.data.split("_")
+    await state.update_data(segment=segment, segment_days=int(days) or None)
+    
+    await show_broadcast_preview(callback.message, state, show_sample=False, session=session)
+    await callback.answer()
+
 @router.callback_query(F.data == "send_broadcast_now")
-async def send_broadcast_now(callback: CallbackQuery, state: FSMContext):
+async def send_broadcast_now(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
     """Моментальная отправка рассылки"""
     if not is_admin(callback.from_user.id):
         await callback.answer("У вас нет доступа к этой функции")
@@ -416,32 +478,35 @@ async def send_broadcast_now(callback: CallbackQuery, state: FSMContext):
     data = await state.get_data()
     
     # Создаем запись в базе данных
-    async with async_session() as session:
-        # Подсчитываем общее количество пользователей
-        total_users = await session.scalar(select(func.count()).select_from(User))
-        
-        # Создаем новую рассылку
-        new_broadcast = Broadcast(
-            name=data.get("name"),
-            text=data.get("text"),
-            photo=data.get("photo"),
-            button_text=data.get("button_text"),
-            button_url=data.get("button_url"),
-            status="sending",
-            total_users=total_users
-        )
-        
-        session.add(new_broadcast)
-        await session.commit()
-        
-        # Запускаем процесс рассылки
-        asyncio.create_task(
-            send_broadcast(
-                callback.bot, 
-                new_broadcast.id, 
-                callback.from_user.id
-            )
+    # Оцениваем количество получателей (точное значение посчитается при отправке)
+    total_users = await estimate_audience(session, data.get("segment"), data.get("segment_days"))
+    
+    # Создаем новую рассылку
+    new_broadcast = Broadcast(
+        name=data.get("name"),
+        text=data.get("text"),
+        photo=data.get("photo"),
+        button_text=data.get("button_text"),
+        button_url=data.get("button_url"),
+        segment=data.get("segment", "all"),
+        segment_days=data.get("segment_days"),
+        status="sending",
+        claimed_by=INSTANCE_ID,
+        heartbeat_at=datetime.utcnow(),
+        total_users=total_users
+    )
+    
+    session.add(new_broadcast)
+    await session.commit()
+    
+    # Запускаем процесс рассылки
+    asyncio.create_task(
+        send_broadcast(
+            callback.bot, 
+            new_broadcast.id, 
+            callback.from_user.id
         )
+    )
     
     # Очищаем состояние
     await state.clear()
@@ -551,7 +616,7 @@ async def process_schedule_date(message: Message, state: FSMContext):
         )
 
 @router.message(BroadcastForm.waiting_for_schedule_time)
-async def process_schedule_time(message: Message, state: FSMContext):
+async def process_schedule_time(message: Message, state: FSMContext, session: AsyncSession):
     """Обработка времени планирования"""
     if not is_admin(message.from_user.id):
         return
@@ -594,7 +659,7 @@ async def process_schedule_time(message: Message, state: FSMContext):
         await state.update_data(schedule_datetime=schedule_datetime)
         
         # Создаем рассылку в базе данных
-        await save_scheduled_broadcast(message, state)
+        await save_scheduled_broadcast(message, state, session=session)
         
     except ValueError:
         await message.answer(
@@ -603,7 +668,7 @@ async def process_schedule_time(message: Message, state: FSMContext):
             "Попробуйте еще раз:"
         )
 
-async def save_scheduled_broadcast(message: Message, state: FSMContext):
+async def save_scheduled_broadcast(message: Message, state: FSMContext, session: AsyncSession):
     """Сохраняет запланированную рассылку в базе данных"""
     # Получаем все данные рассылки
     data = await state.get_data()
@@ -611,24 +676,28 @@ async def save_scheduled_broadcast(message: Message, state: FSMContext):
     scheduled_time = data.get("schedule_datetime")
     
     # Создаем запись в базе данных
-    async with async_session() as session:
-        # Подсчитываем общее количество пользователей
-        total_users = await session.scalar(select(func.count()).select_from(User))
-        
-        # Создаем новую запланированную рассылку
-        new_broadcast = Broadcast(
-            name=data.get("name"),
-            text=data.get("text"),
-            photo=data.get("photo"),
-            button_text=data.get("button_text"),
-            button_url=data.get("button_url"),
-            scheduled_at=scheduled_time,
-            status="created",
-            total_users=total_users
-        )
-        
-        session.add(new_broadcast)
-        await session.commit()
+    # Оцениваем количество получателей (точное значение посчитается при отправке)
+    total_users = await estimate_audience(session, data.get("segment"), data.get("segment_days"))
+    
+    # Создаем новую запланированную рассылку
+    new_broadcast = Broadcast(
+        name=data.get("name"),
+        text=data.get("text"),
+        photo=data.get("photo"),
+        button_text=data.get("button_text"),
+        button_url=data.get("button_url"),
+        segment=data.get("segment", "all"),
+        segment_days=data.get("segment_days"),
+        scheduled_at=scheduled_time,
+        status="created",
+        total_users=total_users
+    )
+    
+    session.add(new_broadcast)
+    await session.commit()
+    
+    # Добавляем рассылку в расписание планировщика
+    scheduler.schedule(new_broadcast.id, scheduled_time)
     
     # Очищаем состояние
     await state.clear()
@@ -653,83 +722,144 @@ async def send_broadcast(bot, broadcast_id: int, admin_id: int):
             logging.error(f"Broadcast {broadcast_id} not found")
             return
         
-        # Получаем всех пользователей
-        users_result = await session.execute(select(User))
-        users = users_result.scalars().all()
+        # Рассылку отправляет только захвативший ее экземпляр бота
+        if broadcast.claimed_by != INSTANCE_ID:
+            logging.warning(f"Broadcast {broadcast_id} is claimed by {broadcast.claimed_by}, skipping")
+            return
+        
+        # Если есть контрольная точка, рассылка была прервана - продолжаем с нее
+        resuming = broadcast.last_user_id is not None
+        already_sent = (broadcast.received_count or 0) if resuming else 0
         
-        # Обновляем общее количество пользователей
-        broadcast.total_users = len(users)
+        if resuming:
+            logging.info(f"Resuming broadcast {broadcast_id} after user id {broadcast.last_user_id}")
+        else:
+            # Обновляем общее количество пользователей (сами пользователи загружаются порциями при отправке)
+            broadcast.total_users = await count_audience(session, broadcast.segment, broadcast.segment_days)
+            broadcast.received_count = 0
+        # Завершаем транзакцию, чтобы не держать соединение на время отправки
         await session.commit()
         
         sent_count = 0
         errors_count = 0
+        errors_by_kind = {}
         
-        # Отправляем сообщения всем пользователям
-        for user in users:
-            try:
-                # Создаем кнопку для каждого пользователя
-                keyboard = None
-                if broadcast.button_text and broadcast.button_url:
-                    # Создаем простую кнопку с URL
-                    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                        [InlineKeyboardButton(text=broadcast.button_text, url=broadcast.button_url)]
-                    ])
-                
-                # Отправляем сообщение в зависимости от наличия фото
-                if broadcast.photo:
-                    sent_msg = await bot.send_photo(
-                        chat_id=user.telegram_id,
-                        photo=broadcast.photo,
-                        caption=broadcast.text,
-                        parse_mode="HTML",
-                        reply_markup=keyboard
-                    )
-                else:
-                    sent_msg = await bot.send_message(
-                        chat_id=user.telegram_id,
-                        text=broadcast.text,
-                        parse_mode="HTML",
-                        reply_markup=keyboard
-                    )
-                
-                # Увеличиваем счетчик отправленных
-                sent_count += 1
-                
-                # Добавляем запись о получателе
-                recipient = BroadcastRecipient(
-                    broadcast_id=broadcast.id,
-                    user_id=user.id,
-                    received=True,
-                    received_at=datetime.now()
+        # Клавиатура одинакова для всех получателей, создаем ее один раз
+        keyboard = None
+        if broadcast.button_text and broadcast.button_url:
+            keyboard = InlineKeyboardMarkup(inline_keyboard=[
+                [InlineKeyboardButton(text=broadcast.button_text, url=broadcast.button_url)]
+            ])
+        
+        async def deliver(chat_id: int):
+            # Отправляем сообщение в зависимости от наличия фото
+            if broadcast.photo:
+                await bot.send_photo(
+                    chat_id=chat_id,
+                    photo=broadcast.photo,
+                    caption=broadcast.text,
+                    parse_mode="HTML",
+                    reply_markup=keyboard
                 )
-                session.add(recipient)
-                
-                # Обновляем статистику каждые 10 пользователей
-                if sent_count % 10 == 0:
-                    broadcast.received_count = sent_count
-                    await session.commit()
-                
-                # Делаем небольшую паузу, чтобы не превысить лимиты Telegram
-                await asyncio.sleep(0.05)
-                
-            except Exception as e:
-                logging.error(f"Error sending broadcast to user {user.telegram_id}: {e}")
+            else:
+                await bot.send_message(
+                    chat_id=chat_id,
+                    text=broadcast.text,
+                    parse_mode="HTML",
+                    reply_markup=keyboard
+                )
+        
+        # Результаты доставки пишутся в БД пачками вместе с контрольной точкой
+        cursor = DeliveryCursor(broadcast.last_user_id or 0)
+        
+        async def recipients():
+            # При продолжении пропускаем тех, кто уже получил рассылку после контрольной точки
+            audience = iter_audience(
+                after_id=cursor.watermark,
+                exclude_broadcast_id=broadcast.id if resuming else None,
+                segment=broadcast.segment,
+                days=broadcast.segment_days
+            )
+            async for user_id, chat_id in audience:
+                cursor.dispatch(user_id)
+                yield user_id, chat_id
+        
+        async def on_result(user_id: int, chat_id: int, error: Exception | None):
+            nonlocal sent_count, errors_count
+            run.record(error)
+            
+            if error is not None:
+                # Повторяемые ошибки уже обработаны отправителем, сюда приходят окончательные
+                kind = classify_send_error(error)
+                if kind in (BLOCKED, CHAT_NOT_FOUND):
+                    # Исключаем пользователя из следующих рассылок
+                    logging.info(f"Broadcast recipient {chat_id} is unreachable: {error}")
+                    writer.suppress(user_id, chat_id)
+                else:
+                    logging.error(f"Error sending broadcast to user {chat_id}: {error}")
+                    writer.skip(user_id)
                 errors_count += 1
+                errors_by_kind[kind] = errors_by_kind.get(kind, 0) + 1
+                return
+            
+            # Увеличиваем счетчик отправленных и добавляем запись о получателе
+            sent_count += 1
+            await writer.add(user_id)
+        
+        # Отправляем сообщения пулом воркеров с учетом лимитов Telegram
+        sender = BroadcastSender(deliver, rate=broadcast.rate_limit, concurrency=broadcast.concurrency)
         
-        # Обновляем финальную статистику
-        broadcast.received_count = sent_count
+        # Регистрируем рассылку, чтобы ею можно было управлять из админки
+        run = BroadcastRun(broadcast.id, sender, broadcast.total_users or 0, already_sent)
+        broadcast_runtime.register(run)
+        
+        # Продлеваем аренду, пока идет отправка; если ее потеряли - останавливаемся
+        lease = BroadcastLease(broadcast.id, sender.stop)
+        lease.start()
+        
+        writer = RecipientWriter(broadcast.id, cursor, lease)
+        writer.start()
+        try:
+            await sender.run(recipients(), on_result)
+        finally:
+            await lease.stop()
+            broadcast_runtime.unregister(broadcast.id)
+            await writer.close()
+        
+        if lease.lost:
+            # Рассылку отменили или забрал другой экземпляр бота, финальный статус не наш
+            return
+        
+        if run.cancelled:
+            broadcast.status = "cancelled"
+            await session.commit()
+            logging.info(f"Broadcast {broadcast_id} cancelled")
+            return
+        
+        # Обновляем финальную статистику (received_count уже обновлен при записи получателей)
         broadcast.status = "completed"
         broadcast.sent_at = datetime.now()
         await session.commit()
         
+        # Расшифровка ошибок по типам
+        error_labels = {
+            BLOCKED: "заблокировали бота",
+            CHAT_NOT_FOUND: "чат не найден",
+        }
+        errors_details = "".join(
+            f"\n  • {error_labels.get(kind, kind)}: {count}"
+            for kind, count in errors_by_kind.items()
+        )
+        
         # Уведомляем админа о завершении рассылки
         try:
             await bot.send_message(
                 chat_id=admin_id,
                 text=(
                     f"✅ Рассылка '{broadcast.name}' завершена!\n\n"
-                    f"Отправлено: {sent_count}/{broadcast.total_users} пользователей\n"
-                    f"Ошибок: {errors_count}"
+                    f"Отправлено: {already_sent + sent_count}/{broadcast.total_users} пользователей\n"
+                    f"Ошибок: {errors_count}{errors_details}\n"
+                    f"Повторных попыток: {sender.retried}"
                 ),
                 parse_mode="HTML",
                 reply_markup=InlineKeyboardMarkup(inline_keyboard=[
@@ -740,68 +870,78 @@ async def send_broadcast(bot, broadcast_id: int, admin_id: int):
         except Exception as e:
             logging.error(f"Error notifying admin about broadcast completion: {e}")
 
+def format_duration(seconds: float) -> str:
+    """Форматирует длительность в виде "1 ч 5 мин" """
+    seconds = int(seconds)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    if hours:
+        return f"{hours} ч {minutes} мин"
+    if minutes:
+        return f"{minutes} мин {seconds} сек"
+    return f"{seconds} сек"
+
 @router.callback_query(F.data == "active_broadcasts")
-async def active_broadcasts(callback: CallbackQuery, state: FSMContext):
+async def active_broadcasts(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
     """Показывает активные рассылки"""
     if not is_admin(callback.from_user.id):
         await callback.answer("У вас нет доступа к этой функции")
         return
     
-    async with async_session() as session:
-        # Получаем активные рассылки
-        active_broadcasts_query = select(Broadcast).where(
-            Broadcast.status.in_(["created", "sending"])
-        ).order_by(desc(Broadcast.created_at))
-        
-        result = await session.execute(active_broadcasts_query)
-        broadcasts = result.scalars().all()
-        
-        if not broadcasts:
-            await callback.message.edit_text(
-                "📊 Активные рассылки\n\n"
-                "В настоящее время нет активных рассылок.",
-                reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                    [InlineKeyboardButton(text="📝 Создать рассылку", callback_data="create_broadcast")],
-                    [InlineKeyboardButton(text="🔙 В меню рассылок", callback_data="admin_broadcasts")]
-                ])
-            )
-            await callback.answer()
-            return
-        
-        text = "📊 Активные рассылки:\n\n"
+    # Получаем активные рассылки
+    active_broadcasts_query = select(Broadcast).where(
+        Broadcast.status.in_(["created", "sending", "paused"])
+    ).order_by(desc(Broadcast.created_at))
+    
+    result = await session.execute(active_broadcasts_query)
+    broadcasts = result.scalars().all()
+    
+    if not broadcasts:
+        await callback.message.edit_text(
+            "📊 Активные рассылки\n\n"
+            "В настоящее время нет активных рассылок.",
+            reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+                [InlineKeyboardButton(text="📝 Создать рассылку", callback_data="create_broadcast")],
+                [InlineKeyboardButton(text="🔙 В меню рассылок", callback_data="admin_broadcasts")]
+            ])
+        )
+        await callback.answer()
+        return
+    
+    text = "📊 Активные рассылки:\n\n"
+    
+    kb = []
+    
+    for i, broadcast in enumerate(broadcasts, 1):
+        status_emoji = {"sending": "🔄", "paused": "⏸"}.get(broadcast.status, "⏳")
         
-        kb = []
+        text += f"{i}. {status_emoji} {broadcast.name}\n"
         
-        for i, broadcast in enumerate(broadcasts, 1):
-            status_emoji = "🔄" if broadcast.status == "sending" else "⏳"
-            
-            text += f"{i}. {status_emoji} {broadcast.name}\n"
-            
-            if broadcast.scheduled_at:
-                text += f"   Запланирована на: {broadcast.scheduled_at.strftime('%d.%m.%Y %H:%M')}\n"
-            
-            if broadcast.status == "sending":
-                text += f"   Отправлено: {broadcast.received_count}/{broadcast.total_users}\n"
-            
-            text += "\n"
-            
-            # Добавляем кнопку для каждой рассылки
-            kb.append([InlineKeyboardButton(
-                text=f"{status_emoji} {broadcast.name}", 
-                callback_data=f"broadcast_details_{broadcast.id}"
-            )])
+        if broadcast.scheduled_at:
+            text += f"   Запланирована на: {broadcast.scheduled_at.strftime('%d.%m.%Y %H:%M')}\n"
         
-        kb.append([InlineKeyboardButton(text="🔙 В меню рассылок", callback_data="admin_broadcasts")])
+        if broadcast.status in ["sending", "paused"]:
+            text += f"   Отправлено: {broadcast.received_count}/{broadcast.total_users}\n"
         
-        await callback.message.edit_text(
-            text,
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=kb)
-        )
+        text += "\n"
         
-        await callback.answer()
+        # Добавляем кнопку для каждой рассылки
+        kb.append([InlineKeyboardButton(
+            text=f"{status_emoji} {broadcast.name}", 
+            callback_data=f"broadcast_details_{broadcast.id}"
+        )])
+    
+    kb.append([InlineKeyboardButton(text="🔙 В меню рассылок", callback_data="admin_broadcasts")])
+    
+    await callback.message.edit_text(
+        text,
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=kb)
+    )
+    
+    await callback.answer()
 
 @router.callback_query(F.data.startswith("broadcast_details_"))
-async def broadcast_details(callback: CallbackQuery):
+async def broadcast_details(callback: CallbackQuery, session: AsyncSession):
     """Показывает детали рассылки"""
     if not is_admin(callback.from_user.id):
         await callback.answer("У вас нет доступа к этой функции")
@@ -809,102 +949,136 @@ async def broadcast_details(callback: CallbackQuery):
     
     broadcast_id = int(callback.data.split("_")[-1])
     
-    async with async_session() as session:
-        # Получаем рассылку
-        broadcast_result = await session.execute(select(Broadcast).where(Broadcast.id == broadcast_id))
-        broadcast = broadcast_result.scalar_one_or_none()
-        
-        if not broadcast:
-            await callback.answer("Рассылка не найдена")
-            return
-        
-        # Статус рассылки
-        status_emoji = {
-            "created": "⏳",
-            "sending": "🔄",
-            "completed": "✅",
-            "failed": "❌"
-        }.get(broadcast.status, "❓")
-        
-        status_text = {
-            "created": "Создана",
-            "sending": "Отправляется",
-            "completed": "Завершена",
-            "failed": "Ошибка"
-        }.get(broadcast.status, "Неизвестно")
+    # Получаем рассылку
+    broadcast_result = await session.execute(select(Broadcast).where(Broadcast.id == broadcast_id))
+    broadcast = broadcast_result.scalar_one_or_none()
+    
+    if not broadcast:
+        await callback.answer("Рассылка не найдена")
+        return
+    
+    # Статус рассылки
+    status_emoji = {
+        "created": "⏳",
+        "sending": "🔄",
+        "paused": "⏸",
+        "completed": "✅",
+        "cancelled": "🚫",
+        "failed": "❌"
+    }.get(broadcast.status, "❓")
+    
+    status_text = {
+        "created": "Создана",
+        "sending": "Отправляется",
+        "paused": "Приостановлена",
+        "completed": "Завершена",
+        "cancelled": "Отменена",
+        "failed": "Ошибка"
+    }.get(broadcast.status, "Неизвестно")
+    
+    text = (
+        f"📊 Детали рассылки '{broadcast.name}'\n\n"
+        f"Статус: {status_emoji} {status_text}\n"
+        f"Создана: {broadcast.created_at.strftime('%d.%m.%Y %H:%M')}\n"
+    )
+    
+    if broadcast.scheduled_at:
+        text += f"Запланирована на: {broadcast.scheduled_at.strftime('%d.%m.%Y %H:%M')}\n"
         
-        text = (
-            f"📊 Детали рассылки '{broadcast.name}'\n\n"
-            f"Статус: {status_emoji} {status_text}\n"
-            f"Создана: {broadcast.created_at.strftime('%d.%m.%Y %H:%M')}\n"
+    if broadcast.sent_at:
+        text += f"Отправлена: {broadcast.sent_at.strftime('%d.%m.%Y %H:%M')}\n"
+    
+    text += f"\nАудитория: {segment_label(broadcast.segment, broadcast.segment_days)}\n"
+    text += f"Получатели: {broadcast.received_count}/{broadcast.total_users}\n"
+    
+    # Живая статистика выполняющейся рассылки
+    run = broadcast_runtime.get_run(broadcast.id)
+    if run:
+        text += (
+            f"Скорость: {run.throughput:.1f} сообщ./сек (лимит {run.sender.rate:g})\n"
+            f"Ошибок: {run.errors} ({run.error_rate:.1%})\n"
         )
+        if run.eta is not None:
+            text += f"Осталось: ~{format_duration(run.eta)}\n"
+    text += "\n"
+    
+    # Сообщение рассылки (превью)
+    text += "📱 Сообщение рассылки:\n\n"
+    
+    # Ограничиваем длину превью текста
+    message_preview = broadcast.text
+    if len(message_preview) > 100:
+        message_preview = message_preview[:97] + "..."
         
-        if broadcast.scheduled_at:
-            text += f"Запланирована на: {broadcast.scheduled_at.strftime('%d.%m.%Y %H:%M')}\n"
-            
-        if broadcast.sent_at:
-            text += f"Отправлена: {broadcast.sent_at.strftime('%d.%m.%Y %H:%M')}\n"
-        
-        text += f"\nПолучатели: {broadcast.received_count}/{broadcast.total_users}\n\n"
-        
-        # Сообщение рассылки (превью)
-        text += "📱 Сообщение рассылки:\n\n"
-        
-        # Ограничиваем длину превью текста
-        message_preview = broadcast.text
-        if len(message_preview) > 100:
-            message_preview = message_preview[:97] + "..."
-            
-        text += f"{message_preview}\n\n"
-        
-        # Добавляем информацию о фото и кнопке
-        if broadcast.photo:
-            text += "🖼 Фото: Прикреплено\n"
-            
-        if broadcast.button_text and broadcast.button_url:
-            text += f"🔘 Кнопка: {broadcast.button_text} ({broadcast.button_url})\n"
-        
-        # Создаем клавиатуру для управления
-        kb = []
+    text += f"{message_preview}\n\n"
+    
+    # Добавляем информацию о фото и кнопке
+    if broadcast.photo:
+        text += "🖼 Фото: Прикреплено\n"
         
-        # Если рассылка запланирована, добавляем кнопку отправки сейчас
-        if broadcast.status == "created" and broadcast.scheduled_at:
-            kb.append([InlineKeyboardButton(
-                text="📤 Отправить сейчас", 
-                callback_data=f"broadcast_send_now_{broadcast.id}"
-            )])
-            
-        # Добавляем кнопку удаления
+    if broadcast.button_text and broadcast.button_url:
+        text += f"🔘 Кнопка: {broadcast.button_text} ({broadcast.button_url})\n"
+    
+    # Создаем клавиатуру для управления
+    kb = []
+    
+    # Если рассылка запланирована, добавляем кнопку отправки сейчас
+    if broadcast.status == "created" and broadcast.scheduled_at:
         kb.append([InlineKeyboardButton(
-            text="🗑 Удалить рассылку", 
-            callback_data=f"broadcast_delete_{broadcast.id}"
+            text="📤 Отправить сейчас", 
+            callback_data=f"broadcast_send_now_{broadcast.id}"
         )])
+    
+    # Управление выполняющейся рассылкой
+    if broadcast.status == "sending":
+        kb.append([
+            InlineKeyboardButton(text="⏸ Пауза", callback_data=f"broadcast_pause_{broadcast.id}"),
+            InlineKeyboardButton(text="🚫 Отменить", callback_data=f"broadcast_cancel_{broadcast.id}")
+        ])
+    elif broadcast.status == "paused":
+        kb.append([
+            InlineKeyboardButton(text="▶️ Продолжить", callback_data=f"broadcast_resume_{broadcast.id}"),
+            InlineKeyboardButton(text="🚫 Отменить", callback_data=f"broadcast_cancel_{broadcast.id}")
+        ])
+    
+    if run:
+        kb.append([
+            InlineKeyboardButton(text="🐢 Медленнее", callback_data=f"broadcast_rate_down_{broadcast.id}"),
+            InlineKeyboardButton(text="🐇 Быстрее", callback_data=f"broadcast_rate_up_{broadcast.id}")
+        ])
+        kb.append([InlineKeyboardButton(text="🔄 Обновить", callback_data=f"broadcast_details_{broadcast.id}")])
         
-        # Кнопка возврата
-        kb.append([InlineKeyboardButton(text="🔙 К активным рассылкам", callback_data="active_broadcasts")])
-        
-        # Отправляем сообщение
+    # Добавляем кнопку удаления
+    kb.append([InlineKeyboardButton(
+        text="🗑 Удалить рассылку", 
+        callback_data=f"broadcast_delete_{broadcast.id}"
+    )])
+    
+    # Кнопка возврата
+    kb.append([InlineKeyboardButton(text="🔙 К активным рассылкам", callback_data="active_broadcasts")])
+    
+    # Отправляем сообщение
+    try:
+        await callback.message.edit_text(
+            text,
+            reply_markup=InlineKeyboardMarkup(inline_keyboard=kb)
+        )
+    except Exception as e:
+        logging.error(f"Error editing message in broadcast_details: {e}")
+        # Если текст слишком длинный, отправляем сокращенную версию
         try:
             await callback.message.edit_text(
-                text,
+                f"📊 Детали рассылки '{broadcast.name}'\n\n"
+                f"Статус: {status_emoji} {status_text}\n"
+                f"Получатели: {broadcast.received_count}/{broadcast.total_users}\n\n"
+                "Сообщение слишком длинное для отображения.",
                 reply_markup=InlineKeyboardMarkup(inline_keyboard=kb)
             )
-        except Exception as e:
-            logging.error(f"Error editing message in broadcast_details: {e}")
-            # Если текст слишком длинный, отправляем сокращенную версию
-            try:
-                await callback.message.edit_text(
-                    f"📊 Детали рассылки '{broadcast.name}'\n\n"
-                    f"Статус: {status_emoji} {status_text}\n"
-                    f"Получатели: {broadcast.received_count}/{broadcast.total_users}\n\n"
-                    "Сообщение слишком длинное для отображения.",
-                    reply_markup=InlineKeyboardMarkup(inline_keyboard=kb)
-                )
-            except Exception as e2:
-                logging.error(f"Error sending shortened message: {e2}")
-                await callback.answer("Ошибка отображения деталей рассылки")
-        
-        await callback.answer()
+        except Exception as e2:
+            logging.error(f"Error sending shortened message: {e2}")
+            await callback.answer("Ошибка отображения деталей рассылки")
+    
+    await callback.answer()
 
 @router.callback_query(F.data.startswith("broadcast_send_now_"))
 async def broadcast_send_now_scheduled(callback: CallbackQuery):
@@ -915,32 +1089,22 @@ async def broadcast_send_now_scheduled(callback: CallbackQuery):
     
     broadcast_id = int(callback.data.split("_")[-1])
     
-    async with async_session() as session:
-        # Получаем рассылку
-        broadcast_result = await session.execute(select(Broadcast).where(Broadcast.id == broadcast_id))
-        broadcast = broadcast_result.scalar_one_or_none()
-        
-        if not broadcast:
-            await callback.answer("Рассылка не найдена")
-            return
-        
-        # Проверяем, что рассылка еще не отправлена
-        if broadcast.status != "created":
-            await callback.answer("Эта рассылка уже в процессе отправки или завершена")
-            return
-        
-        # Меняем статус на "sending"
-        broadcast.status = "sending"
-        await session.commit()
-        
-        # Запускаем процесс рассылки
-        asyncio.create_task(
-            send_broadcast(
-                callback.bot, 
-                broadcast.id, 
-                callback.from_user.id
-            )
+    # Атомарно захватываем рассылку: если ее уже запустил планировщик или другой экземпляр бота, ничего не делаем
+    if await claim_broadcast(broadcast_id, ["created"]) is None:
+        await callback.answer("Эта рассылка уже в процессе отправки или завершена")
+        return
+    
+    # Убираем рассылку из расписания, чтобы планировщик не запустил ее повторно
+    scheduler.cancel(broadcast_id)
+    
+    # Запускаем процесс рассылки
+    asyncio.create_task(
+        send_broadcast(
+            callback.bot, 
+            broadcast_id, 
+            callback.from_user.id
         )
+    )
     
     await callback.message.edit_text(
         "✅ Рассылка запущена!\n\n"
@@ -954,6 +1118,115 @@ async def broadcast_send_now_scheduled(callback: CallbackQuery):
     
     await callback.answer()
 
+async def update_broadcast_status(broadcast_id: int, status: str, from_statuses: list, session: AsyncSession) -> bool:
+    """Меняет статус рассылки, если текущий статус входит в from_statuses"""
+    result = await session.execute(
+        update(Broadcast)
+        .where(Broadcast.id == broadcast_id, Broadcast.status.in_(from_statuses))
+        .values(status=status)
+    )
+    await session.commit()
+    return result.rowcount > 0
+
+@router.callback_query(F.data.startswith("broadcast_pause_"))
+async def broadcast_pause(callback: CallbackQuery, session: AsyncSession):
+    """Приостановка рассылки"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("У вас нет доступа к этой функции")
+        return
+    
+    broadcast_id = int(callback.data.split("_")[-1])
+    run = broadcast_runtime.get_run(broadcast_id)
+    
+    if not run or not await update_broadcast_status(broadcast_id, "paused", ["sending"], session=session):
+        await callback.answer("Рассылка сейчас не отправляется")
+        return
+    
+    run.pause()
+    await broadcast_details(callback, session=session)
+
+@router.callback_query(F.data.startswith("broadcast_resume_"))
+async def broadcast_resume(callback: CallbackQuery, session: AsyncSession):
+    """Продолжение приостановленной рассылки"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("У вас нет доступа к этой функции")
+        return
+    
+    broadcast_id = int(callback.data.split("_")[-1])
+    
+    run = broadcast_runtime.get_run(broadcast_id)
+    if run:
+        if not await update_broadcast_status(broadcast_id, "sending", ["paused"], session=session):
+            await callback.answer("Рассылка не на паузе")
+            return
+        run.resume()
+    else:
+        # Рассылка была приостановлена до перезапуска бота - захватываем и запускаем ее с контрольной точки
+        if await claim_broadcast(broadcast_id, ["paused"], takeover_own=True) is None:
+            await callback.answer("Рассылка не на паузе или выполняется другим экземпляром бота")
+            return
+        asyncio.create_task(send_broadcast(callback.bot, broadcast_id, callback.from_user.id))
+    
+    await broadcast_details(callback, session=session)
+
+@router.callback_query(F.data.startswith("broadcast_cancel_"))
+async def broadcast_cancel(callback: CallbackQuery, session: AsyncSession):
+    """Отмена выполняющейся или приостановленной рассылки"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("У вас нет доступа к этой функции")
+        return
+    
+    broadcast_id = int(callback.data.split("_")[-1])
+    run = broadcast_runtime.get_run(broadcast_id)
+    
+    if run:
+        # Статус "cancelled" запишет сама задача рассылки после остановки
+        run.cancel()
+    elif not await update_broadcast_status(broadcast_id, "cancelled", ["sending", "paused"], session=session):
+        await callback.answer("Эту рассылку нельзя отменить")
+        return
+    
+    await callback.message.edit_text(
+        "🚫 Рассылка отменена.\n\n"
+        "Уже отправленные сообщения остаются у получателей.",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="📊 Активные рассылки", callback_data="active_broadcasts")],
+            [InlineKeyboardButton(text="🔙 В меню рассылок", callback_data="admin_broadcasts")]
+        ])
+    )
+    
+    await callback.answer()
+
+# Шаг изменения скорости рассылки, сообщений в секунду
+RATE_STEP = 5
+
+@router.callback_query(F.data.startswith("broadcast_rate_"))
+async def broadcast_change_rate(callback: CallbackQuery, session: AsyncSession):
+    """Изменение скорости выполняющейся рассылки"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("У вас нет доступа к этой функции")
+        return
+    
+    _, _, direction, broadcast_id = callback.data.split("_")
+    broadcast_id = int(broadcast_id)
+    run = broadcast_runtime.get_run(broadcast_id)
+    
+    if not run:
+        await callback.answer("Рассылка сейчас не отправляется")
+        return
+    
+    step = RATE_STEP if direction == "up" else -RATE_STEP
+    rate = int(min(max(run.sender.rate + step, 1), GLOBAL_RATE))
+    run.set_rate(rate)
+    
+    # Сохраняем скорость, чтобы она сохранилась при продолжении после перезапуска
+    await session.execute(
+        update(Broadcast).where(Broadcast.id == broadcast_id).values(rate_limit=rate)
+    )
+    await session.commit()
+    
+    await broadcast_details(callback, session=session)
+
 @router.callback_query(F.data.startswith("broadcast_delete_"))
 async def broadcast_delete(callback: CallbackQuery):
     """Удаление рассылки"""
@@ -979,7 +1252,7 @@ async def broadcast_delete(callback: CallbackQuery):
     await callback.answer()
 
 @router.callback_query(F.data.startswith("confirm_delete_broadcast_"))
-async def confirm_delete_broadcast(callback: CallbackQuery):
+async def confirm_delete_broadcast(callback: CallbackQuery, session: AsyncSession):
     """Подтверждение удаления рассылки"""
     if not is_admin(callback.from_user.id):
         await callback.answer("У вас нет доступа к этой функции")
@@ -987,24 +1260,25 @@ async def confirm_delete_broadcast(callback: CallbackQuery):
     
     broadcast_id = int(callback.data.split("_")[-1])
     
-    async with async_session() as session:
-        # Получаем рассылку
-        broadcast_result = await session.execute(select(Broadcast).where(Broadcast.id == broadcast_id))
-        broadcast = broadcast_result.scalar_one_or_none()
-        
-        if not broadcast:
-            await callback.answer("Рассылка не найдена")
-            return
-        
-        # Удаляем получателей рассылки
-        await session.execute(
-            "DELETE FROM broadcast_recipients WHERE broadcast_id = :broadcast_id",
-            {"broadcast_id": broadcast_id}
-        )
-        
-        # Удаляем саму рассылку
-        await session.delete(broadcast)
-        await session.commit()
+    # Получаем рассылку
+    broadcast_result = await session.execute(select(Broadcast).where(Broadcast.id == broadcast_id))
+    broadcast = broadcast_result.scalar_one_or_none()
+    
+    if not broadcast:
+        await callback.answer("Рассылка не найдена")
+        return
+    
+    # Удаляем получателей рассылки
+    await session.execute(
+        delete(BroadcastRecipient).where(BroadcastRecipient.broadcast_id == broadcast_id)
+    )
+    
+    # Удаляем саму рассылку
+    await session.delete(broadcast)
+    await session.commit()
+    
+    # Убираем рассылку из расписания
+    scheduler.cancel(broadcast_id)
     
     await callback.message.edit_text(
         "✅ Рассылка удалена!\n\n"
@@ -1018,117 +1292,142 @@ async def confirm_delete_broadcast(callback: CallbackQuery):
     await callback.answer()
 
 @router.callback_query(F.data == "broadcast_history")
-async def broadcast_history(callback: CallbackQuery):
+async def broadcast_history(callback: CallbackQuery, session: AsyncSession):
     """История рассылок"""
     if not is_admin(callback.from_user.id):
         await callback.answer("У вас нет доступа к этой функции")
         return
     
-    async with async_session() as session:
-        # Получаем завершенные рассылки
-        history_query = select(Broadcast).where(
-            Broadcast.status.in_(["completed", "failed"])
-        ).order_by(desc(Broadcast.sent_at)).limit(10)
-        
-        result = await session.execute(history_query)
-        broadcasts = result.scalars().all()
-        
-        if not broadcasts:
-            await callback.message.edit_text(
-                "📈 История рассылок\n\n"
-                "В истории нет завершенных рассылок.",
-                reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                    [InlineKeyboardButton(text="📝 Создать рассылку", callback_data="create_broadcast")],
-                    [InlineKeyboardButton(text="🔙 В меню рассылок", callback_data="admin_broadcasts")]
-                ])
-            )
-            await callback.answer()
-            return
-        
-        text = "📈 История рассылок:\n\n"
-        
-        kb = []
-        
-        for i, broadcast in enumerate(broadcasts, 1):
-            status_emoji = "✅" if broadcast.status == "completed" else "❌"
-            
-            text += (
-                f"{i}. {status_emoji} {broadcast.name}\n"
-                f"   Отправлена: {broadcast.sent_at.strftime('%d.%m.%Y %H:%M')}\n"
-                f"   Получили: {broadcast.received_count}/{broadcast.total_users}\n\n"
-            )
-            
-            # Добавляем кнопку для каждой рассылки
-            kb.append([InlineKeyboardButton(
-                text=f"{status_emoji} {broadcast.name}", 
-                callback_data=f"broadcast_details_{broadcast.id}"
-            )])
-        
-        kb.append([InlineKeyboardButton(text="🔙 В меню рассылок", callback_data="admin_broadcasts")])
-        
+    # Получаем завершенные рассылки
+    history_query = select(Broadcast).where(
+        Broadcast.status.in_(["completed", "failed"])
+    ).order_by(desc(Broadcast.sent_at)).limit(10)
+    
+    result = await session.execute(history_query)
+    broadcasts = result.scalars().all()
+    
+    if not broadcasts:
         await callback.message.edit_text(
-            text,
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=kb)
+            "📈 История рассылок\n\n"
+            "В истории нет завершенных рассылок.",
+            reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+                [InlineKeyboardButton(text="📝 Создать рассылку", callback_data="create_broadcast")],
+                [InlineKeyboardButton(text="🔙 В меню рассылок", callback_data="admin_broadcasts")]
+            ])
         )
-        
         await callback.answer()
+        return
+    
+    text = "📈 История рассылок:\n\n"
+    
+    kb = []
+    
+    for i, broadcast in enumerate(broadcasts, 1):
+        status_emoji = "✅" if broadcast.status == "completed" else "❌"
+        
+        text += (
+            f"{i}. {status_emoji} {broadcast.name}\n"
+            f"   Отправлена: {broadcast.sent_at.strftime('%d.%m.%Y %H:%M')}\n"
+            f"   Получили: {broadcast.received_count}/{broadcast.total_users}\n\n"
+        )
+        
+        # Добавляем кнопку для каждой рассылки
+        kb.append([InlineKeyboardButton(
+            text=f"{status_emoji} {broadcast.name}", 
+            callback_data=f"broadcast_details_{broadcast.id}"
+        )])
+    
+    kb.append([InlineKeyboardButton(text="🔙 В меню рассылок", callback_data="admin_broadcasts")])
+    
+    await callback.message.edit_text(
+        text,
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=kb)
+    )
+    
+    await callback.answer()
 
 @router.callback_query(F.data.startswith("broadcast_stats_"))
-async def broadcast_stats(callback: CallbackQuery):
+async def broadcast_stats(callback: CallbackQuery, session: AsyncSession):
     """Показывает статистику рассылки после завершения"""
     if not is_admin(callback.from_user.id):
         await callback.answer("У вас нет доступа к этой функции")
         return
     
     # Вызываем детали рассылки
-    await broadcast_details(callback)
+    await broadcast_details(callback, session=session)
+
+async def launch_scheduled_broadcast(bot, broadcast_id: int):
+    """Запускает запланированную рассылку, когда наступило ее время"""
+    # Меняем статус на "sending" только если рассылку еще никто не запустил (в том числе другой экземпляр бота)
+    broadcast_name = await claim_broadcast(broadcast_id, ["created"])
+    if broadcast_name is None:
+        return
+    
+    # Запускаем отправку
+    asyncio.create_task(send_broadcast(bot, broadcast_id, ADMIN_ID))
+    
+    # Уведомляем админа
+    try:
+        await bot.send_message(
+            chat_id=ADMIN_ID,
+            text=f"🔔 Запланированная рассылка '{broadcast_name}' начала отправку.",
+            parse_mode="HTML"
+        )
+    except Exception as e:
+        logging.error(f"Error notifying admin about scheduled broadcast: {e}")
+
+async def resume_interrupted_broadcasts(bot, takeover_own: bool = False):
+    """
+    Продолжает рассылки, брошенные остановившимся экземпляром бота (аренда просрочена),
+    и запускает запланированные рассылки, которые он не успел начать.
+    :param takeover_own: Забрать и рассылки этого экземпляра, прерванные его перезапуском
+    """
+    try:
+        async with async_session() as session:
+            abandoned = lease_expired()
+            if takeover_own:
+                abandoned = or_(abandoned, Broadcast.claimed_by == INSTANCE_ID)
+            result = await session.execute(
+                select(Broadcast.id).where(Broadcast.status == "sending", abandoned)
+            )
+            broadcast_ids = result.scalars().all()
+            
+            # Запланированные рассылки, просроченные дольше аренды: их планировщик не сработал
+            overdue_result = await session.execute(
+                select(Broadcast.id).where(
+                    Broadcast.status == "created",
+                    Broadcast.scheduled_at <= datetime.now() - timedelta(seconds=LEASE_TIMEOUT)
+                )
+            )
+            overdue_ids = overdue_result.scalars().all()
+    except Exception as e:
+        logging.error(f"Error loading interrupted broadcasts: {e}")
+        return
+    
+    for broadcast_id in broadcast_ids:
+        # Рассылки, которые отправляет этот экземпляр, не трогаем
+        if broadcast_runtime.get_run(broadcast_id):
+            continue
+        if await claim_broadcast(broadcast_id, ["sending"], takeover_own=takeover_own) is None:
+            continue
+        logging.info(f"Recovering interrupted broadcast {broadcast_id}")
+        asyncio.create_task(send_broadcast(bot, broadcast_id, ADMIN_ID))
+    
+    for broadcast_id in overdue_ids:
+        await launch_scheduled_broadcast(bot, broadcast_id)
 
-# Добавляем фоновую задачу для проверки и отправки запланированных рассылок
-async def check_scheduled_broadcasts(bot):
-    """Периодически проверяет запланированные рассылки и отправляет их при наступлении времени"""
+async def watch_broadcast_leases(bot):
+    """Периодически подбирает рассылки, брошенные другими экземплярами бота"""
+    await resume_interrupted_broadcasts(bot, takeover_own=True)
     while True:
+        await asyncio.sleep(LEASE_TIMEOUT)
         try:
-            async with async_session() as session:
-                # Получаем запланированные рассылки, время которых уже наступило
-                now = datetime.now()
-                scheduled_query = select(Broadcast).where(
-                    and_(
-                        Broadcast.status == "created",
-                        Broadcast.scheduled_at <= now
-                    )
-                )
-                
-                result = await session.execute(scheduled_query)
-                broadcasts = result.scalars().all()
-                
-                for broadcast in broadcasts:
-                    # Меняем статус на "sending"
-                    broadcast.status = "sending"
-                    await session.commit()
-                    
-                    # Получаем админский ID из переменных окружения
-                    admin_id = int(os.getenv("ADMIN_ID", "5385155120"))
-                    
-                    # Запускаем отправку
-                    asyncio.create_task(send_broadcast(bot, broadcast.id, admin_id))
-                    
-                    # Уведомляем админа
-                    try:
-                        await bot.send_message(
-                            chat_id=admin_id,
-                            text=f"🔔 Запланированная рассылка '{broadcast.name}' начала отправку.",
-                            parse_mode="HTML"
-                        )
-                    except Exception as e:
-                        logging.error(f"Error notifying admin about scheduled broadcast: {e}")
-        
+            await resume_interrupted_broadcasts(bot)
         except Exception as e:
-            logging.error(f"Error checking scheduled broadcasts: {e}")
-        
-        # Проверяем раз в минуту
-        await asyncio.sleep(60)
-        
+            logging.error(f"Error recovering broadcasts: {e}")
+
 # Функция для запуска фоновой задачи при старте бота
 def start_broadcast_scheduler(bot):
-    """Запускает планировщик рассылок"""
-    asyncio.create_task(check_scheduled_broadcasts(bot)) 
\ No newline at end of file
+    """Запускает планировщик рассылок и восстанавливает прерванные рассылки"""
+    asyncio.create_task(watch_broadcast_leases(bot))
+    asyncio.create_task(scheduler.start(lambda broadcast_id: launch_scheduled_broadcast(bot, broadcast_id)))
@@ -3,11 +3,11 @@ from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKe
 from aiogram.types import LabeledPrice, PreCheckoutQuery
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
-from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from ..states.states import CustomStarsAmount, DonationComment
 from ..keyboards.inline import get_stars_payment_kb
-from ..models.base import async_session
 from ..models.models import User, Donation
+from ..services.identity import get_user_snapshot
 import os
 
 router = Router()
@@ -156,7 +156,7 @@ async def pre_checkout_handler(pre_checkout_query: PreCheckoutQuery):
     await pre_checkout_query.answer(ok=True)
 
 @router.message(F.successful_payment)
-async def success_payment_handler(message: Message):
+async def success_payment_handler(message: Message, session: AsyncSession):
     """Обработчик успешного платежа"""
     payment = message.successful_payment
     amount = payment.total_amount
@@ -176,23 +176,21 @@ async def success_payment_handler(message: Message):
     
     # Пытаемся сохранить информацию о пожертвовании в БД
     try:
-        async with async_session() as session:
-            result = await session.execute(select(User).where(User.telegram_id == message.from_user.id))
-            user = result.scalar_one_or_none()
-            
-            # Если пользователя нет, создаем его
-            if not user:
-                user = User(telegram_id=message.from_user.id)
-                session.add(user)
-                await session.flush()  # Получаем ID пользователя
-            
-            donation = Donation(
-                user_id=user.id,
-                amount=amount,
-                comment=comment
-            )
-            session.add(donation)
-            await session.commit()
+        user = await get_user_snapshot(session, message.from_user.id)
+        
+        # Если пользователя нет, создаем его
+        if not user:
+            user = User(telegram_id=message.from_user.id)
+            session.add(user)
+            await session.flush()  # Получаем ID пользователя
+        
+        donation = Donation(
+            user_id=user.id,
+            amount=amount,
+            comment=comment
+        )
+        session.add(donation)
+        await session.commit()
     except Exception as e:
         print(f"Ошибка при сохранении пожертвования: {e}")
         # Не прерываем выполнение, даже если произошла ошибка с БД
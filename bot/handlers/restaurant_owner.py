@@ -1,15 +1,19 @@
 import random
 import string
 import logging
+from functools import lru_cache
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from sqlalchemy import select, func, and_
+from sqlalchemy.ext.asyncio import AsyncSession
 from ..states.states import RestaurantCreation, MenuItemForm, EditMenuItem, RestaurantSettings
-from ..models.base import async_session
 from ..models.models import User, Restaurant, MenuItem
+from ..services.identity import get_user_snapshot
+from ..services.principal import Principal
 from ..keyboards.inline import get_payment_type_kb
+from ..services.menu import get_menu, forget_menu, bump_menu_version
 from ..keyboards.reply import get_main_menu
 from datetime import datetime
 
@@ -40,6 +44,7 @@ async def generate_unique_invite_code(session, length=8):
     # увеличиваем длину кода и пробуем снова
     return await generate_unique_invite_code(session, length + 1)
 
+@lru_cache(maxsize=None)
 def get_restaurant_admin_kb():
     kb = [
         [
@@ -53,133 +58,113 @@ def get_restaurant_admin_kb():
     ]
     return InlineKeyboardMarkup(inline_keyboard=kb)
 
-async def manage_menu_command(message: Message, state: FSMContext):
-    """Вспомогательная функция для возврата к управлению меню после редактирования"""
-    await state.clear()
-    
-    async with async_session() as session:
-        # Получаем пользователя
-        result = await session.execute(select(User).where(User.telegram_id == message.from_user.id))
-        user = result.scalar_one_or_none()
-        
-        if not user or not user.is_restaurant_owner:
-            await message.answer("У вас нет ресторана!")
-            return
-        
-        # Получаем ресторан пользователя
-        result = await session.execute(select(Restaurant).where(Restaurant.owner_id == user.id))
-        restaurant = result.scalar_one_or_none()
-        
-        if not restaurant:
-            await message.answer("Ресторан не найден. Попробуйте создать новый.")
-            return
-        
-        # Получаем меню ресторана
-        result = await session.execute(select(MenuItem).where(MenuItem.restaurant_id == restaurant.id))
-        menu_items = result.scalars().all()
-        
-        if not menu_items:
-            kb = [[InlineKeyboardButton(text="📝 Добавить позицию", callback_data="add_item")]]
-            await message.answer(
-                "В вашем меню пока нет позиций!",
-                reply_markup=InlineKeyboardMarkup(inline_keyboard=kb)
-            )
-            return
-        
-        # Создаем клавиатуру с позициями в два столбца
+def get_owner_menu_kb(menu):
+    """Клавиатура управления меню: редактирование и удаление позиции в одном ряду (одна на версию меню)"""
+    def build():
         kb = []
-        
-        # Группируем по 2 кнопки в ряд (редактирование и удаление в одном ряду)
-        for item in menu_items:
-            row = [
-                InlineKeyboardButton(
-                    text=f"✏️ {item.name}",
-                    callback_data=f"edit_menu_item:{item.id}"
-                ),
-                InlineKeyboardButton(
-                    text=f"🗑️ {item.name}",
-                    callback_data=f"delete_item:{item.id}"
-                )
-            ]
-            kb.append(row)
-        
+        for item in menu.items:
+            kb.append([
+                InlineKeyboardButton(text=f"✏️ {item.name}", callback_data=f"edit_menu_item:{item.id}"),
+                InlineKeyboardButton(text=f"🗑️ {item.name}", callback_data=f"delete_item:{item.id}")
+            ])
         kb.append([InlineKeyboardButton(text="📝 Добавить позицию", callback_data="add_item")])
         kb.append([InlineKeyboardButton(text="⬅️ Назад", callback_data="back_to_restaurant")])
-        
+        return InlineKeyboardMarkup(inline_keyboard=kb)
+    return menu.markup("owner", build)
+
+async def manage_menu_command(message: Message, state: FSMContext, session: AsyncSession, principal: Principal):
+    """Вспомогательная функция для возврата к управлению меню после редактирования"""
+    await state.clear()
+    
+    # Проверка владельца по снимку пользователя, меню ресторана - из кэша
+    user = await principal.identity()
+    
+    if not user or not user.is_restaurant_owner:
+        await message.answer("У вас нет ресторана!")
+        return
+    
+    if not user.restaurant_id:
+        await message.answer("Ресторан не найден. Попробуйте создать новый.")
+        return
+    
+    menu = await get_menu(session, user.restaurant_id)
+    menu_items = menu.items if menu else ()
+    
+    if not menu_items:
+        kb = [[InlineKeyboardButton(text="📝 Добавить позицию", callback_data="add_item")]]
         await message.answer(
-            "Управление меню:\nНажмите на позицию для редактирования или удаления:",
+            "В вашем меню пока нет позиций!",
             reply_markup=InlineKeyboardMarkup(inline_keyboard=kb)
         )
+        return
+    
+    await message.answer(
+        "Управление меню:\nНажмите на позицию для редактирования или удаления:",
+        reply_markup=get_owner_menu_kb(menu)
+    )
 
 @router.message(F.text == "🍴 Создать ресторан")
-async def create_restaurant_start(message: Message, state: FSMContext):
-    await handle_restaurant_button(message, state)
+async def create_restaurant_start(message: Message, state: FSMContext, session: AsyncSession, principal: Principal):
+    await handle_restaurant_button(message, state, session=session, principal=principal)
 
 @router.message(F.text == "🍴 Мой ресторан")
-async def my_restaurant(message: Message, state: FSMContext):
-    await handle_restaurant_button(message, state)
+async def my_restaurant(message: Message, state: FSMContext, session: AsyncSession, principal: Principal):
+    await handle_restaurant_button(message, state, session=session, principal=principal)
 
-async def handle_restaurant_button(message: Message, state: FSMContext):
+async def handle_restaurant_button(message: Message, state: FSMContext, session: AsyncSession, principal: Principal):
     """Общая функция для обработки кнопок создания и управления рестораном"""
-    async with async_session() as session:
-        result = await session.execute(select(User).where(User.telegram_id == message.from_user.id))
-        user = result.scalar_one_or_none()
+    user = await principal.identity()
+    
+    if not user:
+        # Если пользователя нет в БД, создаем его
+        user = User(telegram_id=message.from_user.id)
+        session.add(user)
+        await session.commit()
         
-        if not user:
-            # Если пользователя нет в БД, создаем его
-            user = User(telegram_id=message.from_user.id)
-            session.add(user)
-            await session.commit()
-            
-            # Сразу же переходим к созданию ресторана
-            await state.set_state(RestaurantCreation.waiting_for_name)
-            await message.answer("Добро пожаловать! Введите название вашего ресторана:")
-            return
+        # Сразу же переходим к созданию ресторана
+        await state.set_state(RestaurantCreation.waiting_for_name)
+        await message.answer("Добро пожаловать! Введите название вашего ресторана:")
+        return
+    
+    # Проверяем, есть ли у пользователя ресторан (загружается, только если он есть)
+    try:
+        restaurant = await principal.restaurant()
         
-        # Проверяем, есть ли у пользователя ресторан
-        try:
-            # Отдельным запросом проверяем наличие ресторана
-            result = await session.execute(
-                select(Restaurant).where(Restaurant.owner_id == user.id)
+        if restaurant:
+            # Если ресторан есть, показываем меню управления
+            await message.answer(
+                f"🍴 Ваш ресторан: {restaurant.name}\n\n"
+                f"🔑 Код приглашения: {restaurant.invite_code}\n"
+                f"🔗 Ссылка для приглашения: t.me/{(await message.bot.me()).username}?start={restaurant.invite_code}\n\n"
+                f"Выберите действие:",
+                reply_markup=get_restaurant_admin_kb()
             )
-            restaurant = result.scalar_one_or_none()
-            
-            if restaurant:
-                # Если ресторан есть, показываем меню управления
-                await message.answer(
-                    f"🍴 Ваш ресторан: {restaurant.name}\n\n"
-                    f"🔑 Код приглашения: {restaurant.invite_code}\n"
-                    f"🔗 Ссылка для приглашения: t.me/{(await message.bot.me()).username}?start={restaurant.invite_code}\n\n"
-                    f"Выберите действие:",
-                    reply_markup=get_restaurant_admin_kb()
-                )
-                return
-        except Exception as e:
-            # Логируем ошибку и продолжаем
-            print(f"Ошибка при проверке ресторана: {e}")
+            return
+    except Exception as e:
+        # Логируем ошибку и продолжаем
+        print(f"Ошибка при проверке ресторана: {e}")
     
     # Если ресторана нет или произошла ошибка при проверке, создаем новый
     await state.set_state(RestaurantCreation.waiting_for_name)
     await message.answer("Введите название вашего ресторана:")
 
 @router.message(RestaurantCreation.waiting_for_name)
-async def process_restaurant_name(message: Message, state: FSMContext):
-    async with async_session() as session:
-        result = await session.execute(select(User).where(User.telegram_id == message.from_user.id))
-        user = result.scalar_one_or_none()
-        
-        # Create restaurant
-        invite_code = await generate_unique_invite_code(session)
-        restaurant = Restaurant(
-            name=message.text,
-            owner_id=user.id,
-            invite_code=invite_code
-        )
-        session.add(restaurant)
-        
-        # Update user
-        user.is_restaurant_owner = True
-        await session.commit()
+async def process_restaurant_name(message: Message, state: FSMContext, session: AsyncSession):
+    result = await session.execute(select(User).where(User.telegram_id == message.from_user.id))
+    user = result.scalar_one_or_none()
+    
+    # Create restaurant
+    invite_code = await generate_unique_invite_code(session)
+    restaurant = Restaurant(
+        name=message.text,
+        owner_id=user.id,
+        invite_code=invite_code
+    )
+    session.add(restaurant)
+    
+    # Update user
+    user.is_restaurant_owner = True
+    await session.commit()
     
     await state.clear()
     
@@ -321,143 +306,110 @@ async def skip_description(callback: CallbackQuery, state: FSMContext):
     )
 
 @router.callback_query(F.data == "manage_menu")
-async def manage_menu(callback: CallbackQuery):
+async def manage_menu(callback: CallbackQuery, session: AsyncSession, principal: Principal):
     # Просто отвечаем на callback, чтобы убрать "часики"
     await callback.answer()
     
-    async with async_session() as session:
-        # Получаем пользователя
-        result = await session.execute(select(User).where(User.telegram_id == callback.from_user.id))
-        user = result.scalar_one_or_none()
-        
-        if not user or not user.is_restaurant_owner:
-            await callback.message.answer("У вас нет ресторана!")
-            return
-        
-        # Получаем ресторан пользователя
-        result = await session.execute(select(Restaurant).where(Restaurant.owner_id == user.id))
-        restaurant = result.scalar_one_or_none()
-        
-        if not restaurant:
-            await callback.message.answer("Ресторан не найден. Попробуйте создать новый.")
-            return
-        
-        # Получаем меню ресторана
-        result = await session.execute(select(MenuItem).where(MenuItem.restaurant_id == restaurant.id))
-        menu_items = result.scalars().all()
-        
-        if not menu_items:
-            kb = [[InlineKeyboardButton(text="📝 Добавить позицию", callback_data="add_item")]]
-            await callback.message.answer(
-                "В вашем меню пока нет позиций!",
-                reply_markup=InlineKeyboardMarkup(inline_keyboard=kb)
-            )
-            return
-        
-        # Создаем клавиатуру с позициями в два столбца
-        kb = []
-        
-        # Группируем по 2 кнопки в ряд (редактирование и удаление в одном ряду)
-        for item in menu_items:
-            row = [
-                InlineKeyboardButton(
-                    text=f"✏️ {item.name}",
-                    callback_data=f"edit_menu_item:{item.id}"
-                ),
-                InlineKeyboardButton(
-                    text=f"🗑️ {item.name}",
-                    callback_data=f"delete_item:{item.id}"
-                )
-            ]
-            kb.append(row)
-        
-        kb.append([InlineKeyboardButton(text="📝 Добавить позицию", callback_data="add_item")])
-        kb.append([InlineKeyboardButton(text="⬅️ Назад", callback_data="back_to_restaurant")])
-        
+    # Проверка владельца по снимку пользователя, меню ресторана - из кэша
+    user = await principal.identity()
+    
+    if not user or not user.is_restaurant_owner:
+        await callback.message.answer("У вас нет ресторана!")
+        return
+    
+    if not user.restaurant_id:
+        await callback.message.answer("Ресторан не найден. Попробуйте создать новый.")
+        return
+    
+    menu = await get_menu(session, user.restaurant_id)
+    menu_items = menu.items if menu else ()
+    
+    if not menu_items:
+        kb = [[InlineKeyboardButton(text="📝 Добавить позицию", callback_data="add_item")]]
         await callback.message.answer(
-            "Управление меню:\nНажмите на позицию для редактирования или удаления:",
+            "В вашем меню пока нет позиций!",
             reply_markup=InlineKeyboardMarkup(inline_keyboard=kb)
         )
+        return
+    
+    await callback.message.answer(
+        "Управление меню:\nНажмите на позицию для редактирования или удаления:",
+        reply_markup=get_owner_menu_kb(menu)
+    )
 
 @router.callback_query(F.data == "back_to_restaurant")
-async def back_to_restaurant(callback: CallbackQuery):
+async def back_to_restaurant(callback: CallbackQuery, session: AsyncSession, principal: Principal):
     # Просто отвечаем на callback, чтобы убрать "часики"
     await callback.answer()
     
-    async with async_session() as session:
-        # Получаем пользователя
-        result = await session.execute(select(User).where(User.telegram_id == callback.from_user.id))
-        user = result.scalar_one_or_none()
-        
-        if not user or not user.is_restaurant_owner:
-            await callback.message.answer("У вас нет ресторана!")
-            return
-        
-        # Получаем ресторан пользователя
-        result = await session.execute(select(Restaurant).where(Restaurant.owner_id == user.id))
-        restaurant = result.scalar_one_or_none()
-        
-        if not restaurant:
-            await callback.message.answer("Ресторан не найден. Попробуйте создать новый.")
-            return
-        
-        await callback.message.edit_text(
-            f"🍴 Ваш ресторан: {restaurant.name}\n\n"
-            f"🔑 Код приглашения: {restaurant.invite_code}\n"
-            f"🔗 Ссылка для приглашения: t.me/{(await callback.bot.me()).username}?start={restaurant.invite_code}\n\n"
-            f"Выберите действие:",
-            reply_markup=get_restaurant_admin_kb()
-        )
+    # Проверка владельца по снимку пользователя, ресторан загружается только для владельца
+    user = await principal.identity()
+    
+    if not user or not user.is_restaurant_owner:
+        await callback.message.answer("У вас нет ресторана!")
+        return
+    
+    restaurant = await principal.restaurant()
+    
+    if not restaurant:
+        await callback.message.answer("Ресторан не найден. Попробуйте создать новый.")
+        return
+    
+    await callback.message.edit_text(
+        f"🍴 Ваш ресторан: {restaurant.name}\n\n"
+        f"🔑 Код приглашения: {restaurant.invite_code}\n"
+        f"🔗 Ссылка для приглашения: t.me/{(await callback.bot.me()).username}?start={restaurant.invite_code}\n\n"
+        f"Выберите действие:",
+        reply_markup=get_restaurant_admin_kb()
+    )
 
 @router.callback_query(F.data.startswith("edit_menu_item:"))
-async def edit_menu_item(callback: CallbackQuery, state: FSMContext):
+async def edit_menu_item(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
     """Редактирование позиции меню"""
     item_id = int(callback.data.split(":")[-1])
     
-    async with async_session() as session:
-        # Получаем позицию по ID
-        result = await session.execute(select(MenuItem).where(MenuItem.id == item_id))
-        item = result.scalar_one_or_none()
-        
-        if not item:
-            await callback.answer("Позиция не найдена")
-            return
-        
-        # Сохраняем ID позиции в состоянии
-        await state.update_data(edit_item_id=item_id)
-        
-        # Создаем клавиатуру для выбора, что редактировать
-        kb = [
-            [InlineKeyboardButton(text="📝 Название", callback_data=f"edit_field:name:{item_id}")],
-            [InlineKeyboardButton(text="📷 Фото", callback_data=f"edit_field:photo:{item_id}")],
-            [InlineKeyboardButton(text="📋 Описание", callback_data=f"edit_field:description:{item_id}")],
-            [InlineKeyboardButton(text="⏱ Длительность", callback_data=f"edit_field:duration:{item_id}")],
-            [InlineKeyboardButton(text="💰 Стоимость", callback_data=f"edit_field:price:{item_id}")],
-            [InlineKeyboardButton(text="◀️ Назад", callback_data=f"manage_menu")]
-        ]
-        
-        await callback.message.edit_text(
-            f"Редактирование позиции: {item.name}\n\n"
-            f"Выберите, что вы хотите изменить:",
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=kb)
-        )
-        await callback.answer()
+    # Получаем позицию по ID
+    result = await session.execute(select(MenuItem).where(MenuItem.id == item_id))
+    item = result.scalar_one_or_none()
+    
+    if not item:
+        await callback.answer("Позиция не найдена")
+        return
+    
+    # Сохраняем ID позиции в состоянии
+    await state.update_data(edit_item_id=item_id)
+    
+    # Создаем клавиатуру для выбора, что редактировать
+    kb = [
+        [InlineKeyboardButton(text="📝 Название", callback_data=f"edit_field:name:{item_id}")],
+        [InlineKeyboardButton(text="📷 Фото", callback_data=f"edit_field:photo:{item_id}")],
+        [InlineKeyboardButton(text="📋 Описание", callback_data=f"edit_field:description:{item_id}")],
+        [InlineKeyboardButton(text="⏱ Длительность", callback_data=f"edit_field:duration:{item_id}")],
+        [InlineKeyboardButton(text="💰 Стоимость", callback_data=f"edit_field:price:{item_id}")],
+        [InlineKeyboardButton(text="◀️ Назад", callback_data=f"manage_menu")]
+    ]
+    
+    await callback.message.edit_text(
+        f"Редактирование позиции: {item.name}\n\n"
+        f"Выберите, что вы хотите изменить:",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=kb)
+    )
+    await callback.answer()
 
 @router.callback_query(F.data.startswith("edit_field:"))
-async def edit_specific_field(callback: CallbackQuery, state: FSMContext):
+async def edit_specific_field(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
     """Редактирование конкретного поля позиции меню"""
     parts = callback.data.split(":")
     field = parts[1]
     item_id = int(parts[2])
     
-    async with async_session() as session:
-        # Получаем позицию по ID
-        result = await session.execute(select(MenuItem).where(MenuItem.id == item_id))
-        item = result.scalar_one_or_none()
-        
-        if not item:
-            await callback.answer("Позиция не найдена")
-            return
+    # Получаем позицию по ID
+    result = await session.execute(select(MenuItem).where(MenuItem.id == item_id))
+    item = result.scalar_one_or_none()
+    
+    if not item:
+        await callback.answer("Позиция не найдена")
+        return
     
     # Сохраняем информацию о редактируемом поле
     await state.update_data(edit_field=field, edit_item_id=item_id)
@@ -512,25 +464,25 @@ async def edit_specific_field(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
 @router.callback_query(F.data.startswith("remove_photo:"))
-async def remove_photo(callback: CallbackQuery, state: FSMContext):
+async def remove_photo(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
     """Удаление фото у позиции"""
     item_id = int(callback.data.split(":")[-1])
     
-    async with async_session() as session:
-        # Получаем позицию по ID
-        result = await session.execute(select(MenuItem).where(MenuItem.id == item_id))
-        item = result.scalar_one_or_none()
-        
-        if not item:
-            await callback.answer("Позиция не найдена")
-            return
-        
-        # Удаляем фото
-        item.photo = None
-        await session.commit()
-        
-        await callback.answer("Фото удалено")
-        await edit_menu_item(callback, state)  # Возвращаемся к редактированию
+    # Получаем позицию по ID
+    result = await session.execute(select(MenuItem).where(MenuItem.id == item_id))
+    item = result.scalar_one_or_none()
+    
+    if not item:
+        await callback.answer("Позиция не найдена")
+        return
+    
+    # Удаляем фото
+    item.photo = None
+    await bump_menu_version(session, item.restaurant_id)
+    await session.commit()
+    
+    await callback.answer("Фото удалено")
+    await edit_menu_item(callback, state, session=session)  # Возвращаемся к редактированию
 
 @router.callback_query(F.data.startswith("edit_payment_type:"))
 async def edit_payment_type(callback: CallbackQuery, state: FSMContext):
@@ -548,7 +500,7 @@ async def edit_payment_type(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
 @router.message(EditMenuItem.waiting_for_name)
-async def process_edit_name(message: Message, state: FSMContext):
+async def process_edit_name(message: Message, state: FSMContext, session: AsyncSession, principal: Principal):
     """Обработка ввода нового названия"""
     new_name = message.text
     data = await state.get_data()
@@ -558,53 +510,53 @@ async def process_edit_name(message: Message, state: FSMContext):
         await message.answer("Название не может быть пустым. Введите название:")
         return
     
-    async with async_session() as session:
-        # Получаем позицию по ID
-        result = await session.execute(select(MenuItem).where(MenuItem.id == item_id))
-        item = result.scalar_one_or_none()
-        
-        if not item:
-            await message.answer("Позиция не найдена")
-            await state.clear()
-            return
-        
-        # Обновляем название
-        item.name = new_name
-        await session.commit()
-        
-        await message.answer(f"✅ Название успешно изменено на '{new_name}'")
-        
-        # Возвращаемся к управлению меню
-        await manage_menu_command(message, state)
+    # Получаем позицию по ID
+    result = await session.execute(select(MenuItem).where(MenuItem.id == item_id))
+    item = result.scalar_one_or_none()
+    
+    if not item:
+        await message.answer("Позиция не найдена")
+        await state.clear()
+        return
+    
+    # Обновляем название
+    item.name = new_name
+    await bump_menu_version(session, item.restaurant_id)
+    await session.commit()
+    
+    await message.answer(f"✅ Название успешно изменено на '{new_name}'")
+    
+    # Возвращаемся к управлению меню
+    await manage_menu_command(message, state, session=session, principal=principal)
 
 @router.message(EditMenuItem.waiting_for_description)
-async def process_edit_description(message: Message, state: FSMContext):
+async def process_edit_description(message: Message, state: FSMContext, session: AsyncSession, principal: Principal):
     """Обработка ввода нового описания"""
     new_description = message.text
     data = await state.get_data()
     item_id = data.get("edit_item_id")
     
-    async with async_session() as session:
-        # Получаем позицию по ID
-        result = await session.execute(select(MenuItem).where(MenuItem.id == item_id))
-        item = result.scalar_one_or_none()
-        
-        if not item:
-            await message.answer("Позиция не найдена")
-            await state.clear()
-            return
-        
-        # Обновляем описание
-        item.description = new_description
-        await session.commit()
-        
-        await message.answer(f"✅ Описание успешно изменено")
-        
-        # Возвращаемся к управлению меню
-        await manage_menu_command(message, state)
+    # Получаем позицию по ID
+    result = await session.execute(select(MenuItem).where(MenuItem.id == item_id))
+    item = result.scalar_one_or_none()
+    
+    if not item:
+        await message.answer("Позиция не найдена")
+        await state.clear()
+        return
+    
+    # Обновляем описание
+    item.description = new_description
+    await bump_menu_version(session, item.restaurant_id)
+    await session.commit()
+    
+    await message.answer(f"✅ Описание успешно изменено")
+    
+    # Возвращаемся к управлению меню
+    await manage_menu_command(message, state, session=session, principal=principal)
 
 @router.message(EditMenuItem.waiting_for_photo)
-async def process_edit_photo(message: Message, state: FSMContext):
+async def process_edit_photo(message: Message, state: FSMContext, session: AsyncSession, principal: Principal):
     """Обработка загрузки нового фото"""
     data = await state.get_data()
     item_id = data.get("edit_item_id")
@@ -616,27 +568,27 @@ async def process_edit_photo(message: Message, state: FSMContext):
     # Получаем ID фото
     photo_id = message.photo[-1].file_id
     
-    async with async_session() as session:
-        # Получаем позицию по ID
-        result = await session.execute(select(MenuItem).where(MenuItem.id == item_id))
-        item = result.scalar_one_or_none()
-        
-        if not item:
-            await message.answer("Позиция не найдена")
-            await state.clear()
-            return
-        
-        # Обновляем фото
-        item.photo = photo_id
-        await session.commit()
-        
-        await message.answer("✅ Фото успешно изменено")
-        
-        # Возвращаемся к управлению меню
-        await manage_menu_command(message, state)
+    # Получаем позицию по ID
+    result = await session.execute(select(MenuItem).where(MenuItem.id == item_id))
+    item = result.scalar_one_or_none()
+    
+    if not item:
+        await message.answer("Позиция не найдена")
+        await state.clear()
+        return
+    
+    # Обновляем фото
+    item.photo = photo_id
+    await bump_menu_version(session, item.restaurant_id)
+    await session.commit()
+    
+    await message.answer("✅ Фото успешно изменено")
+    
+    # Возвращаемся к управлению меню
+    await manage_menu_command(message, state, session=session, principal=principal)
 
 @router.message(EditMenuItem.waiting_for_duration)
-async def process_edit_duration(message: Message, state: FSMContext):
+async def process_edit_duration(message: Message, state: FSMContext, session: AsyncSession, principal: Principal):
     """Обработка ввода новой длительности"""
     data = await state.get_data()
     item_id = data.get("edit_item_id")
@@ -661,24 +613,24 @@ async def process_edit_duration(message: Message, state: FSMContext):
         )
         return
     
-    async with async_session() as session:
-        # Получаем позицию по ID
-        result = await session.execute(select(MenuItem).where(MenuItem.id == item_id))
-        item = result.scalar_one_or_none()
-        
-        if not item:
-            await message.answer("Позиция не найдена")
-            await state.clear()
-            return
-        
-        # Обновляем длительность
-        item.duration = duration
-        await session.commit()
-        
-        await message.answer(f"✅ Длительность успешно изменена на {duration} мин")
-        
-        # Возвращаемся к управлению меню
-        await manage_menu_command(message, state)
+    # Получаем позицию по ID
+    result = await session.execute(select(MenuItem).where(MenuItem.id == item_id))
+    item = result.scalar_one_or_none()
+    
+    if not item:
+        await message.answer("Позиция не найдена")
+        await state.clear()
+        return
+    
+    # Обновляем длительность
+    item.duration = duration
+    await bump_menu_version(session, item.restaurant_id)
+    await session.commit()
+    
+    await message.answer(f"✅ Длительность успешно изменена на {duration} мин")
+    
+    # Возвращаемся к управлению меню
+    await manage_menu_command(message, state, session=session, principal=principal)
 
 @router.callback_query(F.data.startswith("payment_type:"))
 async def process_payment_type(callback: CallbackQuery, state: FSMContext):
@@ -714,7 +666,7 @@ async def process_payment_type(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
 @router.message(MenuItemForm.price_kisses)
-async def process_price_kisses(message: Message, state: FSMContext):
+async def process_price_kisses(message: Message, state: FSMContext, session: AsyncSession, principal: Principal):
     """Обработка ввода количества поцелуйчиков"""
     if not message.text.isdigit() or int(message.text) < 0:
         await message.answer(
@@ -741,10 +693,10 @@ async def process_price_kisses(message: Message, state: FSMContext):
         )
     else:
         # Иначе переходим сразу к созданию позиции
-        await create_menu_item(message, state)
+        await create_menu_item(message, state, session=session, principal=principal)
 
 @router.message(MenuItemForm.price_hugs)
-async def process_price_hugs(message: Message, state: FSMContext):
+async def process_price_hugs(message: Message, state: FSMContext, session: AsyncSession, principal: Principal):
     """Обработка ввода стоимости в минутах обнимашек"""
     if not message.text.isdigit() or int(message.text) < 0:
         await message.answer(
@@ -759,137 +711,127 @@ async def process_price_hugs(message: Message, state: FSMContext):
     await state.update_data(price_hugs=int(message.text))
     
     # Создаем позицию меню
-    await create_menu_item(message, state)
+    await create_menu_item(message, state, session=session, principal=principal)
 
 @router.callback_query(F.data == "cancel")
-async def cancel_operation(callback: CallbackQuery, state: FSMContext):
+async def cancel_operation(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
     """Отмена текущей операции"""
     await state.clear()
     await callback.message.answer("Операция отменена")
     
     # Возвращаемся к управлению рестораном
-    async with async_session() as session:
-        result = await session.execute(select(User).where(User.telegram_id == callback.from_user.id))
-        user = result.scalar_one_or_none()
-        
-        if user and user.is_restaurant_owner:
-            await callback.message.answer(
-                "Вы вернулись в управление рестораном. Выберите действие:",
-                reply_markup=get_restaurant_admin_kb()
-            )
+    user = await get_user_snapshot(session, callback.from_user.id)
+    
+    if user and user.is_restaurant_owner:
+        await callback.message.answer(
+            "Вы вернулись в управление рестораном. Выберите действие:",
+            reply_markup=get_restaurant_admin_kb()
+        )
     
     await callback.answer()
 
-async def create_menu_item(message: Message, state: FSMContext):
+async def create_menu_item(message: Message, state: FSMContext, session: AsyncSession, principal: Principal):
     """Создание новой позиции в меню после сбора всех данных"""
     data = await state.get_data()
     
-    async with async_session() as session:
-        # Получаем пользователя
-        result = await session.execute(select(User).where(User.telegram_id == message.from_user.id))
-        user = result.scalar_one_or_none()
-        
-        if not user:
-            await message.answer("Произошла ошибка при получении данных пользователя.")
-            await state.clear()
-            return
-        
-        # Получаем ресторан пользователя
-        result = await session.execute(select(Restaurant).where(Restaurant.owner_id == user.id))
-        restaurant = result.scalar_one_or_none()
-        
-        if not restaurant:
-            await message.answer("Ресторан не найден.")
-            await state.clear()
-            return
-        
-        # Создаем новую позицию меню
-        menu_item = MenuItem(
-            restaurant_id=restaurant.id,
-            name=data.get("name"),
-            photo=data.get("photo_id"),  # Обратите внимание на изменение с photo на photo_id
-            description=data.get("description"),
-            duration=data.get("duration")
-        )
-        
-        # Устанавливаем цены в зависимости от типа оплаты
-        menu_item.price_kisses = data.get("price_kisses")
-        menu_item.price_hugs = data.get("price_hugs")
-        
-        session.add(menu_item)
-        await session.commit()
+    # id ресторана пользователя - из снимка в кэше
+    user = await principal.identity()
+    
+    if not user:
+        await message.answer("Произошла ошибка при получении данных пользователя.")
+        await state.clear()
+        return
+    
+    restaurant_id = user.restaurant_id
+    
+    if not restaurant_id:
+        await message.answer("Ресторан не найден.")
+        await state.clear()
+        return
+    
+    # Создаем новую позицию меню
+    menu_item = MenuItem(
+        restaurant_id=restaurant_id,
+        name=data.get("name"),
+        photo=data.get("photo_id"),  # Обратите внимание на изменение с photo на photo_id
+        description=data.get("description"),
+        duration=data.get("duration")
+    )
+    
+    # Устанавливаем цены в зависимости от типа оплаты
+    menu_item.price_kisses = data.get("price_kisses")
+    menu_item.price_hugs = data.get("price_hugs")
+    
+    session.add(menu_item)
+    await bump_menu_version(session, restaurant_id)
+    await session.commit()
     
     # Очищаем состояние и отправляем сообщение об успехе
     await state.clear()
     await message.answer(f"✅ Позиция '{data.get('name')}' успешно добавлена в меню!")
     
     # Возвращаемся к управлению меню
-    await manage_menu_command(message, state)
+    await manage_menu_command(message, state, session=session, principal=principal)
 
 @router.callback_query(F.data == "restaurant_settings")
-async def restaurant_settings(callback: CallbackQuery):
+async def restaurant_settings(callback: CallbackQuery, session: AsyncSession, principal: Principal):
     """Настройки ресторана"""
     await callback.answer()
     
-    async with async_session() as session:
-        # Получаем пользователя
-        result = await session.execute(select(User).where(User.telegram_id == callback.from_user.id))
-        user = result.scalar_one_or_none()
-        
-        if not user or not user.is_restaurant_owner:
-            await callback.message.answer("У вас нет ресторана!")
-            return
-        
-        # Получаем ресторан пользователя
-        result = await session.execute(select(Restaurant).where(Restaurant.owner_id == user.id))
-        restaurant = result.scalar_one_or_none()
-        
-        if not restaurant:
-            await callback.message.answer("Ресторан не найден. Попробуйте создать новый.")
-            return
-        
-        # Создаем клавиатуру с настройками
-        kb = [
-            [InlineKeyboardButton(text="✏️ Изменить название", callback_data="edit_restaurant_name")],
-            [InlineKeyboardButton(text="🔄 Сгенерировать новый код приглашения", callback_data="regenerate_invite_code")],
-            [InlineKeyboardButton(text="🗑️ Удалить ресторан", callback_data="delete_restaurant")],
-            [InlineKeyboardButton(text="⬅️ Назад", callback_data="back_to_restaurant")]
-        ]
-        
-        await callback.message.edit_text(
-            f"⚙️ Настройки ресторана '{restaurant.name}':\n\n"
-            f"Текущее название: {restaurant.name}\n"
-            f"🔑 Код приглашения: {restaurant.invite_code}\n"
-            f"🔗 Ссылка для приглашения: t.me/{(await callback.bot.me()).username}?start={restaurant.invite_code}\n\n"
-            f"Выберите действие:",
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=kb)
-        )
+    # Проверка владельца по снимку пользователя, ресторан загружается только для владельца
+    user = await principal.identity()
+    
+    if not user or not user.is_restaurant_owner:
+        await callback.message.answer("У вас нет ресторана!")
+        return
+    
+    restaurant = await principal.restaurant()
+    
+    if not restaurant:
+        await callback.message.answer("Ресторан не найден. Попробуйте создать новый.")
+        return
+    
+    # Создаем клавиатуру с настройками
+    kb = [
+        [InlineKeyboardButton(text="✏️ Изменить название", callback_data="edit_restaurant_name")],
+        [InlineKeyboardButton(text="🔄 Сгенерировать новый код приглашения", callback_data="regenerate_invite_code")],
+        [InlineKeyboardButton(text="🗑️ Удалить ресторан", callback_data="delete_restaurant")],
+        [InlineKeyboardButton(text="⬅️ Назад", callback_data="back_to_restaurant")]
+    ]
+    
+    await callback.message.edit_text(
+        f"⚙️ Настройки ресторана '{restaurant.name}':\n\n"
+        f"Текущее название: {restaurant.name}\n"
+        f"🔑 Код приглашения: {restaurant.invite_code}\n"
+        f"🔗 Ссылка для приглашения: t.me/{(await callback.bot.me()).username}?start={restaurant.invite_code}\n\n"
+        f"Выберите действие:",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=kb)
+    )
 
 @router.callback_query(F.data == "edit_restaurant_name")
-async def edit_restaurant_name(callback: CallbackQuery, state: FSMContext):
+async def edit_restaurant_name(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
     """Изменение названия ресторана"""
     await callback.answer()
     
     # Получаем ресторан пользователя
-    async with async_session() as session:
-        result = await session.execute(
-            select(Restaurant).join(User, Restaurant.owner_id == User.id)
-            .where(User.telegram_id == callback.from_user.id)
-        )
-        restaurant = result.scalar_one_or_none()
-        
-        if not restaurant:
-            await callback.message.answer("Ресторан не найден.")
-            return
-        
-        await state.set_state(RestaurantSettings.waiting_for_new_name)
-        await callback.message.answer(
-            f"Текущее название ресторана: {restaurant.name}\n\n"
-            f"Введите новое название для вашего ресторана:"
-        )
+    result = await session.execute(
+        select(Restaurant).join(User, Restaurant.owner_id == User.id)
+        .where(User.telegram_id == callback.from_user.id)
+    )
+    restaurant = result.scalar_one_or_none()
+    
+    if not restaurant:
+        await callback.message.answer("Ресторан не найден.")
+        return
+    
+    await state.set_state(RestaurantSettings.waiting_for_new_name)
+    await callback.message.answer(
+        f"Текущее название ресторана: {restaurant.name}\n\n"
+        f"Введите новое название для вашего ресторана:"
+    )
 
 @router.message(RestaurantSettings.waiting_for_new_name)
-async def process_new_restaurant_name(message: Message, state: FSMContext):
+async def process_new_restaurant_name(message: Message, state: FSMContext, session: AsyncSession):
     """Обработка нового названия ресторана"""
     new_name = message.text.strip()
     
@@ -897,95 +839,94 @@ async def process_new_restaurant_name(message: Message, state: FSMContext):
         await message.answer("Название не может быть пустым. Пожалуйста, введите корректное название.")
         return
         
-    async with async_session() as session:
-        # Получаем ресторан пользователя
-        result = await session.execute(
-            select(Restaurant).join(User, Restaurant.owner_id == User.id)
-            .where(User.telegram_id == message.from_user.id)
-        )
-        restaurant = result.scalar_one_or_none()
-        
-        if not restaurant:
-            await message.answer("Ресторан не найден.")
-            await state.clear()
-            return
-        
-        # Сохраняем старое название для уведомления клиентов
-        old_name = restaurant.name
-        
-        # Обновляем название
-        restaurant.name = new_name
-        await session.commit()
-        
-        # Получаем список подключенных пользователей для уведомления
-        result = await session.execute(
-            select(User).where(User.current_restaurant_id == restaurant.id)
-        )
-        connected_users = result.scalars().all()
-        
-        # Уведомляем подключенных пользователей об изменении названия
-        bot = message.bot
-        for user in connected_users:
-            try:
-                await bot.send_message(
-                    user.telegram_id,
-                    f"🔔 Уведомление: ресторан '{old_name}' изменил название на '{new_name}'."
-                )
-            except Exception as e:
-                logging.error(f"Failed to notify user {user.telegram_id} about restaurant name change: {e}")
-        
+    # Получаем ресторан пользователя
+    result = await session.execute(
+        select(Restaurant).join(User, Restaurant.owner_id == User.id)
+        .where(User.telegram_id == message.from_user.id)
+    )
+    restaurant = result.scalar_one_or_none()
+    
+    if not restaurant:
+        await message.answer("Ресторан не найден.")
         await state.clear()
-        await message.answer(
-            f"✅ Название ресторана успешно изменено на '{new_name}'!\n"
-            f"Все подключенные клиенты ({len(connected_users)}) были уведомлены об изменении."
-        )
-        
-        # Показываем меню управления рестораном
-        await message.answer(
-            f"🍴 Ваш ресторан: {new_name}\n\n"
-            f"🔑 Код приглашения: {restaurant.invite_code}\n"
-            f"🔗 Ссылка для приглашения: t.me/{(await bot.me()).username}?start={restaurant.invite_code}\n\n"
-            f"Выберите действие:",
-            reply_markup=get_restaurant_admin_kb()
-        )
+        return
+    
+    # Сохраняем старое название для уведомления клиентов
+    old_name = restaurant.name
+    
+    # Обновляем название
+    restaurant.name = new_name
+    forget_menu(session, restaurant.id)
+    await session.commit()
+    
+    # Получаем список подключенных пользователей для уведомления
+    result = await session.execute(
+        select(User).where(User.current_restaurant_id == restaurant.id)
+    )
+    connected_users = result.scalars().all()
+    
+    # Уведомляем подключенных пользователей об изменении названия
+    bot = message.bot
+    for user in connected_users:
+        try:
+            await bot.send_message(
+                user.telegram_id,
+                f"🔔 Уведомление: ресторан '{old_name}' изменил название на '{new_name}'."
+            )
+        except Exception as e:
+            logging.error(f"Failed to notify user {user.telegram_id} about restaurant name change: {e}")
+    
+    await state.clear()
+    await message.answer(
+        f"✅ Название ресторана успешно изменено на '{new_name}'!\n"
+        f"Все подключенные клиенты ({len(connected_users)}) были уведомлены об изменении."
+    )
+    
+    # Показываем меню управления рестораном
+    await message.answer(
+        f"🍴 Ваш ресторан: {new_name}\n\n"
+        f"🔑 Код приглашения: {restaurant.invite_code}\n"
+        f"🔗 Ссылка для приглашения: t.me/{(await bot.me()).username}?start={restaurant.invite_code}\n\n"
+        f"Выберите действие:",
+        reply_markup=get_restaurant_admin_kb()
+    )
 
 @router.callback_query(F.data == "regenerate_invite_code")
-async def regenerate_invite_code(callback: CallbackQuery):
+async def regenerate_invite_code(callback: CallbackQuery, session: AsyncSession):
     """Генерация нового кода приглашения"""
     await callback.answer()
     
-    async with async_session() as session:
-        # Получаем ресторан пользователя
-        result = await session.execute(
-            select(Restaurant).join(User, Restaurant.owner_id == User.id)
-            .where(User.telegram_id == callback.from_user.id)
-        )
-        restaurant = result.scalar_one_or_none()
-        
-        if not restaurant:
-            await callback.message.answer("Ресторан не найден.")
-            return
-        
-        # Генерируем новый код
-        new_code = await generate_unique_invite_code(session)
-        
-        # Обновляем код приглашения
-        restaurant.invite_code = new_code
-        await session.commit()
-        
-        await callback.message.edit_text(
-            f"✅ Новый код приглашения сгенерирован!\n\n"
-            f"🍴 Ресторан: {restaurant.name}\n"
-            f"🔑 Новый код: {new_code}\n"
-            f"🔗 Ссылка для приглашения: t.me/{(await callback.bot.me()).username}?start={new_code}\n\n"
-            f"⚠️ Старый код больше не работает!",
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="⬅️ Назад к настройкам", callback_data="restaurant_settings")]
-            ])
-        )
+    # Получаем ресторан пользователя
+    result = await session.execute(
+        select(Restaurant).join(User, Restaurant.owner_id == User.id)
+        .where(User.telegram_id == callback.from_user.id)
+    )
+    restaurant = result.scalar_one_or_none()
+    
+    if not restaurant:
+        await callback.message.answer("Ресторан не найден.")
+        return
+    
+    # Генерируем новый код
+    new_code = await generate_unique_invite_code(session)
+    
+    # Обновляем код приглашения
+    restaurant.invite_code = new_code
+    await session.commit()
+    
+    await callback.message.edit_text(
+        f"✅ Новый код приглашения сгенерирован!\n\n"
+        f"🍴 Ресторан: {restaurant.name}\n"
+        f"🔑 Новый код: {new_code}\n"
+        f"🔗 Ссылка для приглашения: t.me/{(await callback.bot.me()).username}?start={new_code}\n\n"
+        f"⚠️ Старый код больше не работает!",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="⬅️ Назад к настройкам", callback_data="restaurant_settings")]
+        ])
+    )
 
 @router.callback_query(F.data == "manage_clients")
-async def manage_clients(callback: CallbackQuery, state: FSMContext):
+async def manage_clients(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
     """Управление клиентами ресторана"""
     await callback.answer()
     
@@ -996,97 +937,96 @@ async def manage_clients(callback: CallbackQuery, state: FSMContext):
     clients_per_page = 5
     offset = (page - 1) * clients_per_page
     
-    async with async_session() as session:
-        # Получаем ресторан пользователя
-        result = await session.execute(
-            select(Restaurant).join(User, Restaurant.owner_id == User.id)
-            .where(User.telegram_id == callback.from_user.id)
+    # Получаем ресторан пользователя
+    result = await session.execute(
+        select(Restaurant).join(User, Restaurant.owner_id == User.id)
+        .where(User.telegram_id == callback.from_user.id)
+    )
+    restaurant = result.scalar_one_or_none()
+    
+    if not restaurant:
+        await callback.message.answer("Ресторан не найден.")
+        return
+    
+    # Получаем общее количество подключенных клиентов
+    count_query = select(func.count()).select_from(User).where(User.current_restaurant_id == restaurant.id)
+    total_clients = await session.scalar(count_query) or 0
+    
+    if total_clients == 0:
+        await callback.message.edit_text(
+            f"👥 К вашему ресторану '{restaurant.name}' пока никто не подключен.\n\n"
+            f"🔑 Клиенты могут подключиться по коду: {restaurant.invite_code}\n"
+            f"🔗 Или по ссылке: t.me/{(await callback.bot.me()).username}?start={restaurant.invite_code}",
+            reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+                [InlineKeyboardButton(text="⬅️ Назад", callback_data="back_to_restaurant")]
+            ])
         )
-        restaurant = result.scalar_one_or_none()
-        
-        if not restaurant:
-            await callback.message.answer("Ресторан не найден.")
-            return
-        
-        # Получаем общее количество подключенных клиентов
-        count_query = select(func.count()).select_from(User).where(User.current_restaurant_id == restaurant.id)
-        total_clients = await session.scalar(count_query) or 0
-        
-        if total_clients == 0:
-            await callback.message.edit_text(
-                f"👥 К вашему ресторану '{restaurant.name}' пока никто не подключен.\n\n"
-                f"🔑 Клиенты могут подключиться по коду: {restaurant.invite_code}\n"
-                f"🔗 Или по ссылке: t.me/{(await callback.bot.me()).username}?start={restaurant.invite_code}",
-                reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                    [InlineKeyboardButton(text="⬅️ Назад", callback_data="back_to_restaurant")]
-                ])
-            )
-            return
-        
-        # Получаем список клиентов с пагинацией
-        clients_query = select(User).where(User.current_restaurant_id == restaurant.id).limit(clients_per_page).offset(offset)
-        result = await session.execute(clients_query)
-        clients = result.scalars().all()
-        
-        # Общее количество страниц
-        total_pages = (total_clients + clients_per_page - 1) // clients_per_page
-        
-        # Формируем текст со списком клиентов
-        text = f"👥 Клиенты ресторана '{restaurant.name}' (страница {page} из {total_pages}):\n\n"
-        
-        for i, client in enumerate(clients, offset + 1):
-            # Добавляем информацию о клиенте
-            last_activity = client.last_activity.strftime("%d.%m.%Y %H:%M") if client.last_activity else "неизвестно"
-            joined_at = client.created_at.strftime("%d.%m.%Y") if client.created_at else "неизвестно"
-            
-            # Получаем информацию о пользователе из Telegram
-            try:
-                user_info = await callback.bot.get_chat(client.telegram_id)
-                username = user_info.username or "Нет username"
-                fullname = user_info.full_name or "Без имени"
-                user_display = f"{fullname}" + (f" (@{username})" if username != "Нет username" else "")
-            except Exception as e:
-                logging.error(f"Failed to get user info: {e}")
-                user_display = f"ID: {client.telegram_id}"
-            
-            text += (
-                f"{i}. {user_display}\n"
-                f"   ID: {client.telegram_id}\n"
-                f"   Последняя активность: {last_activity}\n"
-                f"   Регистрация: {joined_at}\n\n"
-            )
-        
-        # Создаем кнопки пагинации и управления
-        kb = []
-        
-        # Кнопки действий
-        action_buttons = []
-        if page > 1:
-            action_buttons.append(InlineKeyboardButton(text="◀️ Назад", callback_data="clients_prev_page"))
-        
-        if page < total_pages:
-            action_buttons.append(InlineKeyboardButton(text="Вперед ▶️", callback_data="clients_next_page"))
-        
-        if action_buttons:
-            kb.append(action_buttons)
-        
-        # Кнопка удаления клиентов
-        if clients:
-            kb.append([InlineKeyboardButton(text="❌ Удалить клиента", callback_data="select_client_to_remove")])
-        
-        kb.append([InlineKeyboardButton(text="⬅️ Назад к ресторану", callback_data="back_to_restaurant")])
-        
-        # Сохраняем текущую страницу в состоянии
-        await state.update_data(clients_page=page)
+        return
+    
+    # Получаем список клиентов с пагинацией
+    clients_query = select(User).where(User.current_restaurant_id == restaurant.id).limit(clients_per_page).offset(offset)
+    result = await session.execute(clients_query)
+    clients = result.scalars().all()
+    
+    # Общее количество страниц
+    total_pages = (total_clients + clients_per_page - 1) // clients_per_page
+    
+    # Формируем текст со списком клиентов
+    text = f"👥 Клиенты ресторана '{restaurant.name}' (страница {page} из {total_pages}):\n\n"
+    
+    for i, client in enumerate(clients, offset + 1):
+        # Добавляем информацию о клиенте
+        last_activity = client.last_activity.strftime("%d.%m.%Y %H:%M") if client.last_activity else "неизвестно"
+        joined_at = client.created_at.strftime("%d.%m.%Y") if client.created_at else "неизвестно"
         
-        # Отправляем список клиентов
-        await callback.message.edit_text(
-            text,
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=kb)
+        # Получаем информацию о пользователе из Telegram
+        try:
+            user_info = await callback.bot.get_chat(client.telegram_id)
+            username = user_info.username or "Нет username"
+            fullname = user_info.full_name or "Без имени"
+            user_display = f"{fullname}" + (f" (@{username})" if username != "Нет username" else "")
+        except Exception as e:
+            logging.error(f"Failed to get user info: {e}")
+            user_display = f"ID: {client.telegram_id}"
+        
+        text += (
+            f"{i}. {user_display}\n"
+            f"   ID: {client.telegram_id}\n"
+            f"   Последняя активность: {last_activity}\n"
+            f"   Регистрация: {joined_at}\n\n"
         )
+    
+    # Создаем кнопки пагинации и управления
+    kb = []
+    
+    # Кнопки действий
+    action_buttons = []
+    if page > 1:
+        action_buttons.append(InlineKeyboardButton(text="◀️ Назад", callback_data="clients_prev_page"))
+    
+    if page < total_pages:
+        action_buttons.append(InlineKeyboardButton(text="Вперед ▶️", callback_data="clients_next_page"))
+    
+    if action_buttons:
+        kb.append(action_buttons)
+    
+    # Кнопка удаления клиентов
+    if clients:
+        kb.append([InlineKeyboardButton(text="❌ Удалить клиента", callback_data="select_client_to_remove")])
+    
+    kb.append([InlineKeyboardButton(text="⬅️ Назад к ресторану", callback_data="back_to_restaurant")])
+    
+    # Сохраняем текущую страницу в состоянии
+    await state.update_data(clients_page=page)
+    
+    # Отправляем список клиентов
+    await callback.message.edit_text(
+        text,
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=kb)
+    )
 
 @router.callback_query(F.data == "clients_prev_page")
-async def clients_prev_page(callback: CallbackQuery, state: FSMContext):
+async def clients_prev_page(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
     """Предыдущая страница списка клиентов"""
     await callback.answer()
     
@@ -1096,151 +1036,148 @@ async def clients_prev_page(callback: CallbackQuery, state: FSMContext):
     if current_page > 1:
         await state.update_data(clients_page=current_page - 1)
     
-    await manage_clients(callback, state)
+    await manage_clients(callback, state, session=session)
 
 @router.callback_query(F.data == "clients_next_page")
-async def clients_next_page(callback: CallbackQuery, state: FSMContext):
+async def clients_next_page(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
     """Следующая страница списка клиентов"""
     await callback.answer()
     
     data = await state.get_data()
     current_page = data.get("clients_page", 1)
     
-    async with async_session() as session:
-        # Получаем ресторан пользователя
-        result = await session.execute(
-            select(Restaurant).join(User, Restaurant.owner_id == User.id)
-            .where(User.telegram_id == callback.from_user.id)
-        )
-        restaurant = result.scalar_one_or_none()
-        
-        if not restaurant:
-            return
-        
-        # Получаем общее количество клиентов
-        count_query = select(func.count()).select_from(User).where(User.current_restaurant_id == restaurant.id)
-        total_clients = await session.scalar(count_query) or 0
-        
-        clients_per_page = 5
-        total_pages = (total_clients + clients_per_page - 1) // clients_per_page
-        
-        if current_page < total_pages:
-            await state.update_data(clients_page=current_page + 1)
+    # Получаем ресторан пользователя
+    result = await session.execute(
+        select(Restaurant).join(User, Restaurant.owner_id == User.id)
+        .where(User.telegram_id == callback.from_user.id)
+    )
+    restaurant = result.scalar_one_or_none()
+    
+    if not restaurant:
+        return
+    
+    # Получаем общее количество клиентов
+    count_query = select(func.count()).select_from(User).where(User.current_restaurant_id == restaurant.id)
+    total_clients = await session.scalar(count_query) or 0
     
-    await manage_clients(callback, state)
+    clients_per_page = 5
+    total_pages = (total_clients + clients_per_page - 1) // clients_per_page
+    
+    if current_page < total_pages:
+        await state.update_data(clients_page=current_page + 1)
+    
+    await manage_clients(callback, state, session=session)
 
 @router.callback_query(F.data == "select_client_to_remove")
-async def select_client_to_remove(callback: CallbackQuery, state: FSMContext):
+async def select_client_to_remove(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
     """Выбор клиента для удаления"""
     await callback.answer()
     
-    async with async_session() as session:
-        # Получаем ресторан пользователя
-        result = await session.execute(
-            select(Restaurant).join(User, Restaurant.owner_id == User.id)
-            .where(User.telegram_id == callback.from_user.id)
-        )
-        restaurant = result.scalar_one_or_none()
-        
-        if not restaurant:
-            await callback.message.answer("Ресторан не найден.")
-            return
-        
-        # Получаем список клиентов
-        result = await session.execute(
-            select(User).where(User.current_restaurant_id == restaurant.id)
+    # Получаем ресторан пользователя
+    result = await session.execute(
+        select(Restaurant).join(User, Restaurant.owner_id == User.id)
+        .where(User.telegram_id == callback.from_user.id)
+    )
+    restaurant = result.scalar_one_or_none()
+    
+    if not restaurant:
+        await callback.message.answer("Ресторан не найден.")
+        return
+    
+    # Получаем список клиентов
+    result = await session.execute(
+        select(User).where(User.current_restaurant_id == restaurant.id)
+    )
+    clients = result.scalars().all()
+    
+    if not clients:
+        await callback.message.edit_text(
+            "К вашему ресторану никто не подключен.",
+            reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+                [InlineKeyboardButton(text="⬅️ Назад", callback_data="manage_clients")]
+            ])
         )
-        clients = result.scalars().all()
+        return
+    
+    # Создаем клавиатуру с кнопками для каждого клиента
+    kb = []
+    for client in clients:
+        # Получаем информацию о пользователе из Telegram
+        try:
+            user_info = await callback.bot.get_chat(client.telegram_id)
+            username = user_info.username or "Нет username"
+            fullname = user_info.full_name or "Без имени"
+            user_display = f"{fullname}" + (f" (@{username})" if username != "Нет username" else "")
+        except Exception as e:
+            logging.error(f"Failed to get user info: {e}")
+            user_display = f"ID: {client.telegram_id}"
         
-        if not clients:
-            await callback.message.edit_text(
-                "К вашему ресторану никто не подключен.",
-                reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                    [InlineKeyboardButton(text="⬅️ Назад", callback_data="manage_clients")]
-                ])
+        kb.append([
+            InlineKeyboardButton(
+                text=f"{user_display}",
+                callback_data=f"remove_client:{client.telegram_id}"
             )
-            return
-        
-        # Создаем клавиатуру с кнопками для каждого клиента
-        kb = []
-        for client in clients:
-            # Получаем информацию о пользователе из Telegram
-            try:
-                user_info = await callback.bot.get_chat(client.telegram_id)
-                username = user_info.username or "Нет username"
-                fullname = user_info.full_name or "Без имени"
-                user_display = f"{fullname}" + (f" (@{username})" if username != "Нет username" else "")
-            except Exception as e:
-                logging.error(f"Failed to get user info: {e}")
-                user_display = f"ID: {client.telegram_id}"
-            
-            kb.append([
-                InlineKeyboardButton(
-                    text=f"{user_display}",
-                    callback_data=f"remove_client:{client.telegram_id}"
-                )
-            ])
-        
-        kb.append([InlineKeyboardButton(text="❌ Отмена", callback_data="manage_clients")])
-        
-        await callback.message.edit_text(
-            "Выберите клиента для удаления из ресторана:",
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=kb)
-        )
+        ])
+    
+    kb.append([InlineKeyboardButton(text="❌ Отмена", callback_data="manage_clients")])
+    
+    await callback.message.edit_text(
+        "Выберите клиента для удаления из ресторана:",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=kb)
+    )
 
 @router.callback_query(F.data.startswith("remove_client:"))
-async def remove_client(callback: CallbackQuery, state: FSMContext):
+async def remove_client(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
     """Удаление клиента из ресторана"""
     client_id = int(callback.data.split(":")[-1])
     
-    async with async_session() as session:
-        # Получаем ресторан владельца
-        result = await session.execute(
-            select(Restaurant).join(User, Restaurant.owner_id == User.id)
-            .where(User.telegram_id == callback.from_user.id)
-        )
-        restaurant = result.scalar_one_or_none()
-        
-        if not restaurant:
-            await callback.answer("Ресторан не найден!")
-            return
-        
-        # Получаем клиента
-        result = await session.execute(
-            select(User).where(
-                and_(
-                    User.telegram_id == client_id,
-                    User.current_restaurant_id == restaurant.id
-                )
+    # Получаем ресторан владельца
+    result = await session.execute(
+        select(Restaurant).join(User, Restaurant.owner_id == User.id)
+        .where(User.telegram_id == callback.from_user.id)
+    )
+    restaurant = result.scalar_one_or_none()
+    
+    if not restaurant:
+        await callback.answer("Ресторан не найден!")
+        return
+    
+    # Получаем клиента
+    result = await session.execute(
+        select(User).where(
+            and_(
+                User.telegram_id == client_id,
+                User.current_restaurant_id == restaurant.id
             )
         )
-        client = result.scalar_one_or_none()
-        
-        if not client:
-            await callback.answer("Клиент не найден или не подключен к вашему ресторану!")
-            return
-        
-        # Отключаем клиента от ресторана
-        client.current_restaurant_id = None
-        client.last_activity = datetime.now()
-        await session.commit()
-        
-        # Уведомляем клиента
-        try:
-            await callback.bot.send_message(
-                client_id,
-                f"❌ Вы были отключены от ресторана '{restaurant.name}' его владельцем."
-            )
-        except Exception as e:
-            logging.error(f"Failed to notify client {client_id} about removal: {e}")
-        
-        await callback.answer(f"Клиент с ID {client_id} успешно удален из ресторана!")
-        
-        # Возвращаемся к управлению клиентами с явной передачей state
-        await manage_clients(callback, state)
+    )
+    client = result.scalar_one_or_none()
+    
+    if not client:
+        await callback.answer("Клиент не найден или не подключен к вашему ресторану!")
+        return
+    
+    # Отключаем клиента от ресторана
+    client.current_restaurant_id = None
+    client.last_activity = datetime.now()
+    await session.commit()
+    
+    # Уведомляем клиента
+    try:
+        await callback.bot.send_message(
+            client_id,
+            f"❌ Вы были отключены от ресторана '{restaurant.name}' его владельцем."
+        )
+    except Exception as e:
+        logging.error(f"Failed to notify client {client_id} about removal: {e}")
+    
+    await callback.answer(f"Клиент с ID {client_id} успешно удален из ресторана!")
+    
+    # Возвращаемся к управлению клиентами с явной передачей state
+    await manage_clients(callback, state, session=session)
 
 @router.message(EditMenuItem.waiting_for_price_kisses)
-async def process_edit_price_kisses(message: Message, state: FSMContext):
+async def process_edit_price_kisses(message: Message, state: FSMContext, session: AsyncSession, principal: Principal):
     """Обработка ввода новой цены в поцелуйчиках"""
     data = await state.get_data()
     item_id = data.get("edit_item_id")
@@ -1256,27 +1193,27 @@ async def process_edit_price_kisses(message: Message, state: FSMContext):
     
     price = int(message.text)
     
-    async with async_session() as session:
-        # Получаем позицию по ID
-        result = await session.execute(select(MenuItem).where(MenuItem.id == item_id))
-        item = result.scalar_one_or_none()
-        
-        if not item:
-            await message.answer("Позиция не найдена")
-            await state.clear()
-            return
-        
-        # Обновляем цену
-        item.price_kisses = price
-        await session.commit()
-        
-        await message.answer(f"✅ Стоимость в поцелуйчиках успешно изменена на {price}")
-        
-        # Возвращаемся к управлению меню
-        await manage_menu_command(message, state)
+    # Получаем позицию по ID
+    result = await session.execute(select(MenuItem).where(MenuItem.id == item_id))
+    item = result.scalar_one_or_none()
+    
+    if not item:
+        await message.answer("Позиция не найдена")
+        await state.clear()
+        return
+    
+    # Обновляем цену
+    item.price_kisses = price
+    await bump_menu_version(session, item.restaurant_id)
+    await session.commit()
+    
+    await message.answer(f"✅ Стоимость в поцелуйчиках успешно изменена на {price}")
+    
+    # Возвращаемся к управлению меню
+    await manage_menu_command(message, state, session=session, principal=principal)
 
 @router.message(EditMenuItem.waiting_for_price_hugs)
-async def process_edit_price_hugs(message: Message, state: FSMContext):
+async def process_edit_price_hugs(message: Message, state: FSMContext, session: AsyncSession, principal: Principal):
     """Обработка ввода новой цены в минутах обнимашек"""
     data = await state.get_data()
     item_id = data.get("edit_item_id")
@@ -1292,24 +1229,24 @@ async def process_edit_price_hugs(message: Message, state: FSMContext):
     
     price = int(message.text)
     
-    async with async_session() as session:
-        # Получаем позицию по ID
-        result = await session.execute(select(MenuItem).where(MenuItem.id == item_id))
-        item = result.scalar_one_or_none()
-        
-        if not item:
-            await message.answer("Позиция не найдена")
-            await state.clear()
-            return
-        
-        # Обновляем цену
-        item.price_hugs = price
-        await session.commit()
-        
-        await message.answer(f"✅ Стоимость в минутах обнимашек успешно изменена на {price}")
-        
-        # Возвращаемся к управлению меню
-        await manage_menu_command(message, state)
+    # Получаем позицию по ID
+    result = await session.execute(select(MenuItem).where(MenuItem.id == item_id))
+    item = result.scalar_one_or_none()
+    
+    if not item:
+        await message.answer("Позиция не найдена")
+        await state.clear()
+        return
+    
+    # Обновляем цену
+    item.price_hugs = price
+    await bump_menu_version(session, item.restaurant_id)
+    await session.commit()
+    
+    await message.answer(f"✅ Стоимость в минутах обнимашек успешно изменена на {price}")
+    
+    # Возвращаемся к управлению меню
+    await manage_menu_command(message, state, session=session, principal=principal)
 
 @router.message(MenuItemForm.duration)
 async def process_menu_item_duration(message: Message, state: FSMContext):
@@ -1368,74 +1305,72 @@ async def delete_restaurant_confirmation(callback: CallbackQuery, state: FSMCont
     )
 
 @router.callback_query(F.data == "confirm_delete_restaurant")
-async def process_delete_restaurant(callback: CallbackQuery, state: FSMContext):
+async def process_delete_restaurant(callback: CallbackQuery, state: FSMContext, session: AsyncSession, principal: Principal):
     """Обработчик удаления ресторана"""
     await callback.answer("Удаляем ресторан...")
     
-    async with async_session() as session:
-        # Получаем пользователя
-        result = await session.execute(select(User).where(User.telegram_id == callback.from_user.id))
-        user = result.scalar_one_or_none()
-        
-        if not user or not user.is_restaurant_owner:
-            await callback.message.answer("У вас нет ресторана!")
-            await state.clear()
-            return
-        
-        # Получаем ресторан пользователя
-        result = await session.execute(select(Restaurant).where(Restaurant.owner_id == user.id))
-        restaurant = result.scalar_one_or_none()
-        
-        if not restaurant:
-            await callback.message.answer("Ресторан не найден.")
-            await state.clear()
-            return
-        
-        # Получаем список подключенных клиентов для уведомления
-        result = await session.execute(
-            select(User).where(User.current_restaurant_id == restaurant.id)
-        )
-        connected_users = result.scalars().all()
-        
-        # Сохраняем название для уведомления
-        restaurant_name = restaurant.name
-        
-        # Отвязываем всех подключенных пользователей
-        for client in connected_users:
-            client.current_restaurant_id = None
-        
-        # Удаляем ресторан
-        await session.delete(restaurant)
-        
-        # Обновляем статус пользователя - теперь он не владелец ресторана
-        user.is_restaurant_owner = False
-        
-        # Применяем изменения
-        await session.commit()
-        
-        # Уведомляем клиентов об удалении ресторана
-        bot = callback.bot
-        for client in connected_users:
-            try:
-                await bot.send_message(
-                    client.telegram_id,
-                    f"🚫 Уведомление: ресторан '{restaurant_name}' был удален его владельцем.\n"
-                    f"Вы были отключены от этого ресторана."
-                )
-            except Exception as e:
-                logging.error(f"Failed to notify user {client.telegram_id} about restaurant deletion: {e}")
-        
-        # Очищаем состояние
+    # Проверка владельца по снимку; пользователь и ресторан для изменения загружаются после нее
+    identity = await principal.identity()
+    
+    if not identity or not identity.is_restaurant_owner:
+        await callback.message.answer("У вас нет ресторана!")
         await state.clear()
-        
-        # Обновляем текст сообщения
-        await callback.message.edit_text(
-            f"✅ Ресторан '{restaurant_name}' успешно удален!\n"
-            f"Все клиенты ({len(connected_users)}) были уведомлены."
-        )
-        
-        # Показываем основное меню с обновленной клавиатурой
-        await callback.message.answer(
-            "Вы вернулись в главное меню.",
-            reply_markup=get_main_menu(user)
-        )
\ No newline at end of file
+        return
+    
+    user = await principal.user()
+    restaurant = user.restaurant
+    
+    if not restaurant:
+        await callback.message.answer("Ресторан не найден.")
+        await state.clear()
+        return
+    
+    # Получаем список подключенных клиентов для уведомления
+    result = await session.execute(
+        select(User).where(User.current_restaurant_id == restaurant.id)
+    )
+    connected_users = result.scalars().all()
+    
+    # Сохраняем название для уведомления
+    restaurant_name = restaurant.name
+    
+    # Отвязываем всех подключенных пользователей
+    for client in connected_users:
+        client.current_restaurant_id = None
+    
+    # Удаляем ресторан
+    await session.delete(restaurant)
+    forget_menu(session, restaurant.id)
+    
+    # Обновляем статус пользователя - теперь он не владелец ресторана
+    user.is_restaurant_owner = False
+    
+    # Применяем изменения
+    await session.commit()
+    
+    # Уведомляем клиентов об удалении ресторана
+    bot = callback.bot
+    for client in connected_users:
+        try:
+            await bot.send_message(
+                client.telegram_id,
+                f"🚫 Уведомление: ресторан '{restaurant_name}' был удален его владельцем.\n"
+                f"Вы были отключены от этого ресторана."
+            )
+        except Exception as e:
+            logging.error(f"Failed to notify user {client.telegram_id} about restaurant deletion: {e}")
+    
+    # Очищаем состояние
+    await state.clear()
+    
+    # Обновляем текст сообщения
+    await callback.message.edit_text(
+        f"✅ Ресторан '{restaurant_name}' успешно удален!\n"
+        f"Все клиенты ({len(connected_users)}) были уведомлены."
+    )
+    
+    # Показываем основное меню с обновленной клавиатурой
+    await callback.message.answer(
+        "Вы вернулись в главное меню.",
+        reply_markup=get_main_menu(user)
+    )
\ No newline at end of file
@@ -6,8 +6,8 @@ from sqlalchemy.ext.asyncio import AsyncSession
 import logging
 import os
 
-from ..models.base import async_session
 from ..models.models import User, Restaurant
+from ..services.identity import get_user_snapshot
 from ..keyboards.reply import get_main_menu
 from ..keyboards.inline import get_start_kb
 
@@ -17,7 +17,7 @@ router = Router()
 ADMIN_USERNAME = os.getenv("ADMIN_USERNAME", "LoveRestaurantAdmin")
 
 @router.message(CommandStart())
-async def start_command(message: Message):
+async def start_command(message: Message, session: AsyncSession):
     """Обработчик команды /start"""
     logging.info(f"Start command received from user {message.from_user.id} (@{message.from_user.username or 'no_username'})")
     
@@ -29,49 +29,50 @@ async def start_command(message: Message):
         invite_code = args[1]
         logging.info(f"Invite code detected: {invite_code}")
     
-    async with async_session() as session:
-        # Проверяем, есть ли пользователь в базе
-        result = await session.execute(select(User).where(User.telegram_id == message.from_user.id))
-        user = result.scalar_one_or_none()
+    # Проверяем, есть ли пользователь в базе (по снимку из кэша)
+    snapshot = await get_user_snapshot(session, message.from_user.id)
+    user = None
+    
+    if not snapshot:
+        # Создаем нового пользователя
+        user = User(telegram_id=message.from_user.id)
+        session.add(user)
+        await session.commit()
+        logging.info(f"New user created: {message.from_user.id}")
+    
+    # Если есть инвайт-код, пытаемся подключиться к ресторану
+    if invite_code:
+        result = await session.execute(select(Restaurant).where(Restaurant.invite_code == invite_code))
+        restaurant = result.scalar_one_or_none()
         
-        if not user:
-            # Создаем нового пользователя
-            user = User(telegram_id=message.from_user.id)
-            session.add(user)
+        if restaurant:
+            # Подключаем пользователя к ресторану (строка пользователя нужна только здесь)
+            if user is None:
+                user = await session.get(User, snapshot.id)
+            user.current_restaurant_id = restaurant.id
             await session.commit()
-            logging.info(f"New user created: {message.from_user.id}")
-        
-        # Если есть инвайт-код, пытаемся подключиться к ресторану
-        if invite_code:
-            result = await session.execute(select(Restaurant).where(Restaurant.invite_code == invite_code))
-            restaurant = result.scalar_one_or_none()
+            logging.info(f"User {message.from_user.id} connected to restaurant {restaurant.id} ({restaurant.name})")
             
-            if restaurant:
-                # Подключаем пользователя к ресторану
-                user.current_restaurant_id = restaurant.id
-                await session.commit()
-                logging.info(f"User {message.from_user.id} connected to restaurant {restaurant.id} ({restaurant.name})")
-                
-                await message.answer(
-                    f"Вы успешно подключились к ресторану '{restaurant.name}'!\n"
-                    f"Теперь вы можете просматривать меню и делать заказы.",
-                    reply_markup=get_main_menu()
-                )
-                return
-            else:
-                logging.warning(f"Invalid invite code used: {invite_code}")
-                await message.answer(
-                    "Неверный код приглашения. Проверьте код и попробуйте снова.",
-                    reply_markup=get_main_menu()
-                )
-                return
+            await message.answer(
+                f"Вы успешно подключились к ресторану '{restaurant.name}'!\n"
+                f"Теперь вы можете просматривать меню и делать заказы.",
+                reply_markup=get_main_menu()
+            )
+            return
+        else:
+            logging.warning(f"Invalid invite code used: {invite_code}")
+            await message.answer(
+                "Неверный код приглашения. Проверьте код и попробуйте снова.",
+                reply_markup=get_main_menu()
+            )
+            return
     
     # Отправляем приветственное сообщение с reply-клавиатурой
     await message.answer(
         "Добро пожаловать в Love Restaurant!\n\n"
         "Здесь вы можете создать свой виртуальный ресторан любви, "
         "где валютой служат поцелуи и обнимашки.",
-        reply_markup=get_main_menu(user)
+        reply_markup=get_main_menu(user or snapshot)
     )
 
 @router.message(F.text == "❓ Помощь")
@@ -1,11 +1,17 @@
+from functools import lru_cache
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
 from ..models.models import User
 
 def get_main_menu(user: User = None) -> ReplyKeyboardMarkup:
     """Главное меню бота"""
+    return _main_menu(bool(user and user.is_restaurant_owner))
+
+# Клавиатуры ниже не зависят от данных, поэтому собираются один раз и переиспользуются (не изменять)
+@lru_cache(maxsize=None)
+def _main_menu(is_restaurant_owner: bool) -> ReplyKeyboardMarkup:
     kb = []
     
-    if user and user.is_restaurant_owner:
+    if is_restaurant_owner:
         kb.append([KeyboardButton(text="🍴 Мой ресторан")])
     else:
         kb.append([KeyboardButton(text="🍴 Создать ресторан")])
@@ -16,6 +22,7 @@ def get_main_menu(user: User = None) -> ReplyKeyboardMarkup:
     
     return ReplyKeyboardMarkup(keyboard=kb, resize_keyboard=True)
 
+@lru_cache(maxsize=None)
 def get_restaurant_menu() -> ReplyKeyboardMarkup:
     """Меню ресторана"""
     kb = [
@@ -1,4 +1,6 @@
 from .anti_spam import AntiSpamMiddleware
+from .db_session import DbSessionMiddleware
 from .error_monitor import ErrorMonitorMiddleware
+from .reachability import ReachabilityMiddleware
 
-__all__ = ["AntiSpamMiddleware", "ErrorMonitorMiddleware"] 
\ No newline at end of file
+__all__ = ["AntiSpamMiddleware", "DbSessionMiddleware", "ErrorMonitorMiddleware", "ReachabilityMiddleware"] 
\ No newline at end of file
@@ -1,31 +1,87 @@
-import time
-from typing import Any, Awaitable, Callable, Dict
+import math
+from typing import Any, Awaitable, Callable, Dict, Optional
 from aiogram import BaseMiddleware
 from aiogram.types import TelegramObject, Message, CallbackQuery
+from ..services.rate_limiter import LimiterBackend, MemoryLimiterBackend
+from ..services.alerts import alerts
 import os
 import logging
 
+# Стоимость сообщения в единицах лимита: текстовый ввод обычно запускает более тяжелые обработчики
+MESSAGE_COST = 1.5
+# Стоимость нажатия кнопки по умолчанию
+CALLBACK_COST = 1.0
+# Стоимость кнопок по префиксу callback_data: навигация дешевле, запись в БД и оплата дороже
+CALLBACK_COSTS = {
+    "view_item:": 0.5,
+    "show_menu": 0.5,
+    "show_restaurant_menu:": 0.5,
+    "back_to_restaurant": 0.5,
+    "clients_next_page": 0.5,
+    "clients_prev_page": 0.5,
+    "add_to_cart:": 1.0,
+    "view_cart": 1.0,
+    "confirm_order": 3.0,
+    "order_ready:": 2.0,
+    "stars_payment:": 3.0,
+    "regenerate_invite_code": 3.0,
+    "confirm_delete_restaurant": 3.0,
+}
+
 class AntiSpamMiddleware(BaseMiddleware):
     """
     Middleware для защиты от спама.
     Ограничивает количество запросов от одного пользователя в определенный промежуток времени.
+    Один экземпляр подключается и к сообщениям, и к нажатиям кнопок: у пользователя
+    общий бюджет, а каждый запрос расходует его в зависимости от стоимости.
     """
     
-    def __init__(self, rate_limit: int = 2, time_window: int = 2):
+    def __init__(
+        self,
+        rate_limit: int = 2,
+        time_window: int = 2,
+        backend: Optional[LimiterBackend] = None,
+        name: str = "default",
+        message_cost: float = MESSAGE_COST,
+        callback_cost: float = CALLBACK_COST,
+        callback_costs: Optional[Dict[str, float]] = None
+    ):
         """
-        :param rate_limit: Максимальное количество запросов в заданный промежуток времени
+        :param rate_limit: Бюджет запросов единичной стоимости на заданный промежуток времени
         :param time_window: Временное окно в секундах
+        :param backend: Хранилище лимитов (по умолчанию - память процесса)
+        :param name: Имя лимита, разделяет ключи разных middleware в общем хранилище
+        :param message_cost: Стоимость сообщения
+        :param callback_cost: Стоимость нажатия кнопки по умолчанию
+        :param callback_costs: Стоимость нажатия кнопки по префиксу callback_data
         """
         self.rate_limit = rate_limit
         self.time_window = time_window
-        self.user_requests = {}  # user_id -> [timestamp1, timestamp2, ...]
+        self.backend = backend or MemoryLimiterBackend()
+        self.name = name
+        self.message_cost = message_cost
+        self.callback_cost = callback_cost
+        # Более длинные префиксы проверяются первыми
+        costs = CALLBACK_COSTS if callback_costs is None else callback_costs
+        self.callback_costs = sorted(costs.items(), key=lambda item: len(item[0]), reverse=True)
         self.admin_id = int(os.getenv("ADMIN_ID", "5385155120"))
-        self.spam_notifications = {}  # user_id -> last_notification_time
-        self.notification_cooldown = 60  # Не отправлять уведомления чаще чем раз в минуту
+        self.notification_cooldown = 60  # Не отправлять уведомления об одном пользователе чаще чем раз в минуту
+        # Уведомлять админа, если запросов в 2.5 раза больше лимита (считая отклоненные)
+        self.notify_after = math.ceil(rate_limit * 1.5)
         # Команды, которые исключены из ограничений спама
         self.exempt_commands = ["/start", "/help", "/cancel"]
         logging.info(f"AntiSpamMiddleware initialized with rate_limit={rate_limit}, time_window={time_window}, exempt_commands={self.exempt_commands}")
     
+    def get_cost(self, event: TelegramObject) -> float:
+        """Стоимость запроса в единицах лимита"""
+        if isinstance(event, CallbackQuery):
+            callback_data = event.data or ""
+            for prefix, cost in self.callback_costs:
+                if callback_data.startswith(prefix):
+                    return cost
+            return self.callback_cost
+        return self.message_cost
+    
     async def __call__(
         self,
         handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
@@ -55,72 +111,52 @@ class AntiSpamMiddleware(BaseMiddleware):
         if not user_id or user_id == self.admin_id or exempt_command:
             return await handler(event, data)
         
-        current_time = time.time()
-        
-        # Инициализируем список запросов, если его нет
-        if user_id not in self.user_requests:
-            self.user_requests[user_id] = []
-        
-        # Очищаем старые запросы
-        self.user_requests[user_id] = [
-            timestamp for timestamp in self.user_requests[user_id]
-            if current_time - timestamp < self.time_window
-        ]
+        # Учитываем запрос: strikes - количество отклоненных подряд запросов
+        strikes = await self.backend.hit(
+            f"{self.name}:{user_id}", self.rate_limit, self.time_window, self.get_cost(event)
+        )
         
         # Проверяем, не превышает ли пользователь лимит
-        if len(self.user_requests[user_id]) >= self.rate_limit:
+        if strikes:
             # Пользователь превысил лимит, блокируем запрос
             if isinstance(event, Message):
                 await event.answer("🚫 Слишком много запросов. Пожалуйста, подождите несколько секунд.")
             elif isinstance(event, CallbackQuery):
                 await event.answer("🚫 Слишком много запросов. Пожалуйста, подождите.", show_alert=True)
             
-            # Если это уже пятый запрос подряд слишком быстро, уведомляем администратора
-            if len(self.user_requests[user_id]) >= self.rate_limit * 2.5:
-                # Проверяем, не отправляли ли мы уже уведомление недавно
-                should_notify = True
-                if user_id in self.spam_notifications:
-                    if current_time - self.spam_notifications[user_id] < self.notification_cooldown:
-                        should_notify = False
+            # Отклоненные запросы попадают в периодическую сводку для администратора
+            alerts.record("spam", user_id)
+            
+            # Если пользователь продолжает слать запросы после отказа, уведомляем администратора.
+            # Уведомление только ставится в очередь, повторы в течение кулдауна склеиваются
+            if strikes >= self.notify_after:
+                username = event.from_user.username or "Нет username"
+                full_name = event.from_user.full_name or "Неизвестный пользователь"
                 
-                if should_notify:
-                    bot = data.get("bot")
-                    if bot:
-                        try:
-                            username = event.from_user.username or "Нет username"
-                            full_name = event.from_user.full_name or "Неизвестный пользователь"
-                            
-                            # Определяем тип события
-                            event_type = "сообщение"
-                            event_content = ""
-                            if isinstance(event, Message):
-                                event_type = "сообщение"
-                                if is_command:
-                                    event_type = "команда"
-                                event_content = f"Содержание: {event.text}"
-                            elif isinstance(event, CallbackQuery):
-                                event_type = "нажатие кнопки"
-                                event_content = f"Callback: {event.data}"
-                            
-                            await bot.send_message(
-                                self.admin_id,
-                                f"⚠️ Обнаружен возможный спам!\n\n"
-                                f"Пользователь: {full_name} (@{username})\n"
-                                f"ID: {user_id}\n"
-                                f"Тип: {event_type}\n"
-                                f"{event_content}\n"
-                                f"Количество запросов: {len(self.user_requests[user_id])} за {self.time_window} сек."
-                            )
-                            # Обновляем время последнего уведомления
-                            self.spam_notifications[user_id] = current_time
-                            logging.info(f"Spam notification sent for user {user_id}")
-                        except Exception as e:
-                            logging.error(f"Failed to send spam notification: {e}")
+                # Определяем тип события
+                event_type = "сообщение"
+                event_content = ""
+                if isinstance(event, Message):
+                    event_type = "сообщение"
+                    if is_command:
+                        event_type = "команда"
+                    event_content = f"Содержание: {event.text}"
+                elif isinstance(event, CallbackQuery):
+                    event_type = "нажатие кнопки"
+                    event_content = f"Callback: {event.data}"
+                
+                alerts.notify(
+                    f"spam:{user_id}",
+                    f"⚠️ Обнаружен возможный спам!\n\n"
+                    f"Пользователь: {full_name} (@{username})\n"
+                    f"ID: {user_id}\n"
+                    f"Тип: {event_type}\n"
+                    f"{event_content}\n"
+                    f"Количество запросов: {self.rate_limit + strikes} за {self.time_window} сек.",
+                    cooldown=self.notification_cooldown
+                )
             
             return None
         
-        # Добавляем текущий запрос в историю
-        self.user_requests[user_id].append(current_time)
-        
         # Передаем управление следующему обработчику
         return await handler(event, data) 
\ No newline at end of file
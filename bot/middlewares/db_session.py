@@ -0,0 +1,64 @@
+import logging
+from typing import Any, Awaitable, Callable, Dict
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+from ..models.base import async_session, engine
+from ..services.principal import Principal
+from ..services.query_stats import UpdateQueries, current_update, install_query_counter, query_stats
+
+# Сколько запросов к БД на одно обновление считать подозрительным
+QUERY_WARN_THRESHOLD = 25
+
+
+class DbSessionMiddleware(BaseMiddleware):
+    """
+    Middleware единицы работы: одна сессия БД на обновление.
+    Сессия передается обработчикам в data["session"] и берет соединение из пула только
+    при первом запросе, поэтому обновления без обращений к БД пул не занимают.
+    Контекст пользователя передается в data["principal"].
+    В конце обновления изменения фиксируются, при ошибке - откатываются.
+    Также считает запросы к БД на каждое обновление.
+    """
+
+    def __init__(self, warn_threshold: int = QUERY_WARN_THRESHOLD):
+        """
+        :param warn_threshold: Количество запросов на обновление, после которого пишется предупреждение
+        """
+        self.warn_threshold = warn_threshold
+        install_query_counter(engine)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        counter = UpdateQueries()
+        token = current_update.set(counter)
+        try:
+            async with async_session() as session:
+                data["session"] = session
+                user = data.get("event_from_user")
+                if user:
+                    # Пользователь, его ресторан и подключенный ресторан загружаются при первом обращении
+                    data["principal"] = Principal(session, user.id)
+                try:
+                    result = await handler(event, data)
+                except Exception:
+                    await session.rollback()
+                    raise
+
+                if session.in_transaction():
+                    try:
+                        await session.commit()
+                    except Exception as e:
+                        # Ошибка обработчика могла быть перехвачена раньше, а транзакция осталась сломанной
+                        logging.error(f"Error committing update session: {e}")
+                        await session.rollback()
+                return result
+        finally:
+            current_update.reset(token)
+            query_stats.record(counter.count)
+            if counter.count >= self.warn_threshold:
+                update_id = event.update_id if isinstance(event, Update) else None
+                logging.warning(f"Update {update_id} made {counter.count} database queries")
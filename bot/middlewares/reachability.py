@@ -0,0 +1,33 @@
+import logging
+from typing import Any, Awaitable, Callable, Dict
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, ChatMemberUpdated
+from ..services.reachability import restore_reachability
+
+class ReachabilityMiddleware(BaseMiddleware):
+    """
+    Middleware для восстановления доступности пользователя.
+    Если пользователь, ранее заблокировавший бота, снова пишет боту,
+    флаг недоступности снимается и он опять попадает в рассылки.
+    Разблокировка бота (my_chat_member со статусом member) тоже снимает флаг,
+    остальные изменения статуса (например, новая блокировка) флаг не трогают.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get("event_from_user")
+        session = data.get("session")
+        if isinstance(event, ChatMemberUpdated) and event.new_chat_member.status != "member":
+            user = None
+        if user and session is not None:
+            try:
+                if await restore_reachability(session, user.id):
+                    logging.info(f"User {user.id} is reachable again")
+            except Exception as e:
+                logging.error(f"Error restoring reachability for user {user.id}: {e}")
+
+        return await handler(event, data)
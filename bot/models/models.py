@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, BigInteger, String, Boolean, ForeignKey, Text, DateTime
+from sqlalchemy import Column, Integer, BigInteger, String, Boolean, ForeignKey, Text, DateTime, Index
 from sqlalchemy.orm import relationship
 from .base import Base
 import datetime
@@ -9,14 +9,27 @@ class User(Base):
     id = Column(Integer, primary_key=True)
     telegram_id = Column(BigInteger, unique=True)
     is_restaurant_owner = Column(Boolean, default=False)
-    current_restaurant_id = Column(Integer, ForeignKey("restaurants.id"), nullable=True)
+    current_restaurant_id = Column(Integer, ForeignKey("restaurants.id"), nullable=True, index=True)
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
-    last_activity = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+    last_activity = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow, index=True)
+    # Время, когда бот не смог доставить пользователю сообщение (заблокировал бота, удалил аккаунт)
+    unreachable_at = Column(DateTime, nullable=True)
     
     restaurant = relationship("Restaurant", back_populates="owner", foreign_keys="Restaurant.owner_id", uselist=False)
     connected_restaurant = relationship("Restaurant", foreign_keys=[current_restaurant_id], backref="connected_users")
     donations = relationship("Donation", back_populates="user")
     orders = relationship("Order", back_populates="user")
+    
+    __table_args__ = (
+        # Частичный индекс по доступным пользователям для выборки аудитории рассылок
+        Index(
+            "ix_users_reachable_id",
+            "id",
+            postgresql_where=(telegram_id.isnot(None) & unreachable_at.is_(None))
+        ),
+        # Частичный индекс для сегмента владельцев ресторанов
+        Index("ix_users_owners_id", "id", postgresql_where=is_restaurant_owner.is_(True)),
+    )
 
 class Restaurant(Base):
     __tablename__ = "restaurants"
@@ -26,6 +39,8 @@ class Restaurant(Base):
     owner_id = Column(Integer, ForeignKey("users.id"), unique=True)
     invite_code = Column(String(10), unique=True)
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    # Увеличивается при каждом изменении меню (см. services/menu.py)
+    menu_version = Column(Integer, nullable=False, default=1, server_default="1")
     
     owner = relationship("User", back_populates="restaurant", foreign_keys=[owner_id])
     menu_items = relationship("MenuItem", back_populates="restaurant", cascade="all, delete-orphan")
@@ -100,12 +115,22 @@ class Broadcast(Base):
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
     scheduled_at = Column(DateTime, nullable=True)  # Время запланированной отправки
     sent_at = Column(DateTime, nullable=True)  # Время фактической отправки
-    status = Column(String(20), default="created")  # created, sending, completed, failed
+    status = Column(String(20), default="created")  # created, sending, paused, completed, cancelled, failed
     total_users = Column(Integer, default=0)  # Общее количество пользователей
     received_count = Column(Integer, default=0)  # Количество пользователей, получивших сообщение
+    rate_limit = Column(Integer, nullable=True)  # Скорость отправки, сообщений в секунду (None - по умолчанию)
+    concurrency = Column(Integer, nullable=True)  # Количество одновременных запросов (None - по умолчанию)
+    last_user_id = Column(Integer, nullable=True)  # Контрольная точка: все пользователи с id <= обработаны
+    segment = Column(String(20), default="all")  # Сегмент аудитории: all, owners, connected, active, ordered
+    segment_days = Column(Integer, nullable=True)  # Период активности в днях для сегмента active
+    claimed_by = Column(String(64), nullable=True)  # Экземпляр бота, который отправляет рассылку
+    heartbeat_at = Column(DateTime, nullable=True)  # Последнее продление аренды рассылки (UTC)
 
 class BroadcastRecipient(Base):
     __tablename__ = "broadcast_recipients"
+    __table_args__ = (
+        Index("ix_broadcast_recipients_broadcast_user", "broadcast_id", "user_id", unique=True),
+    )
 
     id = Column(Integer, primary_key=True)
     broadcast_id = Column(Integer, ForeignKey("broadcasts.id"))
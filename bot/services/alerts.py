@@ -0,0 +1,172 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict, defaultdict
+from typing import Callable, Dict, List, Optional, Set
+
+# Размер очереди уведомлений: при переполнении новые уведомления отбрасываются и учитываются в дайджесте
+ALERT_QUEUE_SIZE = 100
+# Как часто отправлять дайджест, в секундах
+DIGEST_INTERVAL = 60
+# Сколько разных субъектов (пользователей, типов ошибок) запоминать в одной категории дайджеста
+DIGEST_MAX_SUBJECTS = 10000
+# Сколько секунд при остановке ждать отправки оставшихся уведомлений
+CLOSE_TIMEOUT = 10
+
+# Строки дайджеста по категориям
+DIGEST_FORMATS = {
+    "spam": "🚫 Спам: {total} отклоненных запросов от {subjects} пользователей",
+}
+
+
+class AlertDispatcher:
+    """
+    Фоновая отправка уведомлений администратору.
+    Middleware только ставят уведомление в очередь и сразу возвращаются, отправкой
+    занимается отдельная задача. Повторы уведомления с тем же ключом в пределах
+    кулдауна не отправляются, а считаются и попадают в периодический дайджест.
+    """
+
+    def __init__(self, admin_id: int, queue_size: int = ALERT_QUEUE_SIZE, digest_interval: float = DIGEST_INTERVAL):
+        """
+        :param admin_id: Telegram ID администратора
+        :param queue_size: Максимальное количество уведомлений в очереди
+        :param digest_interval: Период отправки дайджеста в секундах
+        """
+        self.admin_id = admin_id
+        self.digest_interval = digest_interval
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.bot = None
+        self._tasks = []
+
+        # key -> время последней отправки, для склейки повторов
+        self._sent_at: "OrderedDict[str, float]" = OrderedDict()
+        self._max_keys = 1000
+        # Счетчики для дайджеста
+        self._suppressed: Dict[str, int] = defaultdict(int)
+        self._totals: Dict[str, int] = defaultdict(int)
+        self._subjects: Dict[str, Set] = defaultdict(set)
+        self.dropped = 0
+        # Дополнительные источники строк сводки (например, топ ошибок)
+        self._digest_sources: List[Callable[[], List[str]]] = []
+
+    def start(self, bot, admin_id: Optional[int] = None):
+        """Запускает задачи отправки уведомлений и дайджеста"""
+        self.bot = bot
+        if admin_id:
+            self.admin_id = admin_id
+        self._tasks = [
+            asyncio.create_task(self._sender()),
+            asyncio.create_task(self._digest_loop()),
+        ]
+
+    def _enqueue(self, text: str, parse_mode: Optional[str] = None) -> bool:
+        try:
+            self.queue.put_nowait((text, parse_mode))
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+
+    def notify(self, key: str, text: str, parse_mode: Optional[str] = None, cooldown: float = 60) -> bool:
+        """
+        Ставит уведомление в очередь, не дожидаясь отправки.
+        :param key: Ключ склейки: уведомления с одним ключом отправляются не чаще раза в cooldown секунд
+        :return: True, если уведомление поставлено в очередь
+        """
+        if not self.admin_id:
+            return False
+
+        now = time.monotonic()
+        sent_at = self._sent_at.get(key)
+        if sent_at is not None and now - sent_at < cooldown:
+            self._suppressed[key] += 1
+            return False
+
+        self._sent_at.pop(key, None)
+        self._sent_at[key] = now
+        while len(self._sent_at) > self._max_keys:
+            self._sent_at.popitem(last=False)
+
+        return self._enqueue(text, parse_mode)
+
+    def add_digest_source(self, source: Callable[[], List[str]]):
+        """Добавляет функцию, возвращающую строки для сводки"""
+        self._digest_sources.append(source)
+
+    def record(self, category: str, subject=None):
+        """Учитывает событие для дайджеста (например, отклоненный спам-запрос пользователя)"""
+        self._totals[category] += 1
+        subjects = self._subjects[category]
+        if subject is not None and len(subjects) < DIGEST_MAX_SUBJECTS:
+            subjects.add(subject)
+
+    def _build_digest(self) -> Optional[str]:
+        lines = []
+        for category, total in self._totals.items():
+            line_format = DIGEST_FORMATS.get(category, category + ": {total}")
+            lines.append(line_format.format(total=total, subjects=len(self._subjects[category])))
+
+        for source in self._digest_sources:
+            try:
+                lines.extend(source())
+            except Exception as e:
+                logging.error(f"Error building alert digest: {e}")
+
+        if self._suppressed:
+            repeats = sum(self._suppressed.values())
+            lines.append(f"🔁 Повторных уведомлений скрыто: {repeats} ({len(self._suppressed)} видов)")
+
+        if self.dropped:
+            lines.append(f"📭 Уведомлений отброшено из-за переполнения очереди: {self.dropped}")
+
+        self._totals.clear()
+        self._subjects.clear()
+        self._suppressed.clear()
+        self.dropped = 0
+
+        if not lines:
+            return None
+        minutes = max(int(self.digest_interval // 60), 1)
+        return f"📋 Сводка за последние {minutes} мин.:\n\n" + "\n".join(lines)
+
+    async def _digest_loop(self):
+        while True:
+            await asyncio.sleep(self.digest_interval)
+            digest = self._build_digest()
+            if digest:
+                self._enqueue(digest)
+
+    async def _sender(self):
+        while True:
+            text, parse_mode = await self.queue.get()
+            try:
+                await self.bot.send_message(self.admin_id, text, parse_mode=parse_mode)
+            except Exception as e:
+                logging.error(f"Failed to send admin alert: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def close(self, timeout: float = CLOSE_TIMEOUT):
+        """Отправляет итоговый дайджест и оставшиеся уведомления, затем останавливает задачи"""
+        if not self._tasks:
+            return
+        sender, digest_loop = self._tasks
+        digest_loop.cancel()
+        await asyncio.gather(digest_loop, return_exceptions=True)
+
+        digest = self._build_digest()
+        if digest:
+            self._enqueue(digest)
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Dropped {self.queue.qsize()} admin alerts on shutdown")
+
+        sender.cancel()
+        await asyncio.gather(sender, return_exceptions=True)
+        self._tasks = []
+
+
+alerts = AlertDispatcher(int(os.getenv("ADMIN_ID", "5385155120")))
@@ -0,0 +1,142 @@
+import json
+import logging
+import os
+from typing import AsyncIterator, Optional, Tuple
+from sqlalchemy import select, func, exists
+from sqlalchemy.dialects import postgresql
+from ..models.base import async_session
+from ..models.models import User, Order, BroadcastRecipient
+
+# Размер порции пользователей, загружаемой за один запрос
+AUDIENCE_CHUNK_SIZE = int(os.getenv("BROADCAST_CHUNK_SIZE", "1000"))
+
+# Сегменты аудитории рассылки
+SEGMENT_ALL = "all"
+SEGMENT_OWNERS = "owners"
+SEGMENT_CONNECTED = "connected"
+SEGMENT_ACTIVE = "active"
+SEGMENT_ORDERED = "ordered"
+
+SEGMENTS = {
+    SEGMENT_ALL: "Все пользователи",
+    SEGMENT_OWNERS: "Владельцы ресторанов",
+    SEGMENT_CONNECTED: "Подключенные к ресторану",
+    SEGMENT_ACTIVE: "Активные",
+    SEGMENT_ORDERED: "Делавшие заказы",
+}
+
+
+def segment_label(segment: Optional[str], days: Optional[int] = None) -> str:
+    """Название сегмента для отображения админу"""
+    segment = segment or SEGMENT_ALL
+    label = SEGMENTS.get(segment, segment)
+    if segment == SEGMENT_ACTIVE and days:
+        label += f" за {days} дн."
+    return label
+
+
+def segment_condition(segment: Optional[str], days: Optional[int] = None):
+    """
+    Условие отбора пользователей сегмента.
+    Каждое условие опирается на индекс: частичный индекс владельцев,
+    индексы users.current_restaurant_id, users.last_activity и orders.user_id.
+    """
+    if segment == SEGMENT_OWNERS:
+        return User.is_restaurant_owner.is_(True)
+    if segment == SEGMENT_CONNECTED:
+        return User.current_restaurant_id.isnot(None)
+    if segment == SEGMENT_ACTIVE:
+        # Время считается на стороне БД, чтобы запрос можно было отдать в EXPLAIN без параметров
+        since = func.timezone("utc", func.now()) - func.make_interval(0, 0, 0, int(days or 7))
+        return User.last_activity >= since
+    if segment == SEGMENT_ORDERED:
+        return exists().where(Order.user_id == User.id)
+    return None
+
+
+def audience_query(segment: Optional[str] = None, days: Optional[int] = None):
+    """
+    Базовый запрос аудитории рассылки: только нужные для отправки колонки.
+    Недоступные пользователи пропускаются, условие совпадает с частичным индексом ix_users_reachable_id.
+    """
+    query = select(User.id, User.telegram_id).where(
+        User.telegram_id.isnot(None),
+        User.unreachable_at.is_(None)
+    )
+    condition = segment_condition(segment, days)
+    if condition is not None:
+        query = query.where(condition)
+    return query
+
+
+async def count_audience(session, segment: Optional[str] = None, days: Optional[int] = None) -> int:
+    """Точное количество получателей рассылки"""
+    subquery = audience_query(segment, days).subquery()
+    return await session.scalar(select(func.count()).select_from(subquery)) or 0
+
+
+async def estimate_audience(session, segment: Optional[str] = None, days: Optional[int] = None) -> int:
+    """
+    Примерное количество получателей по оценке планировщика PostgreSQL.
+    EXPLAIN не выполняет запрос, поэтому оценка не зависит от размера таблицы.
+    """
+    compiled = audience_query(segment, days).compile(
+        dialect=postgresql.dialect(),
+        compile_kwargs={"literal_binds": True}
+    )
+    try:
+        # Точка сохранения: ошибка EXPLAIN не должна прерывать транзакцию обработчика и запасной подсчет
+        async with session.begin_nested():
+            connection = await session.connection()
+            result = await connection.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}")
+            plan = result.scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]["Plan"]["Plan Rows"])
+    except Exception as e:
+        logging.error(f"Error estimating broadcast audience, falling back to count: {e}")
+        return await count_audience(session, segment, days)
+
+
+async def iter_audience(
+    after_id: int = 0,
+    exclude_broadcast_id: Optional[int] = None,
+    segment: Optional[str] = None,
+    days: Optional[int] = None,
+    chunk_size: int = AUDIENCE_CHUNK_SIZE
+) -> AsyncIterator[Tuple[int, int]]:
+    """
+    Отдает пары (user_id, telegram_id) по возрастанию id.
+    Использует keyset-пагинацию (id > последнего), поэтому в памяти
+    находится не больше одной порции, а каждая порция читается по индексу первичного ключа.
+    Для каждой порции открывается своя короткая сессия, чтобы не держать соединение во время отправки.
+
+    :param after_id: Продолжить с пользователя, следующего за этим id
+    :param exclude_broadcast_id: Пропускать пользователей, уже получивших эту рассылку (при продолжении)
+    :param segment: Сегмент аудитории (по умолчанию все пользователи)
+    :param days: Период активности в днях для сегмента активных пользователей
+    """
+    query = audience_query(segment, days)
+    if exclude_broadcast_id is not None:
+        query = query.where(~exists().where(
+            BroadcastRecipient.broadcast_id == exclude_broadcast_id,
+            BroadcastRecipient.user_id == User.id
+        ))
+
+    last_id = after_id
+    while True:
+        async with async_session() as session:
+            result = await session.execute(
+                query
+                .where(User.id > last_id)
+                .order_by(User.id)
+                .limit(chunk_size)
+            )
+            rows = result.all()
+
+        for user_id, telegram_id in rows:
+            yield user_id, telegram_id
+
+        if len(rows) < chunk_size:
+            return
+        last_id = rows[-1][0]
@@ -0,0 +1,120 @@
+import asyncio
+import logging
+import os
+import socket
+from typing import Callable, Iterable, Optional
+from sqlalchemy import update, or_, func
+from ..models.base import async_session
+from ..models.models import Broadcast
+
+# Идентификатор экземпляра бота. По умолчанию имя хоста: у контейнера оно не меняется при перезапуске
+INSTANCE_ID = os.getenv("INSTANCE_ID") or socket.gethostname()
+
+# Через сколько секунд без продления аренда рассылки считается брошенной
+LEASE_TIMEOUT = int(os.getenv("BROADCAST_LEASE_TIMEOUT", "60"))
+HEARTBEAT_INTERVAL = LEASE_TIMEOUT / 4
+
+# Время БД (UTC), чтобы не зависеть от расхождения часов между экземплярами
+db_now = func.timezone("utc", func.now())
+
+
+def lease_expired():
+    """Условие "аренда просрочена" для запросов"""
+    return or_(
+        Broadcast.heartbeat_at.is_(None),
+        Broadcast.heartbeat_at < db_now - func.make_interval(0, 0, 0, 0, 0, 0, LEASE_TIMEOUT)
+    )
+
+
+async def claim_broadcast(
+    broadcast_id: int,
+    from_statuses: Iterable[str],
+    status: str = "sending",
+    takeover_own: bool = False
+) -> Optional[str]:
+    """
+    Атомарно захватывает рассылку для отправки этим экземпляром бота.
+    Статус меняется одним условным UPDATE ... RETURNING, поэтому из нескольких
+    экземпляров рассылку получит только один.
+
+    :param from_statuses: Статусы, из которых разрешен захват
+    :param status: Новый статус рассылки
+    :param takeover_own: Разрешить захват рассылки, которую этот экземпляр держал до перезапуска
+    :return: Название рассылки или None, если захватить не удалось
+    """
+    free = or_(Broadcast.claimed_by.is_(None), lease_expired())
+    if takeover_own:
+        free = or_(free, Broadcast.claimed_by == INSTANCE_ID)
+
+    async with async_session() as session:
+        result = await session.execute(
+            update(Broadcast)
+            .where(Broadcast.id == broadcast_id, Broadcast.status.in_(list(from_statuses)), free)
+            .values(status=status, claimed_by=INSTANCE_ID, heartbeat_at=db_now)
+            .returning(Broadcast.name)
+        )
+        name = result.scalar_one_or_none()
+        await session.commit()
+    return name
+
+
+async def renew_lease(broadcast_id: int) -> bool:
+    """Продлевает аренду рассылки. False - рассылку забрал другой экземпляр или она завершена"""
+    async with async_session() as session:
+        result = await session.execute(
+            update(Broadcast)
+            .where(
+                Broadcast.id == broadcast_id,
+                Broadcast.claimed_by == INSTANCE_ID,
+                Broadcast.status.in_(["sending", "paused"])
+            )
+            .values(heartbeat_at=db_now)
+        )
+        await session.commit()
+    return result.rowcount > 0
+
+
+class BroadcastLease:
+    """
+    Периодически продлевает аренду выполняющейся рассылки.
+    Если продлить аренду не удалось, вызывает on_lost, чтобы остановить отправку.
+    """
+
+    def __init__(self, broadcast_id: int, on_lost: Callable[[], None]):
+        self.broadcast_id = broadcast_id
+        self.on_lost = on_lost
+        self.lost = False
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._heartbeat())
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            try:
+                renewed = await renew_lease(self.broadcast_id)
+            except Exception as e:
+                # Временная ошибка БД: попробуем в следующий раз, аренда еще действует
+                logging.error(f"Error renewing broadcast {self.broadcast_id} lease: {e}")
+                continue
+            if not renewed:
+                self.mark_lost()
+                return
+
+    def mark_lost(self):
+        """Отмечает аренду потерянной и останавливает отправку"""
+        if self.lost:
+            return
+        logging.warning(f"Broadcast {self.broadcast_id} lease lost, stopping delivery")
+        self.lost = True
+        self.on_lost()
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,108 @@
+import asyncio
+import time
+from collections import deque
+from typing import Deque, Dict, Optional
+from .broadcast_sender import BroadcastSender
+
+# Окно, по которому считается текущая скорость отправки, в секундах
+THROUGHPUT_WINDOW = 30.0
+
+
+class BroadcastRun:
+    """
+    Состояние выполняющейся рассылки.
+    Хранит ссылку на движок отправки для управления и счетчики в памяти для статистики.
+    """
+
+    def __init__(self, broadcast_id: int, sender: BroadcastSender, total: int, already_sent: int = 0):
+        """
+        :param broadcast_id: ID рассылки
+        :param sender: Движок отправки рассылки
+        :param total: Общее количество получателей
+        :param already_sent: Сколько получателей обработано до перезапуска рассылки
+        """
+        self.broadcast_id = broadcast_id
+        self.sender = sender
+        self.task: Optional[asyncio.Task] = asyncio.current_task()
+        self.total = total
+        self.already_sent = already_sent
+        self.sent = 0
+        self.errors = 0
+        self.started_at = time.monotonic()
+        self.cancelled = False
+        self._completed_at: Deque[float] = deque()  # время завершения отправок в пределах окна
+
+    def record(self, error: Optional[Exception] = None):
+        """Учитывает окончательный результат отправки одному получателю"""
+        if error is None:
+            self.sent += 1
+        else:
+            self.errors += 1
+        now = time.monotonic()
+        self._completed_at.append(now)
+        self._trim(now)
+
+    def _trim(self, now: float):
+        while self._completed_at and now - self._completed_at[0] > THROUGHPUT_WINDOW:
+            self._completed_at.popleft()
+
+    @property
+    def paused(self) -> bool:
+        return self.sender.paused
+
+    def pause(self):
+        self.sender.pause()
+
+    def resume(self):
+        self.sender.resume()
+
+    def cancel(self):
+        self.cancelled = True
+        self.sender.stop()
+
+    def set_rate(self, rate: float):
+        self.sender.set_rate(rate)
+
+    @property
+    def throughput(self) -> float:
+        """Текущая скорость отправки, сообщений в секунду"""
+        now = time.monotonic()
+        self._trim(now)
+        window = min(THROUGHPUT_WINDOW, now - self.started_at)
+        if window <= 0:
+            return 0.0
+        return len(self._completed_at) / window
+
+    @property
+    def error_rate(self) -> float:
+        """Доля ошибок среди обработанных получателей"""
+        processed = self.sent + self.errors
+        return self.errors / processed if processed else 0.0
+
+    @property
+    def remaining(self) -> int:
+        return max(self.total - self.already_sent - self.sent - self.errors, 0)
+
+    @property
+    def eta(self) -> Optional[float]:
+        """Оценка оставшегося времени в секундах (None, если скорость неизвестна)"""
+        throughput = self.throughput
+        if self.paused or throughput <= 0:
+            return None
+        return self.remaining / throughput
+
+
+# broadcast_id -> выполняющаяся рассылка
+_runs: Dict[int, BroadcastRun] = {}
+
+
+def register(run: BroadcastRun):
+    _runs[run.broadcast_id] = run
+
+
+def unregister(broadcast_id: int):
+    _runs.pop(broadcast_id, None)
+
+
+def get_run(broadcast_id: int) -> Optional[BroadcastRun]:
+    return _runs.get(broadcast_id)
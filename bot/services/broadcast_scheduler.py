@@ -0,0 +1,99 @@
+import asyncio
+import heapq
+import logging
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from sqlalchemy import select
+from ..models.base import async_session
+from ..models.models import Broadcast
+
+LaunchFunc = Callable[[int], Awaitable[None]]
+
+
+class BroadcastScheduler:
+    """
+    Планировщик отложенных рассылок.
+    Рассылки хранятся в куче по времени запуска, задача спит ровно до
+    ближайшей из них и просыпается раньше, если расписание изменилось.
+    БД читается только один раз при старте, дальше расписание обновляют обработчики.
+    """
+
+    def __init__(self):
+        self._heap: List[Tuple[datetime, int]] = []
+        # broadcast_id -> актуальное время запуска; записи в куче, не совпадающие с ним, устарели
+        self._scheduled: Dict[int, datetime] = {}
+        self._changed = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def schedule(self, broadcast_id: int, scheduled_at: datetime):
+        """Добавляет рассылку в расписание или переносит ее на новое время"""
+        self._scheduled[broadcast_id] = scheduled_at
+        heapq.heappush(self._heap, (scheduled_at, broadcast_id))
+        self._changed.set()
+
+    def cancel(self, broadcast_id: int):
+        """Убирает рассылку из расписания (запись в куче отбрасывается при извлечении)"""
+        if self._scheduled.pop(broadcast_id, None) is not None:
+            self._changed.set()
+
+    def _pop_due(self, now: datetime) -> List[int]:
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            scheduled_at, broadcast_id = heapq.heappop(self._heap)
+            if self._scheduled.get(broadcast_id) == scheduled_at:
+                del self._scheduled[broadcast_id]
+                due.append(broadcast_id)
+        return due
+
+    def _next_delay(self) -> Optional[float]:
+        # Отбрасываем устаревшие записи на вершине кучи
+        while self._heap and self._scheduled.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        if not self._heap:
+            return None
+        return max((self._heap[0][0] - datetime.now()).total_seconds(), 0)
+
+    async def load(self):
+        """Загружает из БД все запланированные и еще не запущенные рассылки"""
+        async with async_session() as session:
+            result = await session.execute(
+                select(Broadcast.id, Broadcast.scheduled_at).where(
+                    Broadcast.status == "created",
+                    Broadcast.scheduled_at.isnot(None)
+                )
+            )
+            for broadcast_id, scheduled_at in result.all():
+                self.schedule(broadcast_id, scheduled_at)
+        logging.info(f"Broadcast scheduler loaded {len(self._scheduled)} scheduled broadcasts")
+
+    async def _run(self, launch: LaunchFunc):
+        while True:
+            for broadcast_id in self._pop_due(datetime.now()):
+                try:
+                    await launch(broadcast_id)
+                except Exception as e:
+                    logging.error(f"Error launching scheduled broadcast {broadcast_id}: {e}")
+
+            self._changed.clear()
+            delay = self._next_delay()
+            try:
+                if delay is None:
+                    await self._changed.wait()
+                else:
+                    await asyncio.wait_for(self._changed.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def start(self, launch: LaunchFunc):
+        """
+        Загружает расписание и запускает фоновую задачу планировщика.
+        :param launch: Корутина запуска рассылки (принимает broadcast_id)
+        """
+        try:
+            await self.load()
+        except Exception as e:
+            logging.error(f"Error loading scheduled broadcasts: {e}")
+        self._task = asyncio.create_task(self._run(launch))
+
+
+scheduler = BroadcastScheduler()
@@ -0,0 +1,307 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+from .telegram_errors import classify_send_error, RETRY_AFTER, TRANSIENT
+
+# Глобальный бюджет Telegram (~30 сообщений в секунду на бота)
+GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
+# Лимит Telegram на один чат (1 сообщение в секунду)
+PER_CHAT_INTERVAL = 1.0
+
+# Настройки рассылки по умолчанию (можно переопределить для конкретной рассылки)
+DEFAULT_BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+DEFAULT_BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "20"))
+
+# Повторы при временных ошибках и flood wait
+MAX_SEND_ATTEMPTS = int(os.getenv("BROADCAST_MAX_ATTEMPTS", "5"))
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 60.0
+
+# recipient = (user_id, chat_id)
+Recipient = Tuple[int, int]
+DeliverFunc = Callable[[int], Awaitable[Any]]
+ResultFunc = Callable[[int, int, Optional[Exception]], Awaitable[None]]
+
+
+class TokenBucket:
+    """
+    Ведро токенов для ограничения скорости отправки.
+    Ожидающие получают токены строго по очереди.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        """
+        :param rate: Количество токенов в секунду
+        :param capacity: Максимальный размер всплеска (по умолчанию - один секундный объем)
+        """
+        self.rate = max(rate, 0.1)
+        self.capacity = capacity if capacity is not None else max(self.rate, 1.0)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def set_rate(self, rate: float):
+        """Меняет скорость на лету"""
+        self._refill(time.monotonic())
+        self.rate = max(rate, 0.1)
+        self.capacity = max(self.rate, 1.0)
+        self.tokens = min(self.tokens, self.capacity)
+
+    def pause(self, seconds: float):
+        """Останавливает выдачу токенов на заданное время (например, при flood wait)"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    @property
+    def is_paused(self) -> bool:
+        return time.monotonic() < self.paused_until
+
+    async def acquire(self):
+        """Ждет, пока не освободится токен"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    # После паузы начинаем с пустого ведра, без всплеска
+                    self.tokens = 0
+                    self.updated_at = time.monotonic()
+                    continue
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class ChatThrottle:
+    """Следит за тем, чтобы в один чат уходило не больше одного сообщения в секунду"""
+
+    def __init__(self, interval: float = PER_CHAT_INTERVAL, max_entries: int = 10000):
+        self.interval = interval
+        self.max_entries = max_entries
+        self.last_sent: Dict[int, float] = {}  # chat_id -> время последней отправки
+
+    async def wait(self, chat_id: int):
+        now = time.monotonic()
+        last = self.last_sent.get(chat_id)
+        if last is not None and now - last < self.interval:
+            await asyncio.sleep(self.interval - (now - last))
+            now = time.monotonic()
+        self.last_sent[chat_id] = now
+
+        # Чистим устаревшие записи, чтобы словарь не рос бесконечно
+        if len(self.last_sent) > self.max_entries:
+            self.last_sent = {
+                chat: sent_at for chat, sent_at in self.last_sent.items()
+                if now - sent_at < self.interval
+            }
+
+
+# Общие для всех рассылок ограничители, чтобы параллельные рассылки не превышали лимиты бота.
+# Flood wait от Telegram ставит на паузу общее ведро, то есть все рассылки сразу.
+global_bucket = TokenBucket(GLOBAL_RATE)
+chat_throttle = ChatThrottle()
+
+
+class BroadcastSender:
+    """
+    Движок доставки рассылки.
+    Пул асинхронных воркеров отправляет сообщения параллельно, а скорость
+    ограничивается ведром токенов рассылки и общим ведром бота.
+    Временные ошибки и flood wait попадают в очередь повторов с задержкой,
+    остальные ошибки сразу передаются в колбэк результата.
+    Результаты обрабатываются последовательно одной задачей, поэтому
+    колбэк может безопасно работать с сессией БД.
+    """
+
+    def __init__(
+        self,
+        deliver: DeliverFunc,
+        rate: Optional[float] = None,
+        concurrency: Optional[int] = None,
+        max_attempts: int = MAX_SEND_ATTEMPTS
+    ):
+        """
+        :param deliver: Корутина отправки сообщения в чат (принимает chat_id)
+        :param rate: Скорость рассылки в сообщениях в секунду
+        :param concurrency: Количество одновременных запросов к API
+        :param max_attempts: Максимальное количество попыток отправки одному получателю
+        """
+        self.deliver = deliver
+        self.rate = rate or DEFAULT_BROADCAST_RATE
+        self.concurrency = max(1, concurrency or DEFAULT_BROADCAST_CONCURRENCY)
+        self.max_attempts = max_attempts
+        self.bucket = TokenBucket(self.rate)
+
+        # Очередь повторов: (время готовности, порядковый номер, задание)
+        self._retries: List[Tuple[float, int, Tuple[int, int, int]]] = []
+        self._retry_seq = itertools.count()
+        self._retry_added = asyncio.Event()
+        self.retried = 0
+
+        # Количество получателей, по которым еще нет окончательного результата
+        self._outstanding = 0
+        self._producer_done = False
+        self._drained = asyncio.Event()
+
+        # Управление рассылкой: пауза и остановка
+        self._running = asyncio.Event()
+        self._running.set()
+        self.stopped = False
+
+    def set_rate(self, rate: float):
+        self.rate = rate
+        self.bucket.set_rate(rate)
+
+    @property
+    def paused(self) -> bool:
+        return not self._running.is_set()
+
+    def pause(self):
+        """Приостанавливает отправку (уже начатые запросы завершаются)"""
+        self._running.clear()
+
+    def resume(self):
+        self._running.set()
+
+    def stop(self):
+        """Останавливает рассылку: новые получатели не берутся, оставшиеся задания отбрасываются"""
+        self.stopped = True
+        self._running.set()
+        self._drained.set()
+
+    async def _send_one(self, chat_id: int) -> Optional[Exception]:
+        await self._running.wait()
+        await self.bucket.acquire()
+        await global_bucket.acquire()
+        await chat_throttle.wait(chat_id)
+        try:
+            await self.deliver(chat_id)
+        except Exception as e:
+            return e
+        return None
+
+    def _retry_delay(self, error: Exception, attempt: int) -> Optional[float]:
+        """Задержка перед повтором или None, если повторять не нужно"""
+        kind = classify_send_error(error)
+        if kind == RETRY_AFTER:
+            # Flood wait касается всего бота - останавливаем все отправки,
+            # даже если у этого получателя попытки закончились
+            logging.warning(f"Telegram flood wait for {error.retry_after}s, pausing broadcasts")
+            global_bucket.pause(error.retry_after)
+
+        if attempt + 1 >= self.max_attempts:
+            return None
+        if kind == RETRY_AFTER:
+            return float(error.retry_after)
+        if kind == TRANSIENT:
+            return min(RETRY_BASE_DELAY * 2 ** attempt, RETRY_MAX_DELAY)
+        return None
+
+    def _schedule_retry(self, job: Tuple[int, int, int], delay: float):
+        user_id, chat_id, attempt = job
+        heapq.heappush(
+            self._retries,
+            (time.monotonic() + delay, next(self._retry_seq), (user_id, chat_id, attempt + 1))
+        )
+        self.retried += 1
+        self._retry_added.set()
+
+    def _finish_one(self):
+        self._outstanding -= 1
+        if self._producer_done and self._outstanding == 0:
+            self._drained.set()
+
+    async def _worker(self, queue: asyncio.Queue, results: asyncio.Queue):
+        while True:
+            job = await queue.get()
+            try:
+                if self.stopped:
+                    continue
+                user_id, chat_id, attempt = job
+                error = await self._send_one(chat_id)
+                if error is not None:
+                    delay = self._retry_delay(error, attempt)
+                    if delay is not None:
+                        self._schedule_retry(job, delay)
+                        continue
+                await results.put((user_id, chat_id, error))
+                self._finish_one()
+            finally:
+                queue.task_done()
+
+    async def _retry_loop(self, queue: asyncio.Queue):
+        """Возвращает задания из очереди повторов в рабочую очередь, когда подходит их время"""
+        while True:
+            if not self._retries:
+                self._retry_added.clear()
+                await self._retry_added.wait()
+                continue
+
+            delay = self._retries[0][0] - time.monotonic()
+            if delay > 0:
+                # Просыпаемся раньше, если появится задание с меньшей задержкой
+                self._retry_added.clear()
+                try:
+                    await asyncio.wait_for(self._retry_added.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, _, job = heapq.heappop(self._retries)
+            await queue.put(job)
+
+    async def _collector(self, results: asyncio.Queue, on_result: ResultFunc):
+        while True:
+            item = await results.get()
+            if item is None:
+                return
+            try:
+                await on_result(*item)
+            except Exception as e:
+                logging.error(f"Error handling broadcast delivery result: {e}")
+
+    async def run(self, recipients: AsyncIterator[Recipient], on_result: ResultFunc):
+        """
+        Отправляет сообщения всем получателям.
+        :param recipients: Асинхронный итератор пар (user_id, chat_id)
+        :param on_result: Колбэк (user_id, chat_id, error), error = None при успехе
+        """
+        # Ограниченная очередь: продюсер не убегает далеко вперед воркеров
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        results: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 4)
+
+        tasks = [
+            asyncio.create_task(self._worker(queue, results))
+            for _ in range(self.concurrency)
+        ]
+        tasks.append(asyncio.create_task(self._retry_loop(queue)))
+        collector = asyncio.create_task(self._collector(results, on_result))
+
+        try:
+            async for user_id, chat_id in recipients:
+                if self.stopped:
+                    break
+                self._outstanding += 1
+                await queue.put((user_id, chat_id, 0))
+
+            # Ждем окончательного результата по всем получателям, включая повторы
+            self._producer_done = True
+            if self._outstanding == 0:
+                self._drained.set()
+            await self._drained.wait()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await results.put(None)
+            await collector
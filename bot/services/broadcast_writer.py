@@ -0,0 +1,171 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from datetime import datetime
+from typing import Deque, List, Optional, Set
+from sqlalchemy import update
+from sqlalchemy.dialects.postgresql import insert
+from ..models.base import async_session
+from ..models.models import Broadcast, BroadcastRecipient
+from . import reachability
+from .broadcast_lease import INSTANCE_ID, BroadcastLease
+
+# Записи о получателях накапливаются и сохраняются пачками
+RECIPIENT_FLUSH_SIZE = int(os.getenv("BROADCAST_FLUSH_SIZE", "500"))
+RECIPIENT_FLUSH_INTERVAL = float(os.getenv("BROADCAST_FLUSH_INTERVAL", "5"))
+
+
+class DeliveryCursor:
+    """
+    Контрольная точка рассылки.
+    Получатели отправляются в порядке возрастания id, но завершаются вразнобой,
+    поэтому курсор хранит наибольший id, до которого (включительно) все
+    получатели уже обработаны. С него рассылка продолжается после перезапуска.
+    """
+
+    def __init__(self, start_id: int = 0):
+        self.watermark = start_id
+        self.pending: Deque[int] = deque()  # отправленные в работу id по порядку
+        self.done: Set[int] = set()  # завершенные id, которые еще не вошли в watermark
+
+    def dispatch(self, user_id: int):
+        self.pending.append(user_id)
+
+    def complete(self, user_id: int):
+        self.done.add(user_id)
+        while self.pending and self.pending[0] in self.done:
+            self.watermark = self.pending.popleft()
+            self.done.discard(self.watermark)
+
+
+class RecipientWriter:
+    """
+    Буфер результатов рассылки.
+    Получатели копятся в памяти и записываются в БД одним многострочным INSERT
+    вместе с обновлением счетчика received_count в той же транзакции.
+    Уже записанные получатели (например, после перезапуска) пропускаются и не учитываются в счетчике.
+    Запись происходит при заполнении буфера или по таймеру.
+    Прогресс пишется, только пока рассылку держит этот экземпляр бота: после потери аренды
+    записи отбрасываются, чтобы не затереть прогресс нового владельца.
+    """
+
+    def __init__(
+        self,
+        broadcast_id: int,
+        cursor: Optional[DeliveryCursor] = None,
+        lease: Optional[BroadcastLease] = None,
+        flush_size: int = RECIPIENT_FLUSH_SIZE,
+        flush_interval: float = RECIPIENT_FLUSH_INTERVAL
+    ):
+        self.broadcast_id = broadcast_id
+        self.cursor = cursor or DeliveryCursor()
+        self.lease = lease
+        self.saved_watermark = self.cursor.watermark
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.buffer: List[dict] = []
+        self.unreachable: List[int] = []  # пользователи, заблокировавшие бота
+        self.written = 0
+        self.last_flush = time.monotonic()
+        self._lock = asyncio.Lock()
+        self._ticker: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Запускает периодическую запись, чтобы прогресс обновлялся и при медленной отправке"""
+        self._ticker = asyncio.create_task(self._tick())
+
+    async def _tick(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error(f"Error flushing broadcast {self.broadcast_id} recipients: {e}")
+
+    async def add(self, user_id: int):
+        """Добавляет успешно доставленного получателя"""
+        self.buffer.append({
+            "broadcast_id": self.broadcast_id,
+            "user_id": user_id,
+            "received": True,
+            "received_at": datetime.now()
+        })
+        self.cursor.complete(user_id)
+        if len(self.buffer) >= self.flush_size:
+            await self.flush()
+
+    def skip(self, user_id: int):
+        """Отмечает получателя, которому не удалось доставить сообщение"""
+        self.cursor.complete(user_id)
+
+    def suppress(self, user_id: int, chat_id: int):
+        """Отмечает получателя, который заблокировал бота: он будет исключен из следующих рассылок"""
+        self.unreachable.append(user_id)
+        reachability.forget(chat_id)
+        self.cursor.complete(user_id)
+
+    async def flush(self):
+        """Записывает накопленных получателей, прогресс и контрольную точку рассылки"""
+        async with self._lock:
+            # Буфер и курсор снимаются в один момент: все id до watermark
+            # либо попали в этот буфер, либо были записаны раньше
+            rows, self.buffer = self.buffer, []
+            unreachable, self.unreachable = self.unreachable, []
+            watermark = self.cursor.watermark
+            if not rows and not unreachable and watermark == self.saved_watermark:
+                return
+            if self.lease and self.lease.lost:
+                logging.warning(f"Broadcast {self.broadcast_id} lease lost, dropping {len(rows)} unsaved recipients")
+                return
+
+            inserted = 0
+            try:
+                async with async_session() as session:
+                    if rows:
+                        result = await session.execute(
+                            insert(BroadcastRecipient)
+                            .values(rows)
+                            .on_conflict_do_nothing(index_elements=["broadcast_id", "user_id"])
+                            .returning(BroadcastRecipient.user_id)
+                        )
+                        inserted = len(result.all())
+                    if unreachable:
+                        await session.execute(reachability.mark_unreachable_stmt(unreachable))
+                    result = await session.execute(
+                        update(Broadcast)
+                        .where(Broadcast.id == self.broadcast_id, Broadcast.claimed_by == INSTANCE_ID)
+                        .values(
+                            received_count=Broadcast.received_count + inserted,
+                            last_user_id=watermark
+                        )
+                    )
+                    if result.rowcount == 0:
+                        # Рассылку забрал другой экземпляр бота: ничего не сохраняем и останавливаемся
+                        await session.rollback()
+                        logging.warning(f"Broadcast {self.broadcast_id} is no longer claimed by {INSTANCE_ID}, dropping {len(rows)} unsaved recipients")
+                        if self.lease:
+                            self.lease.mark_lost()
+                        return
+                    await session.commit()
+            except Exception:
+                # Возвращаем записи в буфер, чтобы сохранить их при следующей попытке
+                self.buffer = rows + self.buffer
+                self.unreachable = unreachable + self.unreachable
+                raise
+
+            self.written += inserted
+            self.saved_watermark = watermark
+            self.last_flush = time.monotonic()
+
+    async def close(self):
+        """Останавливает таймер и записывает остаток буфера"""
+        if self._ticker:
+            self._ticker.cancel()
+            try:
+                await self._ticker
+            except asyncio.CancelledError:
+                pass
+            self._ticker = None
+        await self.flush()
@@ -0,0 +1,84 @@
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import and_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..models.models import MenuItem, Restaurant, User
+
+# Суммируемые поля позиции корзины
+TOTAL_FIELDS = ("kisses", "hugs", "duration")
+
+
+def empty_cart(restaurant_id: Optional[int] = None, menu_version: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Корзина в данных состояния:
+    {"restaurant_id", "menu_version", "items": {"<id позиции>": {"qty", "name", "kisses", "hugs", "duration"}}, "totals"}
+    В позициях хранится снимок цен на единицу, итоги пересчитываются при каждом добавлении.
+    Ключи позиций - строки, так как данные состояния сохраняются в JSON.
+    """
+    return {
+        "restaurant_id": restaurant_id,
+        "menu_version": menu_version,
+        "items": {},
+        "totals": dict.fromkeys(TOTAL_FIELDS, 0),
+    }
+
+
+def load_cart(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Корзина из данных состояния (данные в другом формате считаются пустой корзиной)"""
+    cart = data.get("cart")
+    if not isinstance(cart, dict) or "items" not in cart:
+        return empty_cart()
+    return cart
+
+
+def _snapshot(item: MenuItem, qty: int = 0) -> Dict[str, Any]:
+    return {
+        "qty": qty,
+        "name": item.name,
+        "kisses": item.price_kisses or 0,
+        "hugs": item.price_hugs or 0,
+        "duration": item.duration or 0,
+    }
+
+
+def add_item(cart: Dict[str, Any], item: MenuItem):
+    """Добавляет единицу позиции и обновляет итоги"""
+    entry = cart["items"].setdefault(str(item.id), _snapshot(item))
+    entry["qty"] += 1
+    totals = cart["totals"]
+    for field in TOTAL_FIELDS:
+        totals[field] += entry[field]
+
+
+def rebuild_cart(cart: Dict[str, Any], items: Iterable[MenuItem], menu_version: int) -> Dict[str, Any]:
+    """Пересобирает корзину по актуальным позициям меню, сохраняя количества; удаленные позиции пропадают"""
+    quantities = {key: entry["qty"] for key, entry in cart["items"].items()}
+    rebuilt = empty_cart(cart["restaurant_id"], menu_version)
+    totals = rebuilt["totals"]
+    for item in items:
+        qty = quantities.get(str(item.id))
+        if not qty:
+            continue
+        entry = _snapshot(item, qty)
+        rebuilt["items"][str(item.id)] = entry
+        for field in TOTAL_FIELDS:
+            totals[field] += entry[field] * qty
+    return rebuilt
+
+
+async def resolve_cart(session: AsyncSession, cart: Dict[str, Any]) -> Optional[Tuple[Restaurant, User, List[MenuItem]]]:
+    """
+    Ресторан корзины, его владелец и актуальные позиции корзины одним запросом
+    (WHERE id IN (...) с присоединением ресторана и владельца). None - ресторана больше нет.
+    """
+    item_ids = [int(key) for key in cart["items"]]
+    result = await session.execute(
+        select(Restaurant, User, MenuItem)
+        .join(User, User.id == Restaurant.owner_id)
+        .outerjoin(MenuItem, and_(MenuItem.restaurant_id == Restaurant.id, MenuItem.id.in_(item_ids)))
+        .where(Restaurant.id == cart["restaurant_id"])
+    )
+    rows = result.all()
+    if not rows:
+        return None
+    restaurant, owner, _ = rows[0]
+    return restaurant, owner, [item for _, _, item in rows if item is not None]
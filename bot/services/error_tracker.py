@@ -0,0 +1,113 @@
+import hashlib
+import os
+import time
+import traceback
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+# Сколько верхних кадров стека учитывать в отпечатке ошибки
+FINGERPRINT_FRAMES = 5
+# Сколько разных ошибок хранить
+MAX_FINGERPRINTS = 500
+# Сколько ошибок показывать в сводке
+DIGEST_TOP = 5
+
+
+class ErrorStats:
+    """Счетчики одной ошибки (по отпечатку)"""
+    __slots__ = ("fingerprint", "type_name", "location", "message", "count", "window_count", "first_seen", "reported_at")
+
+    def __init__(self, fingerprint: str, type_name: str, location: str, message: str, now: float):
+        self.fingerprint = fingerprint
+        self.type_name = type_name
+        self.location = location
+        self.message = message  # пример сообщения, для сводки
+        self.count = 0  # всего с момента запуска
+        self.window_count = 0  # с момента последней сводки
+        self.first_seen = now
+        self.reported_at: Optional[float] = None
+
+
+def _frames(error: BaseException) -> List[Tuple[str, str, int]]:
+    """Кадры стека (файл, функция, строка) без чтения исходников"""
+    frames = [
+        (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name, lineno)
+        for frame, lineno in traceback.walk_tb(error.__traceback__)
+    ]
+    return frames[-FINGERPRINT_FRAMES:]
+
+
+def fingerprint(error: BaseException) -> Tuple[str, str]:
+    """
+    Отпечаток ошибки: тип исключения и место в коде, без текста сообщения,
+    чтобы ошибки, отличающиеся только id или значениями, считались одной.
+    :return: (отпечаток, место возникновения для отображения)
+    """
+    frames = _frames(error)
+    type_name = f"{type(error).__module__}.{type(error).__qualname__}"
+    raw = type_name + "|" + "|".join(f"{file}:{func}:{line}" for file, func, line in frames)
+    location = f"{frames[-1][0]}:{frames[-1][2]} in {frames[-1][1]}" if frames else "неизвестно"
+    return hashlib.sha1(raw.encode()).hexdigest()[:12], location
+
+
+class ErrorTracker:
+    """
+    Учет ошибок по отпечаткам.
+    Счетчики хранятся в LRU ограниченного размера. track() сообщает, нужно ли
+    сообщать об ошибке подробно: только при первом появлении в окне report_window.
+    """
+
+    def __init__(self, report_window: float = 300, max_entries: int = MAX_FINGERPRINTS):
+        """
+        :param report_window: Окно в секундах, в котором об ошибке сообщается подробно только один раз
+        :param max_entries: Максимальное количество хранимых отпечатков
+        """
+        self.report_window = report_window
+        self.max_entries = max_entries
+        self._errors: "OrderedDict[str, ErrorStats]" = OrderedDict()
+
+    def track(self, error: BaseException) -> Tuple[ErrorStats, bool]:
+        """
+        Учитывает ошибку.
+        :return: (счетчики ошибки, нужно ли подробно сообщить о ней)
+        """
+        now = time.monotonic()
+        key, location = fingerprint(error)
+        stats = self._errors.get(key)
+        if stats is None:
+            stats = ErrorStats(key, type(error).__name__, location, str(error)[:200], now)
+            self._errors[key] = stats
+            while len(self._errors) > self.max_entries:
+                self._errors.popitem(last=False)
+        else:
+            self._errors.move_to_end(key)
+
+        stats.count += 1
+        stats.window_count += 1
+
+        should_report = stats.reported_at is None or now - stats.reported_at >= self.report_window
+        if should_report:
+            stats.reported_at = now
+        return stats, should_report
+
+    def top(self, limit: int = DIGEST_TOP) -> List[ErrorStats]:
+        """Самые частые ошибки с момента последней сводки"""
+        active = [stats for stats in self._errors.values() if stats.window_count]
+        active.sort(key=lambda stats: stats.window_count, reverse=True)
+        return active[:limit]
+
+    def digest_lines(self) -> List[str]:
+        """Строки сводки для администратора; сбрасывает счетчики окна"""
+        top = self.top()
+        if not top:
+            return []
+
+        total = sum(stats.window_count for stats in self._errors.values())
+        distinct = sum(1 for stats in self._errors.values() if stats.window_count)
+        lines = [f"⚠️ Ошибки: {total}, различных: {distinct}. Самые частые:"]
+        for i, stats in enumerate(top, 1):
+            lines.append(f"  {i}. {stats.type_name} ({stats.location}) - {stats.window_count} раз")
+
+        for stats in self._errors.values():
+            stats.window_count = 0
+        return lines
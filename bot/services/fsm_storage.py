@@ -0,0 +1,368 @@
+import asyncio
+import copy
+import json
+import logging
+import os
+import sys
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+from typing import Any, Dict, Mapping, Optional, Tuple
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey, StateType
+
+# Как часто записывать изменения в хранилище, в секундах
+FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", "1"))
+# Сколько записей держать в кэше
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "10000"))
+# Через сколько секунд перечитывать сохраненную запись (ее мог изменить другой экземпляр бота)
+FSM_CACHE_TTL = float(os.getenv("FSM_CACHE_TTL", "30"))
+# Как часто удалять брошенные состояния, в секундах
+FSM_SWEEP_INTERVAL = float(os.getenv("FSM_SWEEP_INTERVAL", "60"))
+
+# Время жизни состояния без активности пользователя по группам состояний, в секундах
+STATE_TTLS = {
+    "RestaurantCreation": 60 * 60,
+    "RestaurantEntry": 60 * 60,
+    "RestaurantSettings": 60 * 60,
+    "MenuItemForm": 6 * 60 * 60,
+    "EditMenuItem": 6 * 60 * 60,
+    "BroadcastForm": 24 * 60 * 60,
+    "CustomStarsAmount": 60 * 60,
+    "DonationComment": 60 * 60,
+    "UserSearch": 60 * 60,
+}
+# Для групп, которых нет в STATE_TTLS
+DEFAULT_STATE_TTL = 6 * 60 * 60
+# Данные без состояния (корзина, номера страниц списков)
+NO_STATE_TTL = 3 * 24 * 60 * 60
+NO_STATE_GROUP = "no_state"
+
+
+def _json_default(value: Any):
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+    if isinstance(value, date):
+        return {"__date__": value.isoformat()}
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _json_object_hook(value: Dict[str, Any]):
+    if "__datetime__" in value:
+        return datetime.fromisoformat(value["__datetime__"])
+    if "__date__" in value:
+        return date.fromisoformat(value["__date__"])
+    return value
+
+
+def json_dumps(value: Any) -> str:
+    """JSON с поддержкой дат (в данных состояний хранятся даты запланированных рассылок)"""
+    return json.dumps(value, default=_json_default)
+
+
+def json_loads(value: str) -> Any:
+    return json.loads(value, object_hook=_json_object_hook)
+
+
+def state_group(state: Optional[str]) -> str:
+    """Группа состояния (имя StatesGroup): MenuItemForm:price -> MenuItemForm"""
+    if state is None:
+        return NO_STATE_GROUP
+    return state.split(":", 1)[0]
+
+
+def state_ttl(state: Optional[str]) -> float:
+    """Время жизни состояния без активности пользователя"""
+    if state is None:
+        return NO_STATE_TTL
+    return STATE_TTLS.get(state_group(state), DEFAULT_STATE_TTL)
+
+
+def _data_size(data: Dict[str, Any]) -> int:
+    """Примерный объем данных состояния в байтах"""
+    try:
+        return sys.getsizeof(data) + len(json_dumps(data))
+    except (TypeError, ValueError):
+        return sys.getsizeof(data)
+
+
+class _Record:
+    """Закэшированное состояние одного пользователя"""
+    __slots__ = ("state", "data", "dirty", "loaded_at", "touched_at")
+
+    def __init__(self, state: Optional[str], data: Dict[str, Any]):
+        self.state = state
+        self.data = data
+        self.dirty = False
+        self.loaded_at = self.touched_at = time.monotonic()
+
+
+class CachedStorage(BaseStorage):
+    """
+    Хранилище FSM с кэшем в памяти и отложенной записью.
+    Чтение и изменение состояния работают с кэшем, а измененные записи
+    пачкой сохраняются в основное хранилище раз в flush_interval секунд
+    (несколько изменений одной записи за это время дают одну запись).
+    Без основного хранилища кэш сам является хранилищем (состояния живут в памяти процесса).
+
+    Состояния, к которым пользователь не обращался дольше времени жизни его группы
+    (STATE_TTLS), истекают, а фоновая задача удаляет брошенные записи из памяти.
+    """
+
+    def __init__(
+        self,
+        backend: Optional[BaseStorage] = None,
+        flush_interval: float = FSM_FLUSH_INTERVAL,
+        max_entries: int = FSM_CACHE_SIZE,
+        cache_ttl: float = FSM_CACHE_TTL,
+        sweep_interval: float = FSM_SWEEP_INTERVAL
+    ):
+        """
+        :param backend: Основное (постоянное) хранилище, None - только память процесса
+        :param flush_interval: Период записи изменений в секундах
+        :param max_entries: Максимальное количество записей в кэше
+        :param cache_ttl: Время жизни сохраненной записи в кэше в секундах
+        :param sweep_interval: Период удаления брошенных состояний в секундах
+        """
+        self.backend = backend
+        self.flush_interval = flush_interval
+        self.max_entries = max_entries
+        self.cache_ttl = cache_ttl
+        self.sweep_interval = sweep_interval
+        self._records: "OrderedDict[StorageKey, _Record]" = OrderedDict()
+        self._dirty: set = set()
+        self._loading: Dict[StorageKey, asyncio.Future] = {}
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._sweep_task: Optional[asyncio.Task] = None
+        self.expired = 0  # сброшено брошенных состояний с момента запуска
+
+    async def _load(self, key: StorageKey) -> _Record:
+        if self.backend is None:
+            return _Record(None, {})
+        state, data = await asyncio.gather(self.backend.get_state(key), self.backend.get_data(key))
+        return _Record(state, data or {})
+
+    async def _record(self, key: StorageKey) -> _Record:
+        now = time.monotonic()
+        if self._sweep_task is None:
+            self._sweep_task = asyncio.create_task(self._sweep_loop())
+
+        record = self._records.get(key)
+        if record is not None and (self.backend is None or record.dirty or now - record.loaded_at < self.cache_ttl):
+            self._records.move_to_end(key)
+            record.touched_at = now
+            return record
+
+        # Одновременные запросы одного пользователя ждут одну загрузку
+        loading = self._loading.get(key)
+        if loading is None:
+            loading = asyncio.ensure_future(self._load(key))
+            self._loading[key] = loading
+            try:
+                record = await loading
+            finally:
+                self._loading.pop(key, None)
+            self._records[key] = record
+            self._evict()
+            return record
+        return await loading
+
+    def _evict(self):
+        # Вытесняем самые давние записи, которые уже сохранены
+        if self.backend is None or len(self._records) <= self.max_entries:
+            return
+        for key in list(self._records):
+            if len(self._records) <= self.max_entries:
+                break
+            if key not in self._dirty:
+                del self._records[key]
+
+    def _mark_dirty(self, key: StorageKey, record: _Record):
+        if self.backend is None:
+            # Сохранять некуда; пустую запись (после state.clear()) сразу убираем из памяти
+            if record.state is None and not record.data:
+                self._records.pop(key, None)
+            return
+        record.dirty = True
+        self._dirty.add(key)
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = await self._record(key)
+        record.state = state.state if isinstance(state, State) else state
+        self._mark_dirty(key, record)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._record(key)).state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        record = await self._record(key)
+        record.data = dict(data)
+        self._mark_dirty(key, record)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return copy.copy((await self._record(key)).data)
+
+    async def update_data(self, key: StorageKey, data: Mapping[str, Any]) -> Dict[str, Any]:
+        record = await self._record(key)
+        record.data = {**record.data, **data}
+        self._mark_dirty(key, record)
+        return copy.copy(record.data)
+
+    async def _flush_loop(self):
+        while self._dirty:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error(f"Error flushing FSM storage: {e}")
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                logging.error(f"Error sweeping FSM storage: {e}")
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """
+        Удаляет из памяти брошенные записи.
+        Без основного хранилища состояние сбрасывается после времени жизни своей группы.
+        С основным хранилищем из кэша убираются сохраненные записи, к которым давно не
+        обращались, а истечение по группам выполняет само хранилище (см. _write).
+        :return: Количество сброшенных состояний
+        """
+        now = time.monotonic() if now is None else now
+        expired = 0
+        for key, record in list(self._records.items()):
+            idle = now - record.touched_at
+            if self.backend is None:
+                if record.state is None and not record.data:
+                    del self._records[key]
+                elif idle >= state_ttl(record.state):
+                    del self._records[key]
+                    expired += 1
+            elif not record.dirty and idle >= self.cache_ttl:
+                del self._records[key]
+
+        if expired:
+            self.expired += expired
+            logging.info(f"Expired {expired} abandoned FSM states, {len(self._records)} remain in memory")
+        return expired
+
+    def memory_stats(self) -> Dict[str, Tuple[int, int]]:
+        """Количество записей и примерный объем данных в байтах по группам состояний"""
+        stats: Dict[str, Tuple[int, int]] = {}
+        for record in self._records.values():
+            group = state_group(record.state)
+            count, size = stats.get(group, (0, 0))
+            stats[group] = (count + 1, size + _data_size(record.data))
+        return stats
+
+    async def _write(self, key: StorageKey, state: Optional[str], data: Dict[str, Any]):
+        await self.backend.set_state(key, state)
+        await self.backend.set_data(key, data)
+
+    async def _write_redis(self, redis, batch):
+        """
+        Записывает пачку в Redis одним конвейером (один сетевой обмен на всю пачку).
+        Время жизни ключей задается по группе текущего состояния.
+        """
+        key_builder = self.backend.key_builder
+        async with redis.pipeline(transaction=False) as pipe:
+            for key, _, state, data in batch:
+                ttl = int(state_ttl(state))
+                state_key = key_builder.build(key, "state")
+                data_key = key_builder.build(key, "data")
+                if state is None:
+                    pipe.delete(state_key)
+                else:
+                    pipe.set(state_key, state, ex=ttl)
+                if not data:
+                    pipe.delete(data_key)
+                else:
+                    pipe.set(data_key, self.backend.json_dumps(data), ex=ttl)
+            await pipe.execute()
+
+    async def flush(self):
+        """Записывает все измененные записи в основное хранилище"""
+        if self.backend is None:
+            return
+        async with self._flush_lock:
+            keys, self._dirty = self._dirty, set()
+            batch = []
+            for key in keys:
+                record = self._records.get(key)
+                if record is None:
+                    continue
+                record.dirty = False
+                batch.append((key, record, record.state, copy.copy(record.data)))
+            if not batch:
+                return
+
+            redis = getattr(self.backend, "redis", None)
+            if redis is not None:
+                try:
+                    await self._write_redis(redis, batch)
+                    results = [None] * len(batch)
+                except Exception as e:
+                    results = [e] * len(batch)
+            else:
+                results = await asyncio.gather(
+                    *(self._write(key, state, data) for key, _, state, data in batch),
+                    return_exceptions=True
+                )
+
+            errors = []
+            for (key, record, _, _), result in zip(batch, results):
+                if isinstance(result, Exception):
+                    # Запишем при следующей попытке
+                    record.dirty = True
+                    self._dirty.add(key)
+                    errors.append(result)
+            if errors:
+                logging.error(f"Failed to write {len(errors)} FSM records, will retry: {errors[0]}")
+
+    async def close(self) -> None:
+        """Сохраняет несохраненные изменения и закрывает основное хранилище"""
+        for task in (self._flush_task, self._sweep_task):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._flush_task = self._sweep_task = None
+        await self.flush()
+        if self.backend is not None:
+            await self.backend.close()
+
+
+def create_fsm_storage() -> BaseStorage:
+    """
+    Хранилище состояний FSM.
+    При заданном REDIS_URL состояния хранятся в Redis (переживают перезапуск и общие для
+    всех экземпляров бота) с кэшем и отложенной записью, иначе - в памяти процесса.
+    Брошенные состояния в обоих случаях удаляются по времени жизни их группы.
+    """
+    redis_url = os.getenv("REDIS_URL")
+    if redis_url:
+        try:
+            from aiogram.fsm.storage.redis import RedisStorage
+
+            # Предельное время жизни ключей; по группам его уточняет CachedStorage
+            max_ttl = int(max(NO_STATE_TTL, DEFAULT_STATE_TTL, *STATE_TTLS.values()))
+            backend = RedisStorage.from_url(
+                redis_url,
+                state_ttl=max_ttl,
+                data_ttl=max_ttl,
+                json_loads=json_loads,
+                json_dumps=json_dumps
+            )
+            return CachedStorage(backend)
+        except ImportError:
+            logging.warning("REDIS_URL is set but redis package is not installed, using in-memory FSM storage")
+    return CachedStorage()
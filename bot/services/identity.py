@@ -0,0 +1,188 @@
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional, Set
+from sqlalchemy import event, inspect, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from ..models.models import Restaurant, User
+
+# Сколько пользователей держать в кэше
+IDENTITY_CACHE_SIZE = int(os.getenv("IDENTITY_CACHE_SIZE", "50000"))
+# Время жизни снимка в секундах: страховка от изменений, сделанных в обход ORM или другим экземпляром бота
+IDENTITY_CACHE_TTL = float(os.getenv("IDENTITY_CACHE_TTL", "60"))
+
+# Колонки, которые входят в снимок: их изменение сбрасывает кэш
+TRACKED_COLUMNS = ("id", "telegram_id", "is_restaurant_owner", "current_restaurant_id")
+
+# Ключ в session.info со списком telegram_id, измененных в текущей транзакции
+_PENDING_KEY = "identity_invalidate"
+# Ключ в session.info: в транзакции создан или удален ресторан, после фиксации кэш сбрасывается целиком
+_PENDING_CLEAR_KEY = "identity_clear"
+
+
+class UserSnapshot(NamedTuple):
+    """Неизменяемый снимок пользователя для проверок доступа и навигации"""
+    id: int
+    telegram_id: int
+    is_restaurant_owner: bool
+    current_restaurant_id: Optional[int]
+    restaurant_id: Optional[int]  # ресторан, которым владеет пользователь
+
+
+class IdentityCache:
+    """
+    LRU-кэш снимков пользователей по telegram_id с ограниченным временем жизни.
+    Снимки сбрасываются при изменении отслеживаемых колонок через ORM (см. события ниже).
+    """
+
+    def __init__(self, max_entries: int = IDENTITY_CACHE_SIZE, ttl: float = IDENTITY_CACHE_TTL):
+        """
+        :param max_entries: Максимальное количество снимков
+        :param ttl: Время жизни снимка в секундах
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._items: "OrderedDict[int, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def get(self, telegram_id: int) -> Optional[UserSnapshot]:
+        item = self._items.get(telegram_id)
+        if item is not None:
+            snapshot, cached_at = item
+            if time.monotonic() - cached_at < self.ttl:
+                self._items.move_to_end(telegram_id)
+                self.hits += 1
+                return snapshot
+            del self._items[telegram_id]
+        self.misses += 1
+        return None
+
+    def put(self, snapshot: UserSnapshot):
+        self._items.pop(snapshot.telegram_id, None)
+        self._items[snapshot.telegram_id] = (snapshot, time.monotonic())
+        while len(self._items) > self.max_entries:
+            self._items.popitem(last=False)
+
+    def invalidate(self, telegram_id: int):
+        if self._items.pop(telegram_id, None) is not None:
+            self.invalidations += 1
+
+    def clear(self):
+        self._items.clear()
+
+
+identity_cache = IdentityCache()
+
+
+def remember_user(user: User, restaurant_id: Optional[int]) -> UserSnapshot:
+    """Кладет в кэш снимок уже загруженного пользователя (объекта или строки с теми же колонками)"""
+    snapshot = UserSnapshot(
+        user.id, user.telegram_id, bool(user.is_restaurant_owner), user.current_restaurant_id, restaurant_id
+    )
+    identity_cache.put(snapshot)
+    return snapshot
+
+
+async def get_user_snapshot(session: AsyncSession, telegram_id: int) -> Optional[UserSnapshot]:
+    """
+    Снимок пользователя по telegram_id: из кэша или одним запросом по нужным колонкам
+    (вместе с id ресторана, которым он владеет).
+    Отсутствующие пользователи не кэшируются, так как их создают при первом обращении.
+    """
+    snapshot = identity_cache.get(telegram_id)
+    if snapshot is not None:
+        return snapshot
+
+    result = await session.execute(
+        select(
+            User.id, User.telegram_id, User.is_restaurant_owner, User.current_restaurant_id,
+            Restaurant.id.label("restaurant_id")
+        )
+        .outerjoin(Restaurant, Restaurant.owner_id == User.id)
+        .where(User.telegram_id == telegram_id)
+    )
+    row = result.first()
+    if row is None:
+        return None
+
+    return remember_user(row, row.restaurant_id)
+
+
+def _changed_telegram_ids(session: Session) -> Set[int]:
+    changed = set()
+    for obj in session.dirty:
+        if isinstance(obj, User):
+            state = inspect(obj)
+            if any(state.attrs[column].history.has_changes() for column in TRACKED_COLUMNS):
+                changed.add(obj.telegram_id)
+                # Старый telegram_id тоже мог быть в кэше
+                changed.update(value for value in state.attrs.telegram_id.history.deleted if value is not None)
+    for obj in session.deleted:
+        if isinstance(obj, User):
+            changed.add(obj.telegram_id)
+    return changed
+
+
+def _restaurants_added_or_deleted(session: Session) -> bool:
+    return any(isinstance(obj, Restaurant) for obj in session.new) or \
+        any(isinstance(obj, Restaurant) for obj in session.deleted)
+
+
+@event.listens_for(Session, "before_flush")
+def _collect_changed_users(session: Session, flush_context, instances):
+    # Владелец нового или удаленного ресторана по объекту ресторана не известен без запроса,
+    # а такие изменения редки - сбрасываем кэш целиком
+    if _restaurants_added_or_deleted(session):
+        identity_cache.clear()
+        session.info[_PENDING_CLEAR_KEY] = True
+    changed = _changed_telegram_ids(session)
+    if changed:
+        # Сбрасываем сразу, чтобы эта же сессия не прочитала старый снимок,
+        # и еще раз после фиксации - на случай, если его успели перечитать до коммита
+        for telegram_id in changed:
+            identity_cache.invalidate(telegram_id)
+        session.info.setdefault(_PENDING_KEY, set()).update(changed)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed_users(session: Session):
+    if session.info.pop(_PENDING_CLEAR_KEY, False):
+        identity_cache.clear()
+    for telegram_id in session.info.pop(_PENDING_KEY, ()):
+        identity_cache.invalidate(telegram_id)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _forget_rolled_back_users(session: Session, previous_transaction):
+    session.info.pop(_PENDING_KEY, None)
+    session.info.pop(_PENDING_CLEAR_KEY, None)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _invalidate_on_bulk_update(orm_execute_state):
+    # Массовые UPDATE/DELETE по пользователям не проходят через flush - сбрасываем весь кэш,
+    # если затронуты колонки снимка
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is None or mapper.class_ is not User:
+        return
+    if orm_execute_state.is_update:
+        values = getattr(orm_execute_state.statement, "_values", None) or {}
+        columns = {getattr(key, "key", key) for key in values}
+        if columns and not columns & set(TRACKED_COLUMNS):
+            return
+    logging.debug("Bulk statement on users, clearing identity cache")
+    identity_cache.clear()
@@ -0,0 +1,183 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+from sqlalchemy import event, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from ..models.models import MenuItem, Restaurant
+
+# Сколько меню ресторанов держать в кэше
+MENU_CACHE_SIZE = int(os.getenv("MENU_CACHE_SIZE", "1000"))
+# Время жизни меню в кэше в секундах: страховка от изменений, сделанных другим экземпляром бота
+MENU_CACHE_TTL = float(os.getenv("MENU_CACHE_TTL", "60"))
+
+# Ключ в session.info с id ресторанов, меню которых изменено в текущей транзакции
+_PENDING_KEY = "menu_invalidate"
+
+
+class MenuItemSnapshot:
+    """Снимок позиции меню, не привязанный к сессии БД (общий для всех обновлений, не изменять)"""
+    __slots__ = ("id", "restaurant_id", "name", "photo", "description", "duration", "price_kisses", "price_hugs")
+
+    def __init__(self, item: MenuItem):
+        for name in self.__slots__:
+            setattr(self, name, getattr(item, name))
+
+
+class MenuSnapshot:
+    """
+    Меню ресторана: название ресторана, позиции в порядке добавления и версия меню, с которой оно загружено.
+    В markups складываются готовые клавиатуры этой версии меню, они сбрасываются вместе со снимком.
+    """
+    __slots__ = ("restaurant_id", "restaurant_name", "version", "items", "by_id", "markups", "loaded_at")
+
+    def __init__(self, restaurant_id: int, restaurant_name: str, version: int, items: Tuple[MenuItemSnapshot, ...]):
+        self.restaurant_id = restaurant_id
+        self.restaurant_name = restaurant_name
+        self.version = version
+        self.items = items
+        self.by_id: Dict[int, MenuItemSnapshot] = {item.id: item for item in items}
+        self.markups: Dict[Hashable, Any] = {}
+        self.loaded_at = time.monotonic()
+
+    def get(self, item_id: int) -> Optional[MenuItemSnapshot]:
+        return self.by_id.get(item_id)
+
+    def markup(self, key: Hashable, build: Callable[[], Any]) -> Any:
+        """Клавиатура для этой версии меню: строится один раз и переиспользуется (не изменять)"""
+        markup = self.markups.get(key)
+        if markup is None:
+            markup = self.markups[key] = build()
+        return markup
+
+
+class MenuCache:
+    """
+    Кэш меню ресторанов в памяти процесса.
+    Меню сбрасывается при изменении версии меню (bump_menu_version) этим экземпляром бота,
+    а изменения других экземпляров подхватываются по истечении ttl.
+    """
+
+    def __init__(self, max_entries: int = MENU_CACHE_SIZE, ttl: float = MENU_CACHE_TTL):
+        """
+        :param max_entries: Максимальное количество меню
+        :param ttl: Время жизни меню в секундах
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._menus: "OrderedDict[int, MenuSnapshot]" = OrderedDict()
+        # id позиции -> id ресторана, чтобы находить меню по нажатой позиции
+        self._item_restaurants: Dict[int, int] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._menus)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def get(self, restaurant_id: int) -> Optional[MenuSnapshot]:
+        menu = self._menus.get(restaurant_id)
+        if menu is not None and time.monotonic() - menu.loaded_at < self.ttl:
+            self._menus.move_to_end(restaurant_id)
+            self.hits += 1
+            return menu
+        if menu is not None:
+            self.invalidate(restaurant_id)
+        self.misses += 1
+        return None
+
+    def restaurant_of(self, item_id: int) -> Optional[int]:
+        return self._item_restaurants.get(item_id)
+
+    def put(self, menu: MenuSnapshot):
+        self.invalidate(menu.restaurant_id)
+        self._menus[menu.restaurant_id] = menu
+        for item_id in menu.by_id:
+            self._item_restaurants[item_id] = menu.restaurant_id
+        while len(self._menus) > self.max_entries:
+            _, evicted = self._menus.popitem(last=False)
+            self._forget_items(evicted)
+
+    def invalidate(self, restaurant_id: int):
+        menu = self._menus.pop(restaurant_id, None)
+        if menu is not None:
+            self._forget_items(menu)
+
+    def _forget_items(self, menu: MenuSnapshot):
+        for item_id in menu.by_id:
+            if self._item_restaurants.get(item_id) == menu.restaurant_id:
+                del self._item_restaurants[item_id]
+
+
+menu_cache = MenuCache()
+
+
+async def get_menu(session: AsyncSession, restaurant_id: int) -> Optional[MenuSnapshot]:
+    """Меню ресторана из кэша; при промахе загружается из БД. None - ресторана нет"""
+    menu = menu_cache.get(restaurant_id)
+    if menu is not None:
+        return menu
+
+    result = await session.execute(
+        select(Restaurant.name, Restaurant.menu_version).where(Restaurant.id == restaurant_id)
+    )
+    restaurant = result.first()
+    if restaurant is None:
+        return None
+    result = await session.execute(
+        select(MenuItem).where(MenuItem.restaurant_id == restaurant_id).order_by(MenuItem.id)
+    )
+    items = tuple(MenuItemSnapshot(item) for item in result.scalars())
+    menu = MenuSnapshot(restaurant_id, restaurant.name, restaurant.menu_version, items)
+    menu_cache.put(menu)
+    return menu
+
+
+async def get_menu_item(session: AsyncSession, item_id: int) -> Tuple[Optional[MenuSnapshot], Optional[MenuItemSnapshot]]:
+    """Позиция меню вместе с меню ее ресторана"""
+    restaurant_id = menu_cache.restaurant_of(item_id)
+    if restaurant_id is None:
+        restaurant_id = await session.scalar(select(MenuItem.restaurant_id).where(MenuItem.id == item_id))
+        if restaurant_id is None:
+            return None, None
+
+    menu = await get_menu(session, restaurant_id)
+    if menu is None:
+        return None, None
+    return menu, menu.get(item_id)
+
+
+async def bump_menu_version(session: AsyncSession, restaurant_id: int):
+    """
+    Увеличивает версию меню ресторана. Вызывается в той же транзакции, что и
+    изменение позиции меню, чтобы корзины и кэши со старой версией пересобирались.
+    """
+    await session.execute(
+        update(Restaurant)
+        .where(Restaurant.id == restaurant_id)
+        .values(menu_version=Restaurant.menu_version + 1)
+    )
+    # Сбрасываем сразу и еще раз после фиксации, если меню успели перечитать до коммита
+    forget_menu(session, restaurant_id)
+
+
+def forget_menu(session: AsyncSession, restaurant_id: int):
+    """Сбрасывает кэш меню ресторана (например, при переименовании или удалении ресторана)"""
+    menu_cache.invalidate(restaurant_id)
+    session.info.setdefault(_PENDING_KEY, set()).add(restaurant_id)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed_menus(session: Session):
+    for restaurant_id in session.info.pop(_PENDING_KEY, ()):
+        menu_cache.invalidate(restaurant_id)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _forget_rolled_back_menus(session: Session, previous_transaction):
+    session.info.pop(_PENDING_KEY, None)
@@ -0,0 +1,68 @@
+from typing import Optional
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+from ..models.models import User, Restaurant
+from .identity import UserSnapshot, get_user_snapshot, remember_user
+
+
+class Principal:
+    """
+    Контекст пользователя, от которого пришло обновление.
+    Проверки доступа и навигация отвечают по снимку из identity_cache (identity),
+    а объекты ORM (пользователь, его ресторан, ресторан, к которому он подключен)
+    загружаются лениво - только когда обработчику они действительно нужны.
+    """
+
+    def __init__(self, session: AsyncSession, telegram_id: int):
+        """
+        :param session: Сессия БД текущего обновления
+        :param telegram_id: Telegram ID пользователя
+        """
+        self.session = session
+        self.telegram_id = telegram_id
+        self._identity: Optional[UserSnapshot] = None
+        self._identity_loaded = False
+        self._user: Optional[User] = None
+        self._user_loaded = False
+
+    async def identity(self) -> Optional[UserSnapshot]:
+        """Снимок пользователя (id, владелец ли, id ресторанов) или None, если его еще нет в БД"""
+        if not self._identity_loaded:
+            self._identity = await get_user_snapshot(self.session, self.telegram_id)
+            self._identity_loaded = True
+        return self._identity
+
+    async def user(self) -> Optional[User]:
+        """Пользователь (объект ORM, его можно изменять) вместе с его рестораном"""
+        if not self._user_loaded:
+            result = await self.session.execute(
+                select(User)
+                .where(User.telegram_id == self.telegram_id)
+                .options(joinedload(User.restaurant))
+            )
+            self._user = result.unique().scalar_one_or_none()
+            self._user_loaded = True
+            if self._user is not None:
+                restaurant = self._user.restaurant
+                self._identity = remember_user(self._user, restaurant.id if restaurant else None)
+                self._identity_loaded = True
+        return self._user
+
+    async def restaurant(self) -> Optional[Restaurant]:
+        """Ресторан, которым владеет пользователь"""
+        if self._user_loaded:
+            return self._user.restaurant if self._user else None
+        identity = await self.identity()
+        if not identity or not identity.restaurant_id:
+            return None
+        return await self.session.get(Restaurant, identity.restaurant_id)
+
+    async def connected_restaurant(self) -> Optional[Restaurant]:
+        """Ресторан, к которому подключен пользователь (владелец загружен: .owner)"""
+        identity = await self.identity()
+        if not identity or not identity.current_restaurant_id:
+            return None
+        return await self.session.get(
+            Restaurant, identity.current_restaurant_id, options=[joinedload(Restaurant.owner)]
+        )
@@ -0,0 +1,49 @@
+from contextvars import ContextVar
+from typing import Optional
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+# Обновление, в котором сейчас выполняются запросы (None - фоновые задачи)
+current_update: ContextVar[Optional["UpdateQueries"]] = ContextVar("current_update", default=None)
+
+
+class UpdateQueries:
+    """Счетчик запросов к БД одного обновления"""
+    __slots__ = ("count",)
+
+    def __init__(self):
+        self.count = 0
+
+
+class QueryStats:
+    """Статистика запросов к БД на одно обновление с момента запуска"""
+
+    def __init__(self):
+        self.updates = 0
+        self.queries = 0
+        self.max_queries = 0
+
+    def record(self, count: int):
+        self.updates += 1
+        self.queries += count
+        if count > self.max_queries:
+            self.max_queries = count
+
+    @property
+    def average(self) -> float:
+        return self.queries / self.updates if self.updates else 0.0
+
+
+query_stats = QueryStats()
+
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    counter = current_update.get()
+    if counter is not None:
+        counter.count += 1
+
+
+def install_query_counter(engine: AsyncEngine):
+    """Подключает подсчет запросов к движку (один раз при запуске)"""
+    if not event.contains(engine.sync_engine, "before_cursor_execute", _count_query):
+        event.listen(engine.sync_engine, "before_cursor_execute", _count_query)
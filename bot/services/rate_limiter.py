@@ -0,0 +1,184 @@
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional, Tuple
+
+
+class _LimitState:
+    """Состояние лимита одного ключа"""
+    __slots__ = ("tat", "strikes", "seen_at")
+
+    def __init__(self, now: float):
+        self.tat = now  # теоретическое время прибытия следующего запроса (GCRA)
+        self.strikes = 0  # отклоненные подряд запросы
+        self.seen_at = now
+
+
+class RateLimiter:
+    """
+    Ограничитель частоты запросов по алгоритму GCRA.
+    На каждый ключ хранится одно число вместо списка отметок времени, поэтому проверка
+    выполняется за O(1). Ключи хранятся в LRU по времени последнего запроса, и неактивные
+    ключи вытесняются с начала очереди, так что память ограничена активными пользователями.
+    """
+
+    def __init__(self, rate_limit: int, time_window: float, idle_ttl: Optional[float] = None, max_entries: int = 100000):
+        """
+        :param rate_limit: Максимальное количество запросов за окно
+        :param time_window: Окно в секундах
+        :param idle_ttl: Через сколько секунд без запросов ключ забывается (по умолчанию - окно)
+        :param max_entries: Жесткий предел количества ключей
+        """
+        self.rate_limit = rate_limit
+        self.time_window = time_window
+        self.emission_interval = time_window / rate_limit
+        self.idle_ttl = max(idle_ttl or 0, time_window)
+        self.max_entries = max_entries
+        self._states: "OrderedDict[Hashable, _LimitState]" = OrderedDict()
+
+    def __len__(self):
+        return len(self._states)
+
+    def _evict(self, now: float):
+        states = self._states
+        while states:
+            state = next(iter(states.values()))
+            if now - state.seen_at < self.idle_ttl and len(states) <= self.max_entries:
+                break
+            states.popitem(last=False)
+
+    def hit(self, key: Hashable, cost: float = 1.0, now: Optional[float] = None) -> int:
+        """
+        Учитывает запрос.
+        :param cost: Стоимость запроса в единицах лимита
+        :return: 0, если запрос разрешен, иначе количество отклоненных подряд запросов
+        """
+        now = time.monotonic() if now is None else now
+        state = self._states.get(key)
+        if state is None:
+            state = _LimitState(now)
+            self._states[key] = state
+        else:
+            self._states.move_to_end(key)
+        state.seen_at = now
+
+        tat = max(state.tat, now)
+        new_tat = tat + self.emission_interval * cost
+        if new_tat - now > self.time_window:
+            state.strikes += 1
+            strikes = state.strikes
+        else:
+            state.tat = new_tat
+            state.strikes = 0
+            strikes = 0
+
+        self._evict(now)
+        return strikes
+
+
+class LimiterBackend:
+    """
+    Хранилище состояния лимитов.
+    Проверка и учет запроса выполняются одной атомарной операцией,
+    поэтому несколько экземпляров бота могут делить один бюджет.
+    """
+
+    async def hit(self, key: str, rate_limit: int, time_window: float, cost: float = 1.0) -> int:
+        """
+        Учитывает запрос по ключу.
+        :return: 0, если запрос разрешен, иначе количество отклоненных подряд запросов
+        """
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class MemoryLimiterBackend(LimiterBackend):
+    """
+    Состояние лимитов в памяти процесса.
+    Один экземпляр можно передать нескольким middleware, чтобы в тестах
+    имитировать несколько реплик бота с общим бюджетом.
+    """
+
+    def __init__(self, idle_ttl: Optional[float] = None, max_entries: int = 100000):
+        self.idle_ttl = idle_ttl
+        self.max_entries = max_entries
+        self._limiters: Dict[Tuple[int, float], RateLimiter] = {}
+
+    def _limiter(self, rate_limit: int, time_window: float) -> RateLimiter:
+        limiter = self._limiters.get((rate_limit, time_window))
+        if limiter is None:
+            limiter = RateLimiter(rate_limit, time_window, self.idle_ttl, self.max_entries)
+            self._limiters[(rate_limit, time_window)] = limiter
+        return limiter
+
+    async def hit(self, key: str, rate_limit: int, time_window: float, cost: float = 1.0) -> int:
+        return self._limiter(rate_limit, time_window).hit(key, cost)
+
+
+# GCRA в Redis: чтение, проверка и запись состояния за один вызов скрипта.
+# Используется время сервера Redis, чтобы не зависеть от часов экземпляров бота.
+GCRA_SCRIPT = """
+local emission = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tat', 'strikes')
+local tat = math.max(tonumber(state[1]) or now, now)
+local strikes = tonumber(state[2]) or 0
+local new_tat = tat + emission * cost
+if new_tat - now > window then
+    strikes = strikes + 1
+    redis.call('HSET', KEYS[1], 'strikes', strikes)
+else
+    strikes = 0
+    tat = new_tat
+    redis.call('HSET', KEYS[1], 'tat', string.format('%.6f', tat), 'strikes', 0)
+end
+redis.call('PEXPIRE', KEYS[1], math.ceil((tat - now + window) * 1000))
+return strikes
+"""
+
+
+class RedisLimiterBackend(LimiterBackend):
+    """
+    Общее для всех экземпляров бота состояние лимитов в Redis.
+    Каждая проверка - один вызов Lua-скрипта (один сетевой запрос), ключи истекают сами.
+    При недоступности Redis запросы учитываются локально, чтобы бот продолжал работать.
+    """
+
+    def __init__(self, redis_url: str, prefix: str = "ratelimit"):
+        from redis.asyncio import Redis
+
+        self.redis = Redis.from_url(redis_url)
+        self.prefix = prefix
+        self._script = self.redis.register_script(GCRA_SCRIPT)
+        self._fallback = MemoryLimiterBackend()
+
+    async def hit(self, key: str, rate_limit: int, time_window: float, cost: float = 1.0) -> int:
+        try:
+            strikes = await self._script(
+                keys=[f"{self.prefix}:{key}"],
+                args=[time_window / rate_limit, time_window, cost]
+            )
+            return int(strikes)
+        except Exception as e:
+            logging.error(f"Rate limiter Redis error, using local limits: {e}")
+            return await self._fallback.hit(key, rate_limit, time_window, cost)
+
+    async def close(self):
+        await self.redis.aclose()
+
+
+def create_limiter_backend() -> LimiterBackend:
+    """Redis, если задан REDIS_URL и установлен клиент redis, иначе память процесса"""
+    redis_url = os.getenv("REDIS_URL")
+    if redis_url:
+        try:
+            return RedisLimiterBackend(redis_url)
+        except ImportError:
+            logging.warning("REDIS_URL is set but redis package is not installed, using in-memory rate limits")
+    return MemoryLimiterBackend()
@@ -0,0 +1,54 @@
+import time
+from datetime import datetime
+from typing import Dict, Iterable
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..models.models import User
+
+# Как долго не проверять повторно пользователя, от которого уже приходили обновления
+SEEN_TTL = 600
+SEEN_MAX_ENTRIES = 50000
+
+# telegram_id -> время последней проверки флага недоступности
+_recently_seen: Dict[int, float] = {}
+
+
+def mark_unreachable_stmt(user_ids: Iterable[int]):
+    """Запрос, помечающий пользователей недоступными (для записи в общей транзакции)"""
+    return (
+        update(User)
+        .where(User.id.in_(list(user_ids)), User.unreachable_at.is_(None))
+        .values(unreachable_at=datetime.now())
+    )
+
+
+def forget(telegram_id: int):
+    """Сбрасывает отметку о недавней активности, чтобы следующее обновление снова сняло флаг"""
+    _recently_seen.pop(telegram_id, None)
+
+
+async def restore_reachability(session: AsyncSession, telegram_id: int) -> bool:
+    """
+    Снимает флаг недоступности с пользователя, от которого пришло обновление.
+    Запрос к БД выполняется не чаще раза в SEEN_TTL секунд для одного пользователя
+    и меняет строку только если флаг действительно установлен.
+    Запрос выполняется в сессии обновления, ее фиксирует DbSessionMiddleware.
+    :return: True, если флаг был снят
+    """
+    now = time.monotonic()
+    seen_at = _recently_seen.get(telegram_id)
+    if seen_at is not None and now - seen_at < SEEN_TTL:
+        return False
+    _recently_seen[telegram_id] = now
+
+    # Чистим устаревшие записи, чтобы словарь не рос бесконечно
+    if len(_recently_seen) > SEEN_MAX_ENTRIES:
+        for key in [key for key, value in _recently_seen.items() if now - value >= SEEN_TTL]:
+            del _recently_seen[key]
+
+    result = await session.execute(
+        update(User)
+        .where(User.telegram_id == telegram_id, User.unreachable_at.isnot(None))
+        .values(unreachable_at=None)
+    )
+    return result.rowcount > 0
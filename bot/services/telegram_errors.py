@@ -0,0 +1,104 @@
+import asyncio
+import re
+from collections import Counter
+from typing import Optional
+from aiogram.exceptions import (
+    TelegramAPIError,
+    TelegramRetryAfter,
+    TelegramForbiddenError,
+    TelegramBadRequest,
+    TelegramNotFound,
+    TelegramNetworkError,
+    TelegramServerError,
+)
+
+# Типы ошибок отправки сообщения
+RETRY_AFTER = "retry_after"  # Flood wait (429), нужно подождать retry_after секунд
+BLOCKED = "blocked"  # Пользователь заблокировал бота или удалил аккаунт
+CHAT_NOT_FOUND = "chat_not_found"  # Чат не существует
+TRANSIENT = "transient"  # Временная ошибка сети или сервера Telegram, можно повторить
+FAILED = "failed"  # Прочие ошибки, повтор не поможет
+
+
+def classify_send_error(error: Exception) -> str:
+    """Определяет тип ошибки отправки сообщения"""
+    if isinstance(error, TelegramRetryAfter):
+        return RETRY_AFTER
+    if isinstance(error, TelegramForbiddenError):
+        return BLOCKED
+    if isinstance(error, (TelegramNotFound, TelegramBadRequest)):
+        if "chat not found" in error.message.lower():
+            return CHAT_NOT_FOUND
+        return FAILED
+    if isinstance(error, (TelegramNetworkError, TelegramServerError, asyncio.TimeoutError, ConnectionError)):
+        return TRANSIENT
+    return FAILED
+
+
+# Некритичные ошибки обработчиков: о них не нужно уведомлять администратора
+NOT_MODIFIED = "not_modified"  # Редактирование сообщения без изменений
+QUERY_EXPIRED = "query_expired"  # Callback-запрос устарел
+MESSAGE_GONE = "message_gone"  # Сообщение для редактирования/удаления уже удалено
+
+HANDLER_ERROR_LABELS = {
+    NOT_MODIFIED: "редактирование без изменений",
+    QUERY_EXPIRED: "устаревшие callback-запросы",
+    MESSAGE_GONE: "сообщение уже удалено",
+    BLOCKED: "пользователь заблокировал бота",
+}
+
+# Некритичные ошибки по классу исключения
+_ERRORS_BY_TYPE = {
+    TelegramForbiddenError: BLOCKED,
+}
+
+# Некритичные ошибки 400 Bad Request по началу описания Telegram API (до первого ":")
+_BAD_REQUEST_DESCRIPTIONS = {
+    "message is not modified": NOT_MODIFIED,
+    "query is too old and response timeout expired or query id is invalid": QUERY_EXPIRED,
+    "message to edit not found": MESSAGE_GONE,
+    "message to delete not found": MESSAGE_GONE,
+    "message can't be deleted": MESSAGE_GONE,
+    "message can't be deleted for everyone": MESSAGE_GONE,
+    "message can't be edited": MESSAGE_GONE,
+}
+
+# Запасной вариант для описаний, которые Telegram формулирует иначе
+_BAD_REQUEST_PATTERN = re.compile(
+    r"(?P<not_modified>message is not modified)"
+    r"|(?P<query_expired>query is too old|query id is invalid)"
+    r"|(?P<message_gone>message to (?:edit|delete) not found|message can't be (?:deleted|edited))",
+    re.IGNORECASE
+)
+
+# Количество некритичных ошибок каждого типа с момента запуска
+handler_error_counts: Counter = Counter()
+
+
+def _bad_request_kind(message: str) -> Optional[str]:
+    description = message.lower()
+    if description.startswith("bad request: "):
+        description = description[len("bad request: "):]
+    kind = _BAD_REQUEST_DESCRIPTIONS.get(description.split(":", 1)[0].strip())
+    if kind:
+        return kind
+    match = _BAD_REQUEST_PATTERN.search(message)
+    return match.lastgroup if match else None
+
+
+def classify_handler_error(error: Exception) -> Optional[str]:
+    """
+    Определяет тип некритичной ошибки обработчика.
+    Ошибки, не относящиеся к Telegram API, отсекаются одной проверкой типа.
+    :return: Тип некритичной ошибки или None, если ошибка критичная
+    """
+    if not isinstance(error, TelegramAPIError):
+        return None
+
+    kind = _ERRORS_BY_TYPE.get(type(error))
+    if kind is None and isinstance(error, TelegramBadRequest):
+        kind = _bad_request_kind(error.message)
+
+    if kind:
+        handler_error_counts[kind] += 1
+    return kind
@@ -0,0 +1,45 @@
+"""Add broadcast delivery checkpoint
+
+Revision ID: broadcast_checkpoint
+Revises: broadcast_delivery_settings
+Create Date: 2026-10-18
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'broadcast_checkpoint'
+down_revision: Union[str, None] = 'broadcast_delivery_settings'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+def upgrade() -> None:
+    # Курсор доставки для продолжения рассылки после перезапуска
+    op.add_column('broadcasts', sa.Column('last_user_id', sa.Integer(), nullable=True))
+    
+    # Раньше ограничения не было: оставляем по одной записи на получателя рассылки,
+    # иначе уникальный индекс не создастся
+    op.execute(
+        """
+        DELETE FROM broadcast_recipients a
+        USING broadcast_recipients b
+        WHERE a.id > b.id
+          AND a.broadcast_id = b.broadcast_id
+          AND a.user_id = b.user_id
+        """
+    )
+    
+    # Быстрая проверка "уже получил" и защита от повторной записи получателя
+    op.create_index(
+        'ix_broadcast_recipients_broadcast_user',
+        'broadcast_recipients',
+        ['broadcast_id', 'user_id'],
+        unique=True
+    )
+
+def downgrade() -> None:
+    op.drop_index('ix_broadcast_recipients_broadcast_user', table_name='broadcast_recipients')
+    op.drop_column('broadcasts', 'last_user_id')
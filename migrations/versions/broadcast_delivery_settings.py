@@ -0,0 +1,26 @@
+"""Add per-broadcast delivery settings
+
+Revision ID: broadcast_delivery_settings
+Revises: 70c2d98dba91
+Create Date: 2026-10-18
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'broadcast_delivery_settings'
+down_revision: Union[str, None] = '70c2d98dba91'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+def upgrade() -> None:
+    # Скорость и параллельность отправки для конкретной рассылки
+    op.add_column('broadcasts', sa.Column('rate_limit', sa.Integer(), nullable=True))
+    op.add_column('broadcasts', sa.Column('concurrency', sa.Integer(), nullable=True))
+
+def downgrade() -> None:
+    op.drop_column('broadcasts', 'concurrency')
+    op.drop_column('broadcasts', 'rate_limit')
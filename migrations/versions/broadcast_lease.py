@@ -0,0 +1,26 @@
+"""Add broadcast lease columns
+
+Revision ID: broadcast_lease
+Revises: broadcast_segments
+Create Date: 2026-10-18
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'broadcast_lease'
+down_revision: Union[str, None] = 'broadcast_segments'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+def upgrade() -> None:
+    # Аренда рассылки экземпляром бота, чтобы несколько реплик не отправляли одну рассылку
+    op.add_column('broadcasts', sa.Column('claimed_by', sa.String(length=64), nullable=True))
+    op.add_column('broadcasts', sa.Column('heartbeat_at', sa.DateTime(), nullable=True))
+
+def downgrade() -> None:
+    op.drop_column('broadcasts', 'heartbeat_at')
+    op.drop_column('broadcasts', 'claimed_by')
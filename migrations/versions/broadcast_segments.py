@@ -0,0 +1,39 @@
+"""Add broadcast audience segments
+
+Revision ID: broadcast_segments
+Revises: user_reachability
+Create Date: 2026-10-18
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'broadcast_segments'
+down_revision: Union[str, None] = 'user_reachability'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+def upgrade() -> None:
+    # Сегмент аудитории рассылки
+    op.add_column('broadcasts', sa.Column('segment', sa.String(length=20), nullable=True, server_default='all'))
+    op.add_column('broadcasts', sa.Column('segment_days', sa.Integer(), nullable=True))
+    
+    # Индексы для выборки сегментов
+    op.create_index(op.f('ix_users_current_restaurant_id'), 'users', ['current_restaurant_id'], unique=False)
+    op.create_index(op.f('ix_users_last_activity'), 'users', ['last_activity'], unique=False)
+    op.create_index(
+        'ix_users_owners_id',
+        'users',
+        ['id'],
+        postgresql_where=sa.text('is_restaurant_owner IS true')
+    )
+
+def downgrade() -> None:
+    op.drop_index('ix_users_owners_id', table_name='users')
+    op.drop_index(op.f('ix_users_last_activity'), table_name='users')
+    op.drop_index(op.f('ix_users_current_restaurant_id'), table_name='users')
+    op.drop_column('broadcasts', 'segment_days')
+    op.drop_column('broadcasts', 'segment')
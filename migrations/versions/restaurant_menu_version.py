@@ -0,0 +1,24 @@
+"""Add restaurant menu version
+
+Revision ID: restaurant_menu_version
+Revises: broadcast_lease
+Create Date: 2026-10-18
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'restaurant_menu_version'
+down_revision: Union[str, None] = 'broadcast_lease'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+def upgrade() -> None:
+    # Версия меню: корзины хранят снимок цен и сверяют его с версией при оформлении заказа
+    op.add_column('restaurants', sa.Column('menu_version', sa.Integer(), nullable=False, server_default='1'))
+
+def downgrade() -> None:
+    op.drop_column('restaurants', 'menu_version')
@@ -0,0 +1,33 @@
+"""Add user reachability flag
+
+Revision ID: user_reachability
+Revises: broadcast_checkpoint
+Create Date: 2026-10-18
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'user_reachability'
+down_revision: Union[str, None] = 'broadcast_checkpoint'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+def upgrade() -> None:
+    # Пользователи, заблокировавшие бота, не попадают в рассылки
+    op.add_column('users', sa.Column('unreachable_at', sa.DateTime(), nullable=True))
+    
+    # Частичный индекс по доступным пользователям для выборки аудитории рассылок
+    op.create_index(
+        'ix_users_reachable_id',
+        'users',
+        ['id'],
+        postgresql_where=sa.text('telegram_id IS NOT NULL AND unreachable_at IS NULL')
+    )
+
+def downgrade() -> None:
+    op.drop_index('ix_users_reachable_id', table_name='users')
+    op.drop_column('users', 'unreachable_at')